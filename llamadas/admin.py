@@ -1,12 +1,14 @@
 from django.contrib import admin
-from .models import Llamada, MensajeConversacion
+from . import busqueda
+from .models import Llamada, MensajeConversacion, ConversacionArchivada, EstadisticaLlamadas, TiempoTurno, Campana, NumeroCampana
 
 
 @admin.register(Llamada)
 class LlamadaAdmin(admin.ModelAdmin):
     list_display = ['sid', 'numero_destino', 'estado', 'duracion', 'fecha_creacion']
     list_filter = ['estado', 'fecha_creacion']
-    search_fields = ['sid', 'numero_destino', 'transcripcion']
+    # La transcripción se busca con el índice de texto completo de los mensajes
+    search_fields = ['sid', 'numero_destino']
     readonly_fields = ['sid', 'fecha_creacion', 'fecha_inicio', 'fecha_fin']
     
     fieldsets = (
@@ -23,12 +25,85 @@ class LlamadaAdmin(admin.ModelAdmin):
             'fields': ('transcripcion', 'notas')
         }),
     )
+    
+    def get_search_results(self, request, queryset, search_term):
+        resultados, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if search_term:
+            # queryset ya trae los filtros de la lista aplicados
+            resultados |= queryset.filter(busqueda.filtro_llamadas(search_term))
+        return resultados, may_have_duplicates
 
 
 @admin.register(MensajeConversacion)
 class MensajeConversacionAdmin(admin.ModelAdmin):
     list_display = ['llamada', 'tipo', 'timestamp']
     list_filter = ['tipo', 'timestamp']
-    search_fields = ['contenido', 'llamada__sid']
+    # contenido se busca con el índice de texto completo (ver busqueda.py)
+    search_fields = ['llamada__sid']
     readonly_fields = ['timestamp']
+    
+    def get_search_results(self, request, queryset, search_term):
+        resultados, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if search_term:
+            # queryset ya trae los filtros de la lista aplicados
+            resultados |= queryset.filter(busqueda.filtro_mensajes(search_term))
+        return resultados, may_have_duplicates
+
+
+@admin.register(ConversacionArchivada)
+class ConversacionArchivadaAdmin(admin.ModelAdmin):
+    list_display = ['llamada', 'formato', 'mensajes', 'bytes_original', 'fecha']
+    list_filter = ['formato']
+    search_fields = ['llamada__sid']
+    # El contenido se ve descomprimido en el detalle de la llamada
+    exclude = ['datos']
+    readonly_fields = ['llamada', 'formato', 'mensajes', 'bytes_original', 'fecha']
+
+
+@admin.register(EstadisticaLlamadas)
+class EstadisticaLlamadasAdmin(admin.ModelAdmin):
+    list_display = ['hora', 'estado', 'numero_origen', 'llamadas', 'duracion_total']
+    list_filter = ['estado']
+    date_hierarchy = 'hora'
+    # Se mantienen desde los webhooks y recalcular_estadisticas
+    readonly_fields = ['hora', 'estado', 'numero_origen', 'llamadas', 'duracion_total']
+
+
+@admin.register(TiempoTurno)
+class TiempoTurnoAdmin(admin.ModelAdmin):
+    list_display = ['llamada', 'turno', 'total', 'etapas', 'fecha']
+    date_hierarchy = 'fecha'
+    # Los más lentos primero
+    ordering = ['-total']
+    readonly_fields = ['llamada', 'turno', 'total', 'etapas', 'fecha']
+
+
+@admin.register(Campana)
+class CampanaAdmin(admin.ModelAdmin):
+    list_display = ['nombre', 'estado', 'total_numeros', 'pendientes', 'en_curso', 'completadas', 'fallidas', 'fecha_creacion']
+    list_filter = ['estado', 'fecha_creacion']
+    search_fields = ['nombre']
+    readonly_fields = ['total_numeros', 'pendientes', 'en_curso', 'completadas', 'fallidas', 'fecha_creacion', 'fecha_inicio', 'fecha_fin']
+    
+    fieldsets = (
+        ('Campaña', {
+            'fields': ('nombre', 'estado')
+        }),
+        ('Límites', {
+            'fields': ('llamadas_por_segundo', 'max_llamadas_activas', 'max_intentos', 'espera_reintento')
+        }),
+        ('Progreso', {
+            'fields': ('total_numeros', 'pendientes', 'en_curso', 'completadas', 'fallidas')
+        }),
+        ('Fechas', {
+            'fields': ('fecha_creacion', 'fecha_inicio', 'fecha_fin')
+        }),
+    )
+
 
+@admin.register(NumeroCampana)
+class NumeroCampanaAdmin(admin.ModelAdmin):
+    list_display = ['numero', 'campana', 'estado', 'intentos', 'proximo_intento', 'ultimo_resultado']
+    list_filter = ['estado']
+    search_fields = ['numero']
+    raw_id_fields = ['campana', 'llamada']
@@ -0,0 +1,242 @@
+"""
+API JSON de solo lectura para llamadas y mensajes
+
+    GET /api/llamadas/?limite=50&cursor=...&campos=sid,estado&estado=completada,fallida
+    GET /api/llamadas/<id>/?campos=sid,transcripcion
+    GET /api/llamadas/<id>/mensajes/?limite=100&cursor=...
+    GET /api/buscar/?q=pedido+retrasado&pagina=1&limite=20
+    GET /api/exportar/?formato=csv&desde=2024-01-01&hasta=2024-01-31&estado=completada
+
+Los listados se paginan por cursor (keyset) sobre (fecha_creacion, id) para
+las llamadas y (timestamp, id) para los mensajes: cada página es un WHERE
+sobre el índice a partir de la última fila de la anterior, en lugar de un
+OFFSET que recorre todas las filas previas, así que el tiempo de respuesta no
+crece con el tamaño de las tablas. La respuesta trae "siguiente", el cursor
+de la página siguiente (null en la última).
+
+La búsqueda devuelve mensajes ordenados por relevancia usando el índice de
+texto completo (ver busqueda.py); como el orden es por rango y no por una
+columna, se pagina por número de página.
+
+La exportación devuelve todas las llamadas del filtro con sus mensajes como
+CSV o JSONL en streaming, sin paginar (ver exportacion.py).
+
+"campos" elige las columnas; por defecto los listados no incluyen
+transcripcion ni notas, que pueden ser muy grandes. Toda petición debe traer
+la cabecera "Authorization: Bearer <settings.API_TOKEN>"; sin API_TOKEN
+configurado la API responde 404, nunca queda abierta.
+"""
+import base64
+from functools import wraps
+
+from django.conf import settings
+from django.db.models import Q
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.crypto import constant_time_compare
+from django.utils.dateparse import parse_datetime
+
+from . import exportacion
+from .busqueda import buscar_mensajes
+from .models import Llamada, MensajeConversacion
+
+
+CAMPOS_LLAMADA = (
+    'id', 'sid', 'numero_destino', 'numero_origen', 'estado', 'duracion',
+    'fecha_creacion', 'fecha_inicio', 'fecha_fin', 'transcripcion', 'notas',
+)
+# Columnas de texto potencialmente enormes: solo si se piden explícitamente en los listados
+CAMPOS_GRANDES = ('transcripcion', 'notas')
+CAMPOS_LISTA = tuple(campo for campo in CAMPOS_LLAMADA if campo not in CAMPOS_GRANDES)
+CAMPOS_MENSAJE = ('id', 'tipo', 'contenido', 'timestamp')
+
+LIMITE_DEFECTO = 50
+LIMITE_MAXIMO = 200
+
+ESTADOS_VALIDOS = {estado for estado, _ in Llamada.ESTADO_CHOICES}
+
+
+class ErrorAPI(Exception):
+    """Error con el código HTTP que se devuelve al cliente"""
+
+    def __init__(self, mensaje, status=400):
+        super().__init__(mensaje)
+        self.status = status
+
+
+def vista_api(view_func):
+    """
+    Solo GET, token obligatorio (settings.API_TOKEN) y ErrorAPI -> respuesta JSON
+
+    Sin API_TOKEN configurado la vista responde 404: la API y /metrics exponen
+    datos de las llamadas y no deben quedar abiertas por olvidar la variable
+    """
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        if not settings.API_TOKEN:
+            return JsonResponse({'error': 'No encontrado'}, status=404)
+        if request.method != 'GET':
+            return JsonResponse({'error': 'Método no permitido'}, status=405)
+        cabecera = request.headers.get('Authorization', '')
+        if not constant_time_compare(cabecera, f"Bearer {settings.API_TOKEN}"):
+            return JsonResponse({'error': 'No autorizado'}, status=401)
+        try:
+            return view_func(request, *args, **kwargs)
+        except ErrorAPI as e:
+            return JsonResponse({'error': str(e)}, status=e.status)
+    return wrapper
+
+
+def codificar_cursor(fecha, pk):
+    valor = f"{fecha.isoformat()}|{pk}".encode('utf-8')
+    return base64.urlsafe_b64encode(valor).decode('ascii').rstrip('=')
+
+
+def decodificar_cursor(cursor):
+    """
+    (fecha, id) de la última fila de la página anterior
+    """
+    try:
+        relleno = '=' * (-len(cursor) % 4)
+        fecha, pk = base64.urlsafe_b64decode(cursor + relleno).decode('utf-8').split('|')
+        fecha = parse_datetime(fecha)
+        if fecha is None:
+            raise ValueError(cursor)
+        return fecha, int(pk)
+    except (ValueError, UnicodeDecodeError):
+        raise ErrorAPI('Cursor inválido')
+
+
+def _limite(request):
+    try:
+        limite = int(request.GET.get('limite', LIMITE_DEFECTO))
+    except ValueError:
+        raise ErrorAPI('limite debe ser un número')
+    return max(1, min(limite, LIMITE_MAXIMO))
+
+
+def _pagina(request):
+    try:
+        return max(1, int(request.GET.get('pagina', 1)))
+    except ValueError:
+        raise ErrorAPI('pagina debe ser un número')
+
+
+def _campos(request, permitidos, defecto):
+    pedidos = [campo.strip() for campo in request.GET.get('campos', '').split(',') if campo.strip()]
+    if not pedidos:
+        return list(defecto)
+    invalidos = [campo for campo in pedidos if campo not in permitidos]
+    if invalidos:
+        raise ErrorAPI(f"Campos desconocidos: {', '.join(invalidos)}")
+    return pedidos
+
+
+def paginar(queryset, campo_orden, campos, cursor, limite, descendente=False):
+    """
+    Una página por keyset sobre (campo_orden, id)
+
+    Args:
+        queryset: QuerySet ya filtrado
+        campo_orden: Campo de fecha por el que se ordena
+        campos: Columnas a devolver
+        cursor: Cursor de la página anterior, o '' para la primera
+        limite: Filas por página
+        descendente: Más recientes primero
+
+    Returns:
+        (filas, cursor_siguiente): cursor_siguiente es None en la última página
+    """
+    if cursor:
+        fecha, pk = decodificar_cursor(cursor)
+        comparacion = 'lt' if descendente else 'gt'
+        queryset = queryset.filter(
+            Q(**{f"{campo_orden}__{comparacion}": fecha}) | Q(**{campo_orden: fecha, f"id__{comparacion}": pk})
+        )
+    orden = (f"-{campo_orden}", '-id') if descendente else (campo_orden, 'id')
+    # El cursor necesita la fecha y el id aunque no se hayan pedido
+    columnas = list(dict.fromkeys(list(campos) + [campo_orden, 'id']))
+    filas = list(queryset.order_by(*orden).values(*columnas)[:limite + 1])
+
+    siguiente = None
+    if len(filas) > limite:
+        filas = filas[:limite]
+        siguiente = codificar_cursor(filas[-1][campo_orden], filas[-1]['id'])
+    sobrantes = set(columnas) - set(campos)
+    if sobrantes:
+        filas = [{k: v for k, v in fila.items() if k not in sobrantes} for fila in filas]
+    return filas, siguiente
+
+
+@vista_api
+def llamadas_lista(request):
+    """Llamadas, de la más reciente a la más antigua"""
+    queryset = Llamada.objects.all()
+    estados = [estado for estado in request.GET.get('estado', '').split(',') if estado]
+    if estados:
+        if not set(estados) <= ESTADOS_VALIDOS:
+            raise ErrorAPI(f"Estado inválido; válidos: {', '.join(sorted(ESTADOS_VALIDOS))}")
+        queryset = queryset.filter(estado__in=estados)
+
+    filas, siguiente = paginar(
+        queryset, 'fecha_creacion', _campos(request, CAMPOS_LLAMADA, CAMPOS_LISTA),
+        request.GET.get('cursor', ''), _limite(request), descendente=True,
+    )
+    return JsonResponse({'resultados': filas, 'siguiente': siguiente})
+
+
+@vista_api
+def llamada_detalle(request, llamada_id):
+    """Una llamada; por defecto con todos los campos"""
+    fila = Llamada.objects.filter(pk=llamada_id).values(*_campos(request, CAMPOS_LLAMADA, CAMPOS_LLAMADA)).first()
+    if fila is None:
+        raise ErrorAPI('Llamada no encontrada', status=404)
+    return JsonResponse(fila)
+
+
+@vista_api
+def llamada_mensajes(request, llamada_id):
+    """Mensajes de una llamada en orden cronológico"""
+    if not Llamada.objects.filter(pk=llamada_id).exists():
+        raise ErrorAPI('Llamada no encontrada', status=404)
+    filas, siguiente = paginar(
+        MensajeConversacion.objects.filter(llamada_id=llamada_id), 'timestamp',
+        _campos(request, CAMPOS_MENSAJE, CAMPOS_MENSAJE), request.GET.get('cursor', ''), _limite(request),
+    )
+    return JsonResponse({'resultados': filas, 'siguiente': siguiente})
+
+
+@vista_api
+def buscar(request):
+    """Mensajes que contienen el texto "q", del más relevante al menos relevante"""
+    texto = request.GET.get('q', '').strip()
+    if not texto:
+        raise ErrorAPI('Falta el parámetro q')
+    limite, pagina = _limite(request), _pagina(request)
+    filas = buscar_mensajes(texto, limite + 1, (pagina - 1) * limite)
+    return JsonResponse({
+        'resultados': filas[:limite],
+        'pagina': pagina,
+        'siguiente': pagina + 1 if len(filas) > limite else None,
+    })
+
+
+@vista_api
+def exportar(request):
+    """Llamadas con sus mensajes en CSV o JSONL, en streaming"""
+    formato = request.GET.get('formato', 'csv')
+    if formato not in exportacion.FORMATOS:
+        raise ErrorAPI(f"formato debe ser uno de: {', '.join(exportacion.FORMATOS)}")
+    estados = [estado for estado in request.GET.get('estado', '').split(',') if estado]
+    try:
+        llamadas = exportacion.filtrar_llamadas(request.GET.get('desde', ''), request.GET.get('hasta', ''), estados)
+    except ValueError as e:
+        raise ErrorAPI(str(e))
+
+    contenido = exportacion.generar(formato, llamadas)
+    if isinstance(request, ASGIRequest):
+        contenido = exportacion.generar_async(contenido)
+    tipo = 'text/csv' if formato == 'csv' else 'application/x-ndjson'
+    respuesta = StreamingHttpResponse(contenido, content_type=f"{tipo}; charset=utf-8")
+    respuesta['Content-Disposition'] = f'attachment; filename="llamadas.{formato}"'
+    return respuesta
@@ -5,3 +5,5 @@ class LlamadasConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'llamadas'
 
+    def ready(self):
+        from . import checks  # noqa: F401  (registra las comprobaciones)
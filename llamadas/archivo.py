@@ -0,0 +1,171 @@
+"""
+Archivo de conversaciones antiguas
+
+MensajeConversacion guarda una fila por frase para siempre, y
+Llamada.transcripcion repite el mismo texto. Pasados ARCHIVO_DIAS días desde
+que se creó una llamada terminada, sus mensajes se compactan en una sola fila
+de ConversacionArchivada (JSON comprimido con gzip, o zstd si está instalado
+`zstandard` y ARCHIVO_COMPRESION='zstd'); después se borran las filas de
+mensajes y se vacía la transcripción de las llamadas que tenían mensajes. Las tablas e índices calientes solo
+contienen las conversaciones recientes.
+
+detalle_llamada lee los mensajes con mensajes_llamada() y
+transcripcion_llamada(), que descomprimen el archivo si hace falta, así que
+una llamada archivada se ve igual que antes. Los mensajes archivados ya no
+aparecen en la búsqueda de texto completo.
+
+El archivado lo hace el comando archivar_conversaciones, por lotes de llamadas.
+"""
+import gzip
+import json
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .estadisticas import ESTADOS_FINALES
+from .models import ConversacionArchivada, Llamada, MensajeConversacion
+from .persistencia import construir_transcripcion
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def formato_compresion():
+    """
+    'zstd' si se pidió y está disponible; si no, 'gzip'
+    """
+    if settings.ARCHIVO_COMPRESION == 'zstd' and zstandard is not None:
+        return 'zstd'
+    return 'gzip'
+
+
+def comprimir(mensajes, formato='gzip'):
+    """
+    Args:
+        mensajes: Lista de diccionarios con tipo, contenido y timestamp (ISO 8601)
+        formato: 'gzip' o 'zstd'
+
+    Returns:
+        (bytes comprimidos, tamaño del JSON sin comprimir)
+    """
+    crudo = json.dumps(mensajes, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    if formato == 'zstd':
+        return zstandard.ZstdCompressor(level=10).compress(crudo), len(crudo)
+    return gzip.compress(crudo, compresslevel=6), len(crudo)
+
+
+def descomprimir(datos, formato='gzip'):
+    datos = bytes(datos)
+    if formato == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("El archivo está comprimido con zstd y el paquete zstandard no está instalado")
+        crudo = zstandard.ZstdDecompressor().decompress(datos)
+    else:
+        crudo = gzip.decompress(datos)
+    return json.loads(crudo)
+
+
+def llamadas_para_archivar(dias=None):
+    """
+    Llamadas terminadas hace más de `dias` días (ARCHIVO_DIAS) que todavía no están archivadas
+    """
+    dias = settings.ARCHIVO_DIAS if dias is None else dias
+    limite = timezone.now() - timezone.timedelta(days=dias)
+    return Llamada.objects.filter(
+        estado__in=ESTADOS_FINALES, fecha_creacion__lt=limite, archivo__isnull=True,
+    )
+
+
+def archivar_llamadas(ids, formato=None):
+    """
+    Compacta los mensajes de un lote de llamadas y borra las filas calientes
+
+    Todo el lote, lectura incluida, va en una transacción: si algo falla no
+    queda ninguna llamada a medio archivar, y un mensaje guardado después de
+    la lectura no se borra (queda caliente, detrás de los archivados). Cada
+    llamada recibe su fila de archivo, también las que no tienen mensajes (un
+    archivo vacío que las marca como procesadas para que llamadas_para_archivar
+    no vuelva a elegirlas); esas conservan su transcripción, porque no habría
+    de dónde reconstruirla.
+
+    Args:
+        ids: IDs de Llamada
+        formato: 'gzip' o 'zstd' (por defecto formato_compresion())
+
+    Returns:
+        (mensajes archivados, bytes sin comprimir, bytes comprimidos)
+    """
+    formato = formato or formato_compresion()
+    with transaction.atomic():
+        # Las filas de Llamada bloqueadas frenan a quien guarde un turno del
+        # lote mientras tanto; además solo se borran los mensajes leídos
+        llamadas = list(Llamada.objects.select_for_update().filter(pk__in=ids).values_list('pk', flat=True))
+        filas = (
+            MensajeConversacion.objects.filter(llamada_id__in=llamadas)
+            .order_by('llamada_id', 'timestamp', 'pk')
+            .values_list('pk', 'llamada_id', 'tipo', 'contenido', 'timestamp')
+        )
+        leidos, por_llamada = [], {}
+        for pk, llamada_id, tipo, contenido, fecha in filas:
+            leidos.append(pk)
+            por_llamada.setdefault(llamada_id, []).append(
+                {'tipo': tipo, 'contenido': contenido, 'timestamp': fecha.isoformat()}
+            )
+
+        archivos, total_original, total_comprimido = [], 0, 0
+        for llamada_id in llamadas:
+            mensajes = por_llamada.get(llamada_id, [])
+            datos, original = comprimir(mensajes, formato)
+            archivos.append(ConversacionArchivada(
+                llamada_id=llamada_id, formato=formato, datos=datos,
+                mensajes=len(mensajes), bytes_original=original,
+            ))
+            total_original += original
+            total_comprimido += len(datos)
+
+        ConversacionArchivada.objects.bulk_create(archivos)
+        # Sin señales ni cascadas: un solo DELETE ... WHERE id IN (...)
+        borrados, _ = MensajeConversacion.objects.filter(pk__in=leidos).delete()
+        Llamada.objects.filter(pk__in=list(por_llamada)).update(transcripcion='')
+    return borrados, total_original, total_comprimido
+
+
+def _archivo(llamada):
+    try:
+        return llamada.archivo
+    except ConversacionArchivada.DoesNotExist:
+        return None
+
+
+def mensajes_llamada(llamada):
+    """
+    Mensajes de la llamada en orden, incluidos los archivados (como instancias
+    de MensajeConversacion sin guardar)
+    """
+    mensajes = []
+    archivo = _archivo(llamada)
+    if archivo is not None:
+        mensajes = [
+            MensajeConversacion(
+                llamada=llamada, tipo=mensaje['tipo'], contenido=mensaje['contenido'],
+                timestamp=parse_datetime(mensaje['timestamp']),
+            )
+            for mensaje in descomprimir(archivo.datos, archivo.formato)
+        ]
+    mensajes.extend(MensajeConversacion.objects.filter(llamada=llamada).order_by('timestamp', 'pk'))
+    return mensajes
+
+
+def transcripcion_llamada(llamada, mensajes=None):
+    """
+    Llamada.transcripcion, o la reconstruida desde el archivo si ya se vació
+    """
+    if llamada.transcripcion or _archivo(llamada) is None:
+        return llamada.transcripcion
+    if mensajes is None:
+        mensajes = mensajes_llamada(llamada)
+    return construir_transcripcion((mensaje.tipo, mensaje.contenido) for mensaje in mensajes)
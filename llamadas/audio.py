@@ -0,0 +1,165 @@
+"""
+Caché de audio pre-renderizado para las frases fijas
+
+El saludo, "¿Algo más en lo que pueda ayudarte?", la despedida, etc. son
+siempre iguales, pero con <Say> Twilio las sintetiza con Polly en cada llamada.
+Aquí se sintetizan una sola vez con un backend de TTS intercambiable
+(settings.AUDIO_TTS_BACKEND), se guardan como archivos estáticos en
+AUDIO_CACHE_DIR y el TwiML usa <Play> con su URL.
+
+El nombre de cada archivo es un hash de (texto, voz, idioma, backend): si
+cambia el texto o la voz se genera otro archivo y el anterior deja de usarse
+(`python manage.py generar_audios` los genera y borra los obsoletos).
+
+Twilio descarga los audios, así que la URL tiene que ser pública: salvo que
+AUDIO_CACHE_URL la fije (p. ej. un CDN o el servidor web que sirve
+AUDIO_CACHE_DIR), se arma en cada petición con la URL pública de los webhooks
+(url_publica.url_base(), que sigue al túnel de ngrok) y la ruta de la vista
+audio_frase, que sirve los archivos con o sin DEBUG.
+
+Un backend es una clase con un atributo `extension` y un método
+sintetizar(texto, voz, idioma) que devuelve los bytes del archivo de audio.
+"""
+import hashlib
+import io
+import re
+import threading
+import time
+import wave
+from pathlib import Path
+
+from django.conf import settings
+from django.urls import reverse
+from django.utils.module_loading import import_string
+
+from . import twiml
+from .url_publica import url_base as url_publica
+
+
+# Frases fijas de los documentos TwiML
+FRASES_FIJAS = [twiml.SALUDO_INICIAL, twiml.SIN_RESPUESTA, twiml.ALGO_MAS, twiml.DESPEDIDA, twiml.UN_MOMENTO]
+
+# Cada cuánto se vuelve a mirar qué frases tienen audio en disco (segundos)
+VIGENCIA_URLS = 60
+
+# Nombres que genera CacheAudio.nombre_archivo (lo único que sirve audio_frase)
+PATRON_NOMBRE = re.compile(r'^[0-9a-f]{24}\.[a-z0-9]+$')
+
+
+class TTSArchivoLocal:
+    """
+    Backend de TTS de prueba: genera un WAV de silencio (8 kHz, mono) de
+    duración proporcional al texto, sin depender de ningún servicio externo
+    """
+
+    extension = 'wav'
+
+    def sintetizar(self, texto, voz, idioma):
+        muestras = int(8000 * max(0.5, len(texto) * 0.06))
+        buffer = io.BytesIO()
+        with wave.open(buffer, 'wb') as archivo:
+            archivo.setnchannels(1)
+            archivo.setsampwidth(2)
+            archivo.setframerate(8000)
+            archivo.writeframes(b'\x00\x00' * muestras)
+        return buffer.getvalue()
+
+
+class CacheAudio:
+    """Archivos de audio de las frases fijas, indexados por hash"""
+
+    def __init__(self, backend, directorio=None, url_base=None):
+        self.backend = backend
+        self.directorio = Path(directorio or settings.AUDIO_CACHE_DIR)
+        self.url_base = url_base or settings.AUDIO_CACHE_URL
+        # (voz, idioma) -> (pares (texto, ruta), vigente hasta)
+        self._urls = {}
+        self._lock = threading.Lock()
+
+    def nombre_archivo(self, texto, voz, idioma):
+        clave = '\n'.join([texto, voz, idioma, type(self.backend).__qualname__])
+        return f"{hashlib.sha256(clave.encode('utf-8')).hexdigest()[:24]}.{self.backend.extension}"
+
+    def generar(self, texto, voz, idioma):
+        """
+        Sintetiza la frase si todavía no está en disco. Devuelve (ruta, generado)
+        """
+        ruta = self.directorio / self.nombre_archivo(texto, voz, idioma)
+        if ruta.exists():
+            return ruta, False
+        self.directorio.mkdir(parents=True, exist_ok=True)
+        temporal = ruta.with_suffix('.tmp')
+        temporal.write_bytes(self.backend.sintetizar(texto, voz, idioma))
+        temporal.replace(ruta)
+        self._urls = {}
+        return ruta, True
+
+    def generar_frases_fijas(self, voz, idioma):
+        return [self.generar(texto, voz, idioma) for texto in FRASES_FIJAS]
+
+    def limpiar_obsoletos(self, voz, idioma):
+        """
+        Borra los archivos que ya no corresponden a ninguna frase fija actual
+        """
+        vigentes = {self.nombre_archivo(texto, voz, idioma) for texto in FRASES_FIJAS}
+        borrados = []
+        if self.directorio.exists():
+            for ruta in self.directorio.glob(f"*.{self.backend.extension}"):
+                if ruta.name not in vigentes:
+                    ruta.unlink()
+                    borrados.append(ruta)
+        self._urls = {}
+        return borrados
+
+    def _ruta(self, nombre):
+        if self.url_base:
+            return f"{self.url_base}{nombre}"
+        return reverse('llamadas:audio_frase', args=[nombre])
+
+    def urls_frases_fijas(self, voz, idioma):
+        """
+        Pares (texto, url) de las frases fijas que ya tienen audio en disco.
+        Qué frases tienen audio se recalcula como mucho cada VIGENCIA_URLS
+        segundos por voz e idioma; la URL pública se toma en cada llamada
+        """
+        ahora = time.monotonic()
+        rutas, hasta = self._urls.get((voz, idioma), ((), 0))
+        if ahora >= hasta:
+            with self._lock:
+                encontradas = []
+                for texto in FRASES_FIJAS:
+                    nombre = self.nombre_archivo(texto, voz, idioma)
+                    if (self.directorio / nombre).exists():
+                        encontradas.append((texto, self._ruta(nombre)))
+                rutas = tuple(encontradas)
+                self._urls[(voz, idioma)] = (rutas, ahora + VIGENCIA_URLS)
+        if self.url_base:
+            return rutas
+        base = url_publica()
+        return tuple((texto, f"{base}{ruta}") for texto, ruta in rutas)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def obtener_cache_audio():
+    """
+    Caché de audio del proceso, o None si no hay backend de TTS configurado
+    """
+    global _cache
+    if not settings.AUDIO_TTS_BACKEND:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = CacheAudio(import_string(settings.AUDIO_TTS_BACKEND)())
+    return _cache
+
+
+def audios_frases_fijas(voz, idioma):
+    """
+    Pares (texto, url) para reemplazar <Say> por <Play>; vacío si no hay caché
+    """
+    cache = obtener_cache_audio()
+    return cache.urls_frases_fijas(voz, idioma) if cache else ()
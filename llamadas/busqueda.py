@@ -0,0 +1,167 @@
+"""
+Búsqueda de texto completo en los mensajes de las conversaciones
+
+Un icontains sobre MensajeConversacion.contenido (o Llamada.transcripcion)
+recorre la tabla entera. En su lugar se usa el índice de texto completo de
+cada base de datos, creado por la migración 0006:
+
+    - SQLite: tabla virtual FTS5 "llamadas_mensaje_fts" de contenido externo
+      sobre llamadas_mensajeconversacion, sincronizada por triggers al
+      insertar, modificar o borrar mensajes (también con bulk_create)
+    - PostgreSQL: índice GIN sobre to_tsvector('spanish', contenido); al ser un
+      índice de expresión la base de datos lo mantiene sola
+
+La transcripción de una llamada es la concatenación de sus mensajes, así que
+buscar en una llamada es buscar en sus mensajes. Con otra base de datos, o un
+SQLite sin FTS5, se vuelve a icontains.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import MensajeConversacion
+
+
+TABLA_FTS = 'llamadas_mensaje_fts'
+TABLA_MENSAJES = MensajeConversacion._meta.db_table
+# Debe coincidir con la expresión del índice GIN de la migración 0006
+CONFIG_PG = 'spanish'
+VECTOR_PG = f"to_tsvector('{CONFIG_PG}'::regconfig, contenido)"
+CONSULTA_PG = f"websearch_to_tsquery('{CONFIG_PG}'::regconfig, %s)"
+
+_motor = {}
+
+
+def motor():
+    """
+    'fts5', 'postgresql' o None (sin índice de texto completo)
+    """
+    if connection.alias not in _motor:
+        if connection.vendor == 'postgresql':
+            _motor[connection.alias] = 'postgresql'
+        elif connection.vendor == 'sqlite' and TABLA_FTS in connection.introspection.table_names():
+            _motor[connection.alias] = 'fts5'
+        else:
+            _motor[connection.alias] = None
+    return _motor[connection.alias]
+
+
+def consulta_fts5(texto):
+    """
+    Convierte el texto del usuario en una consulta FTS5 segura: cada palabra
+    entre comillas (sin operadores ni sintaxis que pueda fallar) y todas
+    requeridas; la última también como prefijo
+    """
+    palabras = re.findall(r'\w+', texto)
+    if not palabras:
+        return ''
+    terminos = [f'"{palabra}"' for palabra in palabras]
+    terminos[-1] += '*'
+    return ' '.join(terminos)
+
+
+def _sql_ids_mensajes(columna):
+    """
+    SQL que devuelve `columna` (id o llamada_id) de los mensajes que coinciden
+    con la consulta (único parámetro), para usarlo en un pk__in
+    """
+    if motor() == 'fts5':
+        return (
+            f"SELECT m.{columna} FROM {TABLA_FTS} f JOIN {TABLA_MENSAJES} m ON m.id = f.rowid "
+            f"WHERE {TABLA_FTS} MATCH %s"
+        )
+    return f"SELECT {columna} FROM {TABLA_MENSAJES} WHERE {VECTOR_PG} @@ {CONSULTA_PG}"
+
+
+def _filtro(texto, columna, filtro_sin_indice):
+    if motor() is None:
+        return filtro_sin_indice
+    if motor() == 'fts5':
+        texto = consulta_fts5(texto)
+        if not texto:
+            return Q(pk__in=[])
+    return Q(pk__in=RawSQL(_sql_ids_mensajes(columna), [texto]))
+
+
+def filtro_mensajes(texto):
+    """
+    Q para filtrar un QuerySet de MensajeConversacion por el texto buscado
+    """
+    return _filtro(texto, 'id', Q(contenido__icontains=texto))
+
+
+def filtro_llamadas(texto):
+    """
+    Q para filtrar un QuerySet de Llamada: las que tienen algún mensaje con el texto
+    """
+    return _filtro(texto, 'llamada_id', Q(transcripcion__icontains=texto))
+
+
+def buscar_mensajes(texto, limite=20, desplazamiento=0):
+    """
+    Mensajes que coinciden con el texto, del más relevante al menos relevante
+
+    Args:
+        texto: Lo que escribió el usuario (no hace falta conocer la sintaxis de búsqueda)
+        limite: Resultados a devolver
+        desplazamiento: Resultados a saltar (paginación)
+
+    Returns:
+        Lista de diccionarios con id, llamada_id, tipo, timestamp, fragmento
+        (el texto con las coincidencias entre corchetes) y rango (mayor es mejor)
+    """
+    if motor() == 'fts5':
+        consulta = consulta_fts5(texto)
+        if not consulta:
+            return []
+        # bm25() es menor cuanto más relevante
+        sql = (
+            f"SELECT rowid, snippet({TABLA_FTS}, 0, '[', ']', '…', 16), -bm25({TABLA_FTS}) "
+            f"FROM {TABLA_FTS} WHERE {TABLA_FTS} MATCH %s "
+            f"ORDER BY bm25({TABLA_FTS}), rowid DESC LIMIT %s OFFSET %s"
+        )
+        parametros = [consulta, limite, desplazamiento]
+    elif motor() == 'postgresql':
+        sql = (
+            f"SELECT id, ts_headline('{CONFIG_PG}'::regconfig, contenido, q, 'StartSel=[, StopSel=], MaxWords=16'), "
+            f"ts_rank({VECTOR_PG}, q) AS rango FROM {TABLA_MENSAJES}, {CONSULTA_PG} q "
+            f"WHERE {VECTOR_PG} @@ q ORDER BY rango DESC, id DESC LIMIT %s OFFSET %s"
+        )
+        parametros = [texto, limite, desplazamiento]
+    else:
+        mensajes = (
+            MensajeConversacion.objects.filter(contenido__icontains=texto)
+            .order_by('-timestamp', '-id')[desplazamiento:desplazamiento + limite]
+        )
+        return [
+            {
+                'id': mensaje.pk,
+                'llamada_id': mensaje.llamada_id,
+                'tipo': mensaje.tipo,
+                'timestamp': mensaje.timestamp,
+                'fragmento': mensaje.contenido,
+                'rango': 0,
+            }
+            for mensaje in mensajes
+        ]
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, parametros)
+        coincidencias = cursor.fetchall()
+    # Los datos del mensaje por clave primaria, con las conversiones de tipos del ORM
+    mensajes = MensajeConversacion.objects.only('llamada_id', 'tipo', 'timestamp').in_bulk(
+        [pk for pk, _, _ in coincidencias]
+    )
+    return [
+        {
+            'id': pk,
+            'llamada_id': mensajes[pk].llamada_id,
+            'tipo': mensajes[pk].tipo,
+            'timestamp': mensajes[pk].timestamp,
+            'fragmento': fragmento,
+            'rango': rango,
+        }
+        for pk, fragmento, rango in coincidencias if pk in mensajes
+    ]
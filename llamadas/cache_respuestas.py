@@ -0,0 +1,207 @@
+"""
+Caché de respuestas de la IA para preguntas repetidas
+
+Los llamantes hacen una y otra vez las mismas preguntas. Antes de pedir una
+respuesta a OpenAI se busca en esta caché, indexada por la pregunta
+normalizada (minúsculas, sin acentos ni puntuación) y una huella del contexto
+reciente de la conversación, para no reutilizar una respuesta que dependía de
+lo que se venía hablando.
+
+Como el reconocimiento de voz rara vez transcribe dos veces igual la misma
+frase, si no hay coincidencia exacta se busca la pregunta más parecida dentro
+del mismo contexto con un índice de trigramas (similitud de Dice). Dos
+preguntas casi iguales pueden pedir cosas opuestas ("¿abren el lunes?" /
+"¿abren el martes?", "quiero cancelar" / "no quiero cancelar"), así que una
+coincidencia aproximada solo se acepta si ambas tienen exactamente las mismas
+palabras críticas: negaciones, números y días, meses o fechas relativas. Las
+entradas expiran por TTL y, al llenarse, se expulsan por LRU.
+
+Está desactivada por defecto: una respuesta reutilizada no ve el resto de la
+conversación más allá de CACHE_RESPUESTAS_CONTEXTO mensajes.
+
+Configuración (settings): CACHE_RESPUESTAS_ACTIVA, CACHE_RESPUESTAS_MAX,
+CACHE_RESPUESTAS_TTL, CACHE_RESPUESTAS_SIMILITUD, CACHE_RESPUESTAS_CONTEXTO.
+"""
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict, defaultdict
+
+from django.conf import settings
+
+
+_NO_ALFANUMERICO = re.compile(r'[^a-z0-9ñ ]+')
+_ESPACIOS = re.compile(r'\s+')
+_NUMERO = re.compile(r'\d')
+
+# Palabras (ya normalizadas) que cambian el sentido de una pregunta parecida
+PALABRAS_CRITICAS = frozenset('''
+    no ni nunca jamas tampoco nada nadie ninguno ninguna ningun sin
+    cero uno una dos tres cuatro cinco seis siete ocho nueve diez once doce
+    quince veinte treinta cuarenta cincuenta cien ciento mil millon
+    primero primera segundo segunda tercero tercera medio media
+    lunes martes miercoles jueves viernes sabado domingo
+    hoy mañana ayer anteayer pasado tarde noche semana mes año fin
+    enero febrero marzo abril mayo junio julio agosto septiembre octubre noviembre diciembre
+'''.split())
+
+
+def normalizar(texto):
+    """
+    Minúsculas, sin acentos (salvo la ñ) ni puntuación, espacios simples
+    """
+    texto = texto.lower().replace('ñ', '\0')
+    texto = ''.join(c for c in unicodedata.normalize('NFKD', texto) if not unicodedata.combining(c))
+    texto = texto.replace('\0', 'ñ')
+    texto = _NO_ALFANUMERICO.sub(' ', texto)
+    return _ESPACIOS.sub(' ', texto).strip()
+
+
+def palabras_criticas(normalizada):
+    """
+    Negaciones, números y fechas de una pregunta normalizada
+    """
+    return frozenset(
+        palabra for palabra in normalizada.split()
+        if palabra in PALABRAS_CRITICAS or _NUMERO.search(palabra)
+    )
+
+
+def trigramas(texto):
+    relleno = f"  {texto} "
+    return {relleno[i:i + 3] for i in range(len(relleno) - 2)}
+
+
+def huella_contexto(historial, mensajes=None):
+    """
+    Hash de los últimos mensajes de la conversación (vacío al inicio de la llamada)
+    """
+    mensajes = settings.CACHE_RESPUESTAS_CONTEXTO if mensajes is None else mensajes
+    recientes = (historial or [])[-mensajes:] if mensajes else []
+    contenido = '\n'.join(f"{m['role']}:{normalizar(m['content'])}" for m in recientes)
+    return hashlib.sha1(contenido.encode('utf-8')).hexdigest()[:16]
+
+
+class CacheRespuestas:
+    """Caché LRU con TTL y búsqueda aproximada por trigramas"""
+
+    def __init__(self, max_entradas=None, ttl=None, similitud=None):
+        self.max_entradas = max_entradas or settings.CACHE_RESPUESTAS_MAX
+        self.ttl = ttl or settings.CACHE_RESPUESTAS_TTL
+        self.similitud = similitud or settings.CACHE_RESPUESTAS_SIMILITUD
+        # (contexto, pregunta normalizada) -> (respuesta, trigramas, expira)
+        self._entradas = OrderedDict()
+        # (contexto, trigrama) -> claves que lo contienen
+        self._indice = defaultdict(set)
+        self._lock = threading.Lock()
+        self.aciertos_exactos = 0
+        self.aciertos_aproximados = 0
+        self.fallos = 0
+        self.expulsiones = 0
+
+    def obtener(self, pregunta, historial=None):
+        """
+        Respuesta en caché para la pregunta, o None
+        """
+        normalizada = normalizar(pregunta)
+        if not normalizada:
+            return None
+        contexto = huella_contexto(historial)
+        clave = (contexto, normalizada)
+        ahora = time.monotonic()
+
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada and entrada[2] > ahora:
+                self._entradas.move_to_end(clave)
+                self.aciertos_exactos += 1
+                return entrada[0]
+
+            clave = self._buscar_parecida(contexto, normalizada, ahora)
+            if clave:
+                self._entradas.move_to_end(clave)
+                self.aciertos_aproximados += 1
+                return self._entradas[clave][0]
+
+            self.fallos += 1
+            return None
+
+    def guardar(self, pregunta, historial, respuesta):
+        normalizada = normalizar(pregunta)
+        if not normalizada:
+            return
+        clave = (huella_contexto(historial), normalizada)
+        grams = trigramas(normalizada)
+
+        with self._lock:
+            if clave in self._entradas:
+                self._eliminar(clave)
+            self._entradas[clave] = (respuesta, grams, time.monotonic() + self.ttl)
+            for gram in grams:
+                self._indice[(clave[0], gram)].add(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._eliminar(next(iter(self._entradas)))
+                self.expulsiones += 1
+
+    def estadisticas(self):
+        with self._lock:
+            consultas = self.aciertos_exactos + self.aciertos_aproximados + self.fallos
+            return {
+                'entradas': len(self._entradas),
+                'aciertos_exactos': self.aciertos_exactos,
+                'aciertos_aproximados': self.aciertos_aproximados,
+                'fallos': self.fallos,
+                'expulsiones': self.expulsiones,
+                'tasa_aciertos': (self.aciertos_exactos + self.aciertos_aproximados) / consultas if consultas else 0.0,
+            }
+
+    def _buscar_parecida(self, contexto, normalizada, ahora):
+        grams = trigramas(normalizada)
+        comunes = defaultdict(int)
+        for gram in grams:
+            for clave in self._indice.get((contexto, gram), ()):
+                comunes[clave] += 1
+
+        criticas = palabras_criticas(normalizada)
+        mejor, mejor_similitud = None, self.similitud
+        vencidas = []
+        for clave, n in comunes.items():
+            respuesta, grams_entrada, expira = self._entradas[clave]
+            if expira <= ahora:
+                vencidas.append(clave)
+                continue
+            similitud = 2 * n / (len(grams) + len(grams_entrada))
+            if similitud >= mejor_similitud and palabras_criticas(clave[1]) == criticas:
+                mejor, mejor_similitud = clave, similitud
+        for clave in vencidas:
+            self._eliminar(clave)
+        return mejor
+
+    def _eliminar(self, clave):
+        _, grams, _ = self._entradas.pop(clave)
+        for gram in grams:
+            claves = self._indice.get((clave[0], gram))
+            if claves is not None:
+                claves.discard(clave)
+                if not claves:
+                    del self._indice[(clave[0], gram)]
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def obtener_cache_respuestas():
+    """
+    Caché compartida del proceso, o None si está desactivada
+    """
+    global _cache
+    if not settings.CACHE_RESPUESTAS_ACTIVA:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = CacheRespuestas()
+    return _cache
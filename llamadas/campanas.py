@@ -0,0 +1,331 @@
+"""
+Programador de campañas de llamadas salientes
+
+Los números de una campaña viven en NumeroCampana, que hace de cola
+persistente: el programador toma los pendientes cuyo proximo_intento ya pasó,
+los marca con TwilioService.hacer_llamada respetando las llamadas por segundo
+(CPS) y el máximo de llamadas activas de la campaña, y el webhook de estado
+(registrar_resultado) los cierra o los reprograma con backoff exponencial si
+la línea dio ocupado o no contestó.
+
+Como todo el estado está en la base de datos, el programador se puede detener
+y volver a lanzar (python manage.py ejecutar_campana <id>) sin perder ni
+repetir números. La Llamada se crea antes de marcar, con un SID provisional
+que se reemplaza por el de Twilio, así que un número en "marcando" siempre
+tiene su llamada: si el proceso se corta entre la petición a Twilio y la
+respuesta, recuperar() la encuentra con el SID provisional. Los números que
+siguen "marcando" sin resultado después de MAX_DURACION_LLAMADA (callback de
+estado perdido) se cierran como fallidos. Los contadores de progreso de
+Campana se mantienen de forma incremental para no tener que recorrer Llamada.
+"""
+import logging
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, Q, Value, When
+from django.utils import timezone
+
+from .estadisticas import ESTADOS_FINALES, descontar_inicio, registrar_fin, registrar_inicio
+from .models import Campana, Llamada, NumeroCampana
+from .services import TwilioService
+from .url_publica import url_webhook
+
+
+logger = logging.getLogger(__name__)
+
+
+# CallStatus de Twilio que justifican un nuevo intento
+RESULTADOS_REINTENTABLES = {'busy', 'no-answer'}
+RESULTADOS_FINALES = {'completed', 'busy', 'no-answer', 'failed', 'canceled'}
+
+# Resultado anotado cuando no llegó el callback de estado de Twilio
+RESULTADO_SIN_CALLBACK = 'sin-callback'
+
+# SID de la Llamada entre que se crea y Twilio devuelve el real
+PREFIJO_SID_PROVISIONAL = 'provisional-'
+
+# Un número que lleva este tiempo "marcando" con SID provisional quedó
+# colgado por un reinicio entre el reclamo y la respuesta de Twilio
+ESPERA_RECUPERACION = timedelta(minutes=5)
+
+# Twilio corta las llamadas a las 4 horas (time limit por defecto): pasado ese
+# tiempo, un número "marcando" perdió su callback de estado
+MAX_DURACION_LLAMADA = timedelta(hours=4, minutes=10)
+
+# Cada cuánto el programador busca números vencidos mientras corre (segundos)
+INTERVALO_VENCIDOS = 60
+
+
+class LimitadorTasa:
+    """Token bucket: permite como máximo `por_segundo` operaciones por segundo"""
+
+    def __init__(self, por_segundo, capacidad=1):
+        self.intervalo = 1.0 / por_segundo if por_segundo > 0 else 0
+        self.capacidad = capacidad
+        self.tokens = capacidad
+        self.ultimo = time.monotonic()
+
+    def esperar(self):
+        if not self.intervalo:
+            return
+        while True:
+            ahora = time.monotonic()
+            self.tokens = min(self.capacidad, self.tokens + (ahora - self.ultimo) / self.intervalo)
+            self.ultimo = ahora
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            time.sleep((1 - self.tokens) * self.intervalo)
+
+
+def _actualizar_contadores(campana_id, **cambios):
+    Campana.objects.filter(pk=campana_id).update(**{
+        campo: F(campo) + valor for campo, valor in cambios.items()
+    })
+
+
+def recalcular_contadores(campana):
+    """
+    Recalcula los contadores de una campaña desde NumeroCampana (al reanudar)
+    """
+    por_estado = dict(
+        campana.numeros.values_list('estado').annotate(total=Count('id')).values_list('estado', 'total')
+    )
+    campana.pendientes = por_estado.get('pendiente', 0)
+    campana.en_curso = por_estado.get('marcando', 0)
+    campana.completadas = por_estado.get('completado', 0)
+    campana.fallidas = por_estado.get('fallido', 0)
+    campana.total_numeros = sum(por_estado.values())
+    campana.save(update_fields=['pendientes', 'en_curso', 'completadas', 'fallidas', 'total_numeros'])
+
+
+def agregar_numeros(campana, numeros, lote=1000):
+    """
+    Agrega números a la campaña en lotes (bulk_create) y actualiza los contadores
+    """
+    total = 0
+    buffer = []
+    for numero in numeros:
+        numero = numero.strip()
+        if not numero:
+            continue
+        buffer.append(NumeroCampana(campana=campana, numero=numero))
+        if len(buffer) >= lote:
+            NumeroCampana.objects.bulk_create(buffer)
+            total += len(buffer)
+            buffer = []
+    if buffer:
+        NumeroCampana.objects.bulk_create(buffer)
+        total += len(buffer)
+    _actualizar_contadores(campana.pk, total_numeros=total, pendientes=total)
+    return total
+
+
+def registrar_resultado(llamada, call_status):
+    """
+    Cierra o reprograma el número de campaña asociado a una llamada terminada.
+    Se llama desde webhook_status; no hace nada si la llamada no es de campaña
+    """
+    if call_status not in RESULTADOS_FINALES:
+        return
+    numero = (
+        NumeroCampana.objects.select_related('campana')
+        .filter(llamada=llamada, estado='marcando')
+        .first()
+    )
+    if numero:
+        _cerrar_numero(numero, call_status)
+
+
+def adoptar_sid(llamada_id, call_sid):
+    """
+    Pone el CallSid de Twilio a la llamada provisional `llamada_id` y devuelve
+    la llamada que queda con ese sid. Lo hacen el programador al volver de
+    Twilio y webhook_llamada si el primer evento llega antes (trae el token de
+    la llamada en la URL); el segundo en llegar no cambia nada
+
+    Si otra fila ya tiene el CallSid (el webhook la creó sin token), se queda
+    esa: el número de campaña pasa a apuntarla y la provisional se borra
+    """
+    try:
+        with transaction.atomic():
+            Llamada.objects.filter(pk=llamada_id, sid__startswith=PREFIJO_SID_PROVISIONAL).update(sid=call_sid)
+    except IntegrityError:
+        existente = Llamada.objects.get(sid=call_sid)
+        NumeroCampana.objects.filter(llamada_id=llamada_id).update(llamada=existente)
+        provisional = Llamada.objects.filter(pk=llamada_id).first()
+        if provisional:
+            provisional.delete()
+            descontar_inicio(provisional)
+        logger.info("Llamada provisional unida a la del webhook", extra={'llamada_id': existente.pk})
+        return existente
+    return Llamada.objects.get(pk=llamada_id)
+
+
+def _marcar_fallida(llamada_id, motivo):
+    """
+    Cierra como fallida una llamada de campaña que no llegó a Twilio (o cuyo
+    resultado nunca llegó), contándola una sola vez en las estadísticas
+
+    Como en webhook_status, fecha_fin marca la llamada ya contada; un estado
+    final escrito por webhook_llamada se conserva
+    """
+    if Llamada.objects.filter(pk=llamada_id, fecha_fin__isnull=True).update(
+        estado=Case(When(estado__in=ESTADOS_FINALES, then=F('estado')), default=Value('fallida')),
+        fecha_fin=timezone.now(), notas=motivo,
+    ):
+        llamada = Llamada.objects.get(pk=llamada_id)
+        registrar_fin(llamada, llamada.estado, llamada.duracion)
+
+
+def _cerrar_numero(numero, call_status):
+    campana = numero.campana
+    if call_status == 'completed':
+        nuevo_estado, contador = 'completado', 'completadas'
+    elif call_status in RESULTADOS_REINTENTABLES and numero.intentos < campana.max_intentos:
+        nuevo_estado, contador = 'pendiente', 'pendientes'
+    else:
+        nuevo_estado, contador = 'fallido', 'fallidas'
+
+    cambios = {'estado': nuevo_estado, 'ultimo_resultado': call_status}
+    if nuevo_estado == 'pendiente':
+        espera = campana.espera_reintento * 2 ** max(numero.intentos - 1, 0)
+        cambios['proximo_intento'] = timezone.now() + timedelta(seconds=espera)
+
+    # El filtro por estado evita contar dos veces un callback repetido
+    if NumeroCampana.objects.filter(pk=numero.pk, estado='marcando').update(**cambios):
+        _actualizar_contadores(campana.pk, en_curso=-1, **{contador: 1})
+
+
+class ProgramadorCampanas:
+    """Alimenta TwilioService.hacer_llamada con los números pendientes de una campaña"""
+
+    def __init__(self, campana, twilio_service=None, webhook_url=None, intervalo=1.0):
+        self.campana = campana
+        self.twilio_service = twilio_service or TwilioService()
+        self.webhook_url = webhook_url or url_webhook('webhook_llamada')
+        self.intervalo = intervalo
+        self.limitador = LimitadorTasa(campana.llamadas_por_segundo)
+
+    def recuperar(self):
+        """
+        Prepara la campaña para (re)empezar: devuelve a la cola los números que
+        quedaron reclamados sin llamada y recalcula los contadores
+        """
+        limite = timezone.now() - ESPERA_RECUPERACION
+        colgados = NumeroCampana.objects.filter(campana=self.campana, estado='marcando', proximo_intento__lt=limite)
+        # Sin llamada (versiones anteriores) o con SID provisional: Twilio no
+        # llegó a responder, se vuelven a marcar
+        sin_llamada = Q(llamada__isnull=True) | Q(llamada__sid__startswith=PREFIJO_SID_PROVISIONAL)
+        for pk, llamada_id in colgados.filter(sin_llamada).values_list('pk', 'llamada_id'):
+            if llamada_id:
+                _marcar_fallida(llamada_id, "El programador se detuvo antes de que Twilio respondiera")
+            NumeroCampana.objects.filter(pk=pk, estado='marcando').update(estado='pendiente', llamada=None)
+
+        # Llamadas que terminaron mientras no había callback registrado (p. ej. se perdió)
+        terminadas = NumeroCampana.objects.filter(
+            campana=self.campana, estado='marcando', llamada__estado__in=['completada', 'fallida', 'cancelada']
+        ).values_list('pk', 'llamada__estado')
+        for pk, estado in terminadas:
+            NumeroCampana.objects.filter(pk=pk).update(
+                estado='completado' if estado == 'completada' else 'fallido'
+            )
+        self.vencer_sin_resultado()
+        recalcular_contadores(self.campana)
+
+    def vencer_sin_resultado(self):
+        """
+        Cierra los números que siguen "marcando" más de MAX_DURACION_LLAMADA:
+        su callback de estado no llegó. Devuelve cuántos cerró
+        """
+        limite = timezone.now() - MAX_DURACION_LLAMADA
+        vencidos = NumeroCampana.objects.select_related('campana').filter(
+            campana=self.campana, estado='marcando', proximo_intento__lt=limite
+        )
+        cerrados = 0
+        for numero in vencidos:
+            logger.warning("Número de campaña sin resultado de Twilio, se cierra como fallido",
+                           extra={'campana_id': self.campana.pk, 'numero_destino': numero.numero})
+            if numero.llamada_id:
+                _marcar_fallida(numero.llamada_id, "No llegó el callback de estado de Twilio")
+            _cerrar_numero(numero, RESULTADO_SIN_CALLBACK)
+            cerrados += 1
+        return cerrados
+
+    def ciclo(self):
+        """
+        Una pasada del programador. Devuelve cuántas llamadas se iniciaron
+        """
+        self.campana.refresh_from_db(fields=['estado', 'en_curso', 'max_llamadas_activas'])
+        capacidad = self.campana.max_llamadas_activas - self.campana.en_curso
+        if capacidad <= 0:
+            return 0
+
+        candidatos = list(
+            NumeroCampana.objects.filter(
+                campana=self.campana, estado='pendiente', proximo_intento__lte=timezone.now()
+            ).order_by('proximo_intento', 'id').values_list('pk', 'numero')[:capacidad]
+        )
+
+        iniciadas = 0
+        for pk, numero in candidatos:
+            # Reclamar el número; si otro programador ya lo tomó, update devuelve 0
+            reclamado = NumeroCampana.objects.filter(pk=pk, estado='pendiente').update(
+                estado='marcando', intentos=F('intentos') + 1, proximo_intento=timezone.now()
+            )
+            if not reclamado:
+                continue
+            _actualizar_contadores(self.campana.pk, pendientes=-1, en_curso=1)
+
+            # La llamada existe antes de marcar: un corte a mitad de camino
+            # deja el número con su llamada provisional (ver recuperar)
+            llamada = Llamada.objects.create(
+                sid=f"{PREFIJO_SID_PROVISIONAL}{uuid.uuid4().hex}",
+                numero_destino=numero,
+                numero_origen=settings.TWILIO_PHONE_NUMBER,
+                estado='iniciada'
+            )
+            registrar_inicio(llamada)
+            NumeroCampana.objects.filter(pk=pk).update(llamada=llamada)
+
+            self.limitador.esperar()
+            try:
+                call = self.twilio_service.hacer_llamada(numero, self.webhook_url, llamada.pk)
+            except Exception as e:
+                logger.warning("Error al llamar: %s", e, extra={'campana_id': self.campana.pk, 'numero_destino': numero})
+                _marcar_fallida(llamada.pk, f"Error al llamar: {e}")
+                _cerrar_numero(NumeroCampana.objects.select_related('campana').get(pk=pk), 'failed')
+                continue
+
+            adoptar_sid(llamada.pk, call.sid)
+            iniciadas += 1
+        return iniciadas
+
+    def ejecutar(self):
+        """
+        Bucle principal: corre hasta que no quedan números pendientes ni en
+        curso, o hasta que la campaña se pausa
+        """
+        self.recuperar()
+        Campana.objects.filter(pk=self.campana.pk).update(estado='en_curso')
+        Campana.objects.filter(pk=self.campana.pk, fecha_inicio__isnull=True).update(fecha_inicio=timezone.now())
+
+        ultima_revision = time.monotonic()
+        while True:
+            if time.monotonic() - ultima_revision >= INTERVALO_VENCIDOS:
+                self.vencer_sin_resultado()
+                ultima_revision = time.monotonic()
+            iniciadas = self.ciclo()
+            self.campana.refresh_from_db(fields=['estado', 'pendientes', 'en_curso'])
+            if self.campana.estado == 'pausada':
+                logger.info("Campaña pausada", extra={'campana_id': self.campana.pk})
+                return
+            if self.campana.pendientes <= 0 and self.campana.en_curso <= 0:
+                Campana.objects.filter(pk=self.campana.pk).update(estado='completada', fecha_fin=timezone.now())
+                logger.info("Campaña completada", extra={'campana_id': self.campana.pk})
+                return
+            if not iniciadas:
+                time.sleep(self.intervalo)
@@ -0,0 +1,25 @@
+"""
+Comprobaciones de configuración (python manage.py check, runserver, migrate)
+"""
+from django.conf import settings
+from django.core.checks import Error, register
+
+from .streaming import configuracion_incompleta
+
+
+@register()
+def comprobar_voz_tiempo_real(app_configs, **kwargs):
+    """
+    El modo tiempo real sin transcriptor o sin sintetizador conecta llamadas
+    que no escuchan ni hablan: se rechaza en lugar de arrancar así
+    """
+    if not settings.VOZ_TIEMPO_REAL:
+        return []
+    return [
+        Error(
+            f"VOZ_TIEMPO_REAL=True requiere {nombre}",
+            hint="Configurar la ruta a la clase (ver llamadas/streaming.py) o desactivar VOZ_TIEMPO_REAL",
+            id='llamadas.E001',
+        )
+        for nombre in configuracion_incompleta()
+    ]
@@ -0,0 +1,258 @@
+"""
+Registro de clientes de Twilio y OpenAI compartidos por todo el proceso
+
+Crear un twilio.rest.Client o un OpenAI nuevo en cada petición abre conexiones
+TCP/TLS nuevas y vuelve a cargar certificados. Aquí se crean una sola vez por
+proceso (worker), con pools de conexiones persistentes (keep-alive), de modo
+que cada turno reutiliza conexiones ya abiertas.
+
+Configuración (settings):
+    HTTP_POOL_CONEXIONES: conexiones máximas por pool
+    HTTP_POOL_KEEPALIVE: conexiones ociosas que se mantienen abiertas
+    HTTP_TIMEOUT / HTTP_TIMEOUT_CONEXION: timeouts en segundos
+    CALENTAR_CLIENTES: abrir las conexiones al arrancar el worker (wsgi/asgi)
+
+El cliente de Twilio es uno por hilo: TwilioHttpClient.request() guarda la
+respuesta en la instancia y devuelve ese atributo, así que con un cliente
+compartido un hilo puede recibir la respuesta de otro (y el SID de otra
+llamada). Todos comparten la misma requests.Session, que es la que tiene el
+pool de conexiones.
+
+Con gunicorn no usar --preload: las conexiones deben abrirse después del fork.
+"""
+import asyncio
+import logging
+import threading
+import weakref
+
+import httpx
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from openai import AsyncOpenAI, OpenAI
+from requests import Session
+from requests.adapters import HTTPAdapter
+from twilio.http.http_client import TwilioHttpClient
+from twilio.rest import Client
+
+
+logger = logging.getLogger(__name__)
+
+
+TWILIO_API_URL = 'https://api.twilio.com'
+
+_clientes = {}
+_clientes_async = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+# Cliente de Twilio de cada hilo (ver obtener_cliente_twilio)
+_twilio_local = threading.local()
+
+
+def _obtener(nombre, crear):
+    cliente = _clientes.get(nombre)
+    if cliente is None:
+        with _lock:
+            cliente = _clientes.get(nombre)
+            if cliente is None:
+                cliente = crear()
+                _clientes[nombre] = cliente
+    return cliente
+
+
+def _limites_httpx():
+    return httpx.Limits(
+        max_connections=settings.HTTP_POOL_CONEXIONES,
+        max_keepalive_connections=settings.HTTP_POOL_KEEPALIVE,
+    )
+
+
+def _timeout_httpx():
+    return httpx.Timeout(settings.HTTP_TIMEOUT, connect=settings.HTTP_TIMEOUT_CONEXION)
+
+
+class TwilioHttpClientRedirigido(TwilioHttpClient):
+    """
+    Envía las peticiones de la API REST a settings.TWILIO_API_URL en lugar de
+    api.twilio.com (p. ej. un servidor falso local para probar campañas)
+    """
+
+    def request(self, method, url, *args, **kwargs):
+        if url.startswith(TWILIO_API_URL):
+            url = settings.TWILIO_API_URL.rstrip('/') + url[len(TWILIO_API_URL):]
+        return super().request(method, url, *args, **kwargs)
+
+
+def _crear_sesion_twilio():
+    sesion = Session()
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=settings.HTTP_POOL_CONEXIONES,
+    )
+    sesion.mount('https://', adapter)
+    sesion.mount('http://', adapter)
+    return sesion
+
+
+def _crear_twilio(sesion):
+    if settings.TWILIO_API_URL.rstrip('/') != TWILIO_API_URL:
+        http_client = TwilioHttpClientRedirigido(pool_connections=False, timeout=settings.HTTP_TIMEOUT)
+    else:
+        http_client = TwilioHttpClient(pool_connections=False, timeout=settings.HTTP_TIMEOUT)
+    http_client.session = sesion
+    return Client(settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN, http_client=http_client)
+
+
+def _crear_openai():
+    if not settings.OPENAI_API_KEY:
+        return None
+    return OpenAI(
+        api_key=settings.OPENAI_API_KEY,
+        base_url=settings.OPENAI_BASE_URL or None,
+        http_client=httpx.Client(limits=_limites_httpx(), timeout=_timeout_httpx()),
+    )
+
+
+def obtener_cliente_twilio():
+    """
+    Cliente de Twilio del hilo actual, con la sesión (pool de conexiones)
+    compartida por el proceso. None si Twilio no está configurado
+    """
+    if not settings.TWILIO_ACCOUNT_SID:
+        return None
+    sesion = _obtener('twilio', _crear_sesion_twilio)
+    cliente = getattr(_twilio_local, 'cliente', None)
+    # Otra sesión: cerrar_clientes() o un cambio de settings la reemplazó
+    if cliente is None or cliente.http_client.session is not sesion:
+        cliente = _crear_twilio(sesion)
+        _twilio_local.cliente = cliente
+    return cliente
+
+
+def obtener_cliente_openai():
+    """
+    Cliente síncrono de OpenAI compartido (None si no hay API key)
+    """
+    return _obtener('openai', _crear_openai)
+
+
+def obtener_cliente_openai_async():
+    """
+    Cliente AsyncOpenAI compartido por event loop (las conexiones de httpx
+    quedan ligadas al loop que las abrió). None si no hay API key
+    """
+    if not settings.OPENAI_API_KEY:
+        return None
+    loop = asyncio.get_running_loop()
+    cliente = _clientes_async.get(loop)
+    if cliente is None:
+        cliente = AsyncOpenAI(
+            api_key=settings.OPENAI_API_KEY,
+            base_url=settings.OPENAI_BASE_URL or None,
+            http_client=httpx.AsyncClient(limits=_limites_httpx(), timeout=_timeout_httpx()),
+        )
+        _clientes_async[loop] = cliente
+    return cliente
+
+
+def calentar_clientes():
+    """
+    Abre por adelantado las conexiones TLS de los clientes síncronos para que
+    el primer turno no pague el handshake. Los errores solo se informan
+    """
+    twilio = obtener_cliente_twilio()
+    if twilio:
+        try:
+            twilio.http_client.session.head(settings.TWILIO_API_URL, timeout=settings.HTTP_TIMEOUT_CONEXION)
+            logger.info("Conexión con Twilio precalentada")
+        except Exception as e:
+            logger.warning("No se pudo precalentar Twilio: %s", e)
+
+    openai = obtener_cliente_openai()
+    if openai:
+        try:
+            # Cualquier respuesta (incluso 404) deja la conexión abierta en el pool
+            openai._client.get(str(openai.base_url), timeout=settings.HTTP_TIMEOUT_CONEXION)
+            logger.info("Conexión con OpenAI precalentada")
+        except Exception as e:
+            logger.warning("No se pudo precalentar OpenAI: %s", e)
+
+
+def calentar_en_segundo_plano():
+    """
+    calentar_clientes en un hilo aparte, para no demorar el arranque del
+    worker (wsgi.py) si Twilio u OpenAI tardan en responder
+    """
+    hilo = threading.Thread(target=calentar_clientes, name='calentar-clientes', daemon=True)
+    hilo.start()
+    return hilo
+
+
+async def calentar_clientes_async():
+    """
+    Igual que calentar_clientes, más el cliente AsyncOpenAI del loop actual
+    """
+    await asyncio.to_thread(calentar_clientes)
+    cliente = obtener_cliente_openai_async()
+    if cliente:
+        try:
+            await cliente._client.get(str(cliente.base_url), timeout=settings.HTTP_TIMEOUT_CONEXION)
+        except Exception as e:
+            logger.warning("No se pudo precalentar AsyncOpenAI: %s", e)
+
+
+def _cerrar_cliente_async(loop, cliente):
+    """
+    Cierra un AsyncOpenAI en el loop que abrió sus conexiones
+    """
+    if loop.is_closed():
+        # Sus conexiones se cerraron con el loop
+        return
+    try:
+        actual = asyncio.get_running_loop()
+    except RuntimeError:
+        actual = None
+    if loop is actual:
+        loop.create_task(cliente.close())
+    elif loop.is_running():
+        asyncio.run_coroutine_threadsafe(cliente.close(), loop)
+    else:
+        loop.run_until_complete(cliente.close())
+
+
+def cerrar_clientes():
+    """
+    Cierra los pools y vacía el registro (se recrean en el siguiente uso)
+    """
+    with _lock:
+        clientes = list(_clientes.values())
+        _clientes.clear()
+        clientes_async = list(_clientes_async.items())
+        _clientes_async.clear()
+    for cliente in clientes:
+        # OpenAI o la requests.Session de Twilio
+        if cliente is not None:
+            cliente.close()
+    for loop, cliente in clientes_async:
+        try:
+            _cerrar_cliente_async(loop, cliente)
+        except Exception as e:
+            logger.warning("No se pudo cerrar el cliente AsyncOpenAI: %s", e)
+
+
+async def cerrar_clientes_async():
+    """
+    Igual que cerrar_clientes, esperando a que se cierre el cliente
+    AsyncOpenAI del loop actual (apagado del worker ASGI)
+    """
+    loop = asyncio.get_running_loop()
+    with _lock:
+        cliente = _clientes_async.pop(loop, None)
+    cerrar_clientes()
+    if cliente is not None:
+        await cliente.close()
+
+
+@receiver(setting_changed)
+def _reiniciar_al_cambiar_settings(setting, **kwargs):
+    if setting.startswith(('TWILIO_', 'OPENAI_', 'HTTP_')):
+        cerrar_clientes()
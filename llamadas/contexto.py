@@ -0,0 +1,266 @@
+"""
+Contexto que se envía a OpenAI: historial recortado por tokens y resumen
+
+En lugar de enviar siempre los últimos N mensajes, el historial se recorta
+por un presupuesto de tokens (settings.HISTORIAL_MAX_TOKENS): entran los
+mensajes más recientes que quepan. Lo que queda fuera no se pierde: se
+compacta en un resumen acumulativo que va al prompt como mensaje de sistema.
+
+El resumen se actualiza fuera del camino crítico: después de cada turno se
+mira cuántos mensajes quedaron fuera de la ventana sin resumir y, si son al
+menos RESUMEN_LOTE, se encarga a un hilo de fondo que pida a OpenAI un resumen
+nuevo (resumen anterior + mensajes nuevos). Mientras tanto los turnos siguen
+usando el resumen anterior, y los mensajes que quedaron fuera de la ventana
+pero todavía no están en el resumen se siguen enviando completos: ningún
+mensaje desaparece del prompt antes de estar resumido. Así el tamaño del
+prompt (y con él la latencia y el costo del LLM) queda acotado sin importar lo
+larga que sea la llamada. Si los resúmenes fallan una y otra vez, lo pendiente
+se limita a MAX_SIN_RESUMIR_LOTES lotes para no crecer sin fin.
+
+El resumen se guarda en la caché de Django (CONVERSACION_CACHE_ALIAS) bajo
+"resumen:<CallSid>", aparte del estado de la conversación para no competir
+con las escrituras de cada turno.
+
+Los tokens se cuentan con tiktoken si está instalado; si no, se estiman como
+un token cada 4 caracteres.
+"""
+import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .clientes import obtener_cliente_openai
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+logger = logging.getLogger(__name__)
+
+
+# Tokens fijos que agrega el formato de chat por mensaje y para la respuesta
+TOKENS_POR_MENSAJE = 3
+TOKENS_RESPUESTA = 3
+
+PREFIJO_CACHE = 'resumen:'
+
+# Lotes de RESUMEN_LOTE mensajes sin resumir que se siguen enviando fuera de la
+# ventana mientras no llega el resumen
+MAX_SIN_RESUMIR_LOTES = 3
+
+PROMPT_RESUMEN = (
+    "Resume en español la conversación telefónica entre un usuario y un asistente virtual. "
+    "Conserva los datos concretos (nombres, números, fechas, pedidos y lo que ya se respondió) "
+    "y omite saludos y frases de cortesía. Responde solo con el resumen."
+)
+
+# Resumen de historial[:mensajes]
+Resumen = namedtuple('Resumen', ['texto', 'mensajes'])
+
+
+@lru_cache(maxsize=8)
+def _codificador(modelo):
+    try:
+        return tiktoken.encoding_for_model(modelo)
+    except KeyError:
+        return tiktoken.get_encoding('cl100k_base')
+
+
+def contar_tokens(texto, modelo=None):
+    if not texto:
+        return 0
+    if tiktoken is None:
+        return (len(texto) + 3) // 4
+    return len(_codificador(modelo or settings.OPENAI_MODEL).encode(texto))
+
+
+def tokens_mensaje(mensaje, modelo=None):
+    return TOKENS_POR_MENSAJE + contar_tokens(mensaje['content'], modelo)
+
+
+def tokens_mensajes(mensajes, modelo=None):
+    """
+    Tokens de prompt de una lista de mensajes de chat (estimación de OpenAI)
+    """
+    return sum(tokens_mensaje(m, modelo) for m in mensajes) + TOKENS_RESPUESTA
+
+
+def recortar_texto(texto, max_tokens, modelo=None):
+    """
+    Corta el texto para que no pase de max_tokens (se quedan los primeros)
+    """
+    if contar_tokens(texto, modelo) <= max_tokens:
+        return texto
+    if tiktoken is None:
+        return texto[:max_tokens * 4]
+    codificador = _codificador(modelo or settings.OPENAI_MODEL)
+    return codificador.decode(codificador.encode(texto)[:max_tokens])
+
+
+def inicio_ventana(historial, presupuesto=None, desde=0, modelo=None):
+    """
+    Índice del primer mensaje de historial[desde:] que entra en la ventana:
+    los más recientes cuyo total no pasa del presupuesto de tokens
+    """
+    presupuesto = settings.HISTORIAL_MAX_TOKENS if presupuesto is None else presupuesto
+    usados = 0
+    inicio = len(historial)
+    while inicio > desde:
+        usados += tokens_mensaje(historial[inicio - 1], modelo)
+        if usados > presupuesto:
+            break
+        inicio -= 1
+    return inicio
+
+
+def ventana_historial(historial, resumen=None, presupuesto=None, modelo=None):
+    """
+    Mensajes del historial que se envían a OpenAI
+
+    Args:
+        historial: Lista de mensajes [{"role": "user/assistant", "content": "..."}]
+        resumen: Resumen de los mensajes más antiguos (esos ya no se envían)
+        presupuesto: Máximo de tokens del historial (por defecto settings.HISTORIAL_MAX_TOKENS)
+
+    Returns:
+        Lista con los mensajes más recientes que entran en el presupuesto y,
+        con RESUMEN_ACTIVO, los anteriores que todavía no están en el resumen
+    """
+    if not historial:
+        return []
+    presupuesto = settings.HISTORIAL_MAX_TOKENS if presupuesto is None else presupuesto
+    desde = min(resumen.mensajes, len(historial)) if resumen else 0
+    inicio = inicio_ventana(historial, presupuesto, desde, modelo)
+    if settings.RESUMEN_ACTIVO:
+        # historial[desde:inicio] se resume en segundo plano (programar_resumen):
+        # hasta entonces va completo
+        inicio = max(desde, inicio - settings.RESUMEN_LOTE * MAX_SIN_RESUMIR_LOTES)
+    ventana = historial[inicio:]
+    if not ventana and inicio > desde:
+        # Ni el último mensaje entra entero: se envía recortado
+        ultimo = historial[-1]
+        contenido = recortar_texto(ultimo['content'], max(presupuesto - TOKENS_POR_MENSAJE, 0), modelo)
+        ventana = [{"role": ultimo['role'], "content": contenido}]
+    return ventana
+
+
+def mensaje_resumen(resumen):
+    return {
+        "role": "system",
+        "content": f"Resumen de la conversación hasta ahora: {resumen.texto}",
+    }
+
+
+def _cache():
+    return caches[settings.CONVERSACION_CACHE_ALIAS]
+
+
+def obtener_resumen(call_sid):
+    """
+    Resumen vigente de la llamada, o None si todavía no hay
+    """
+    if not call_sid or not settings.RESUMEN_ACTIVO:
+        return None
+    datos = _cache().get(PREFIJO_CACHE + call_sid)
+    return Resumen(*datos) if datos else None
+
+
+async def obtener_resumen_async(call_sid):
+    if not call_sid or not settings.RESUMEN_ACTIVO:
+        return None
+    datos = await _cache().aget(PREFIJO_CACHE + call_sid)
+    return Resumen(*datos) if datos else None
+
+
+def borrar_resumen(call_sid):
+    if call_sid:
+        _cache().delete(PREFIJO_CACHE + call_sid)
+
+
+def resumir(resumen_anterior, mensajes):
+    """
+    Pide a OpenAI un resumen que combine el resumen anterior con los mensajes nuevos
+
+    Returns:
+        Texto del resumen, o None si no se pudo generar
+    """
+    client = obtener_cliente_openai()
+    if not client:
+        return None
+    lineas = []
+    if resumen_anterior:
+        lineas.append(f"Resumen anterior: {resumen_anterior}")
+    for mensaje in mensajes:
+        rol = 'Usuario' if mensaje['role'] == 'user' else 'Asistente'
+        lineas.append(f"{rol}: {mensaje['content']}")
+    response = client.chat.completions.create(
+        model=settings.OPENAI_MODEL_RESUMEN,
+        messages=[
+            {"role": "system", "content": PROMPT_RESUMEN},
+            {"role": "user", "content": "\n".join(lineas)},
+        ],
+        max_tokens=settings.RESUMEN_MAX_TOKENS,
+        temperature=0.3,
+    )
+    texto = (response.choices[0].message.content or '').strip()
+    return texto or None
+
+
+_executor = None
+_en_curso = set()
+_lock = threading.Lock()
+
+
+def _obtener_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.RESUMEN_WORKERS, thread_name_prefix='resumen')
+    return _executor
+
+
+def programar_resumen(call_sid, historial, resumen=None):
+    """
+    Si quedaron al menos RESUMEN_LOTE mensajes fuera de la ventana sin resumir,
+    encarga el resumen a un hilo de fondo. No bloquea: se llama al final del turno
+
+    Returns:
+        True si se programó un resumen
+    """
+    if not call_sid or not settings.RESUMEN_ACTIVO:
+        return False
+    desde = resumen.mensajes if resumen else 0
+    hasta = inicio_ventana(historial, desde=desde)
+    if hasta - desde < settings.RESUMEN_LOTE:
+        return False
+
+    with _lock:
+        if call_sid in _en_curso:
+            return False
+        _en_curso.add(call_sid)
+        executor = _obtener_executor()
+    executor.submit(
+        _actualizar_resumen, call_sid, resumen.texto if resumen else '', list(historial[desde:hasta]), hasta
+    )
+    return True
+
+
+def _actualizar_resumen(call_sid, resumen_anterior, mensajes, hasta):
+    try:
+        texto = resumir(resumen_anterior, mensajes)
+        if texto:
+            texto = recortar_texto(texto, settings.RESUMEN_MAX_TOKENS)
+            _cache().set(PREFIJO_CACHE + call_sid, (texto, hasta), settings.CONVERSACION_TTL)
+            logger.info("Resumen actualizado", extra={
+                'call_sid': call_sid, 'mensajes_resumidos': hasta, 'tokens_resumen': contar_tokens(texto),
+            })
+    except Exception:
+        logger.exception("Error al resumir la conversación", extra={'call_sid': call_sid})
+    finally:
+        with _lock:
+            _en_curso.discard(call_sid)
@@ -0,0 +1,173 @@
+"""
+Estado de las conversaciones en curso, indexado por CallSid
+
+Cada turno del webhook necesita el historial listo para enviar a OpenAI. En
+lugar de consultarlo en la base de datos en cada turno, se mantiene en un
+almacén en memoria/caché y se le agregan los mensajes nuevos de forma
+incremental. La base de datos sigue siendo el registro definitivo: si el
+almacén no tiene la llamada (reinicio, expulsión LRU, otro nodo) se reconstruye
+desde ahí una sola vez.
+
+El almacén se elige en settings.CONVERSACION_ALMACEN:
+    llamadas.conversaciones.AlmacenCache (por defecto): caché de Django
+        (Redis/Memcached), compartido entre workers y nodos
+    llamadas.conversaciones.AlmacenLRU: en memoria del proceso, solo con un
+        único worker. Con varios, cada uno tendría su propia copia: un turno
+        atendido por otro worker la deja desactualizada y
+        finalizar_conversacion solo borra la del worker que la recibe
+
+Estado de una conversación:
+    {'llamada_id': 1, 'sid': 'CA...', 'estado': 'en_progreso', 'turno': 1,
+     'mensajes': [{'role': 'user', 'content': '...'}, ...]}
+
+'turno' es la cantidad de respuestas de la IA (ver tokens.py).
+"""
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+from .contexto import borrar_resumen
+from .estados import actualizar_estado_llamada
+
+
+def _agregar(estado, mensajes):
+    estado['mensajes'].extend(mensajes)
+    estado['turno'] = estado.get('turno', 0) + sum(1 for m in mensajes if m['role'] == 'assistant')
+
+
+class AlmacenLRU:
+    """Almacén en memoria del proceso con expulsión LRU"""
+
+    def __init__(self, max_llamadas=None):
+        self.max_llamadas = max_llamadas or settings.CONVERSACION_LRU_MAX
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, call_sid):
+        with self._lock:
+            estado = self._datos.get(call_sid)
+            if estado is not None:
+                self._datos.move_to_end(call_sid)
+            return estado
+
+    def guardar(self, call_sid, estado):
+        with self._lock:
+            self._datos[call_sid] = estado
+            self._datos.move_to_end(call_sid)
+            while len(self._datos) > self.max_llamadas:
+                self._datos.popitem(last=False)
+
+    def agregar_mensajes(self, call_sid, mensajes):
+        with self._lock:
+            estado = self._datos.get(call_sid)
+            if estado is not None:
+                _agregar(estado, mensajes)
+            return estado
+
+    def eliminar(self, call_sid):
+        with self._lock:
+            self._datos.pop(call_sid, None)
+
+
+class AlmacenCache:
+    """Almacén sobre el framework de caché de Django (compartido entre procesos)"""
+
+    prefijo = 'conversacion:'
+
+    def __init__(self, alias=None, timeout=None):
+        self.cache = caches[alias or settings.CONVERSACION_CACHE_ALIAS]
+        self.timeout = timeout or settings.CONVERSACION_TTL
+
+    def obtener(self, call_sid):
+        return self.cache.get(self.prefijo + call_sid)
+
+    def guardar(self, call_sid, estado):
+        self.cache.set(self.prefijo + call_sid, estado, self.timeout)
+
+    def agregar_mensajes(self, call_sid, mensajes):
+        # Twilio no envía dos turnos de la misma llamada a la vez, así que
+        # leer-modificar-escribir no compite consigo mismo
+        estado = self.obtener(call_sid)
+        if estado is not None:
+            _agregar(estado, mensajes)
+            self.guardar(call_sid, estado)
+        return estado
+
+    def eliminar(self, call_sid):
+        self.cache.delete(self.prefijo + call_sid)
+
+
+_almacen = None
+_almacen_lock = threading.Lock()
+
+
+def obtener_almacen():
+    global _almacen
+    if _almacen is None:
+        with _almacen_lock:
+            if _almacen is None:
+                _almacen = import_string(settings.CONVERSACION_ALMACEN)()
+    return _almacen
+
+
+def obtener_conversacion(call_sid):
+    """
+    Estado de la conversación en el almacén, o None si no está (no toca la BD)
+    """
+    if not call_sid:
+        return None
+    return obtener_almacen().obtener(call_sid)
+
+
+def cargar_conversacion(llamada):
+    """
+    Reconstruye el estado de una llamada desde la base de datos y lo guarda
+    en el almacén. Se usa solo cuando obtener_conversacion no lo encuentra
+    """
+    mensajes = [
+        {"role": "user" if tipo == "usuario" else "assistant", "content": contenido}
+        for tipo, contenido in llamada.mensajes.order_by('timestamp', 'pk').values_list('tipo', 'contenido')
+    ]
+    estado = {
+        'llamada_id': llamada.pk,
+        'sid': llamada.sid,
+        'estado': llamada.estado,
+        'turno': sum(1 for m in mensajes if m['role'] == 'assistant'),
+        'mensajes': mensajes,
+    }
+    obtener_almacen().guardar(llamada.sid, estado)
+    return estado
+
+
+def agregar_mensajes(conversacion, mensajes):
+    """
+    Agrega mensajes nuevos ({"role", "content"}) al historial de la conversación
+    """
+    if obtener_almacen().agregar_mensajes(conversacion['sid'], mensajes) is None:
+        # La entrada expiró entre medio: se guarda la copia local actualizada
+        _agregar(conversacion, mensajes)
+        obtener_almacen().guardar(conversacion['sid'], conversacion)
+
+
+def actualizar_estado(conversacion, estado):
+    """
+    Actualiza Llamada.estado solo si cambió: los estados intermedios pasan por
+    el buffer de escritura diferida (ver estados.py)
+    """
+    if conversacion['estado'] == estado:
+        return
+    actualizar_estado_llamada(conversacion['llamada_id'], estado)
+    conversacion['estado'] = estado
+    obtener_almacen().guardar(conversacion['sid'], conversacion)
+
+
+def finalizar_conversacion(call_sid):
+    """
+    Libera el estado de una llamada que terminó
+    """
+    if call_sid:
+        obtener_almacen().eliminar(call_sid)
+        borrar_resumen(call_sid)
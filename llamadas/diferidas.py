@@ -0,0 +1,214 @@
+"""
+Respuestas diferidas: enmascarar la latencia del LLM con un mensaje de relleno
+
+Con settings.RELLENO_ACTIVO el turno de voz (pedir la respuesta a OpenAI y
+guardarla) se lanza en segundo plano y el webhook espera como mucho
+RELLENO_ESPERA segundos. Si la respuesta llega a tiempo se contesta como
+siempre; si no, se devuelve un <Say> corto de relleno y un <Redirect> a
+webhook_resultado con la clave del turno. Ese endpoint vuelve a esperar hasta
+RELLENO_ESPERA segundos y devuelve la respuesta terminada o más relleno, hasta
+RELLENO_MAX_ESPERAS veces. Así el webhook responde en un tiempo acotado aunque
+OpenAI tarde, y el llamante no escucha silencio.
+
+El resultado de cada turno se guarda en la caché de Django ("diferida:<clave>")
+para que el <Redirect> lo encuentre aunque lo atienda otro worker; con varios
+procesos hace falta una caché compartida (REDIS_URL). Dentro del mismo proceso
+se espera directamente al futuro o a la tarea, sin consultar la caché.
+
+Si después de RELLENO_MAX_ESPERAS la respuesta sigue sin estar, el llamante
+escucha que se repita la pregunta y la respuesta tardía nunca se dice: no
+debe quedar en el historial ni en la transcripción. El turno, antes de
+guardar, llama a reclamar_entrega(); webhook_resultado, antes de rendirse,
+llama a abandonar(). Las dos toman la misma clave con cache.add(), así que
+gana la primera: o el turno se guarda y el webhook espera su respuesta para
+decirla, o el webhook se rinde y el turno descarta la respuesta.
+
+El TiempoTurno de un turno diferido (ver metricas.py) lo guarda el propio
+turno al terminar, no el webhook que respondió con el relleno.
+"""
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import close_old_connections
+
+from .metricas import diferir_turno, terminar_turno_diferido, terminar_turno_diferido_async
+
+
+logger = logging.getLogger(__name__)
+
+
+PREFIJO_CACHE = 'diferida:'
+PREFIJO_DESTINO = 'diferida-destino:'
+
+# Cada cuánto se consulta la caché cuando el turno corre en otro proceso (segundos)
+INTERVALO_CONSULTA = 0.1
+
+_executor = None
+_executor_lock = threading.Lock()
+# clave -> Future / asyncio.Task de los turnos lanzados en este proceso
+_pendientes = {}
+# Clave del turno diferido que se está ejecutando (para reclamar_entrega)
+_clave_actual = contextvars.ContextVar('clave_diferida', default=None)
+
+
+def _cache():
+    return caches[settings.CONVERSACION_CACHE_ALIAS]
+
+
+def _obtener_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=settings.RELLENO_WORKERS, thread_name_prefix='diferida')
+    return _executor
+
+
+def _guardar_resultado(clave, resultado):
+    _cache().set(PREFIJO_CACHE + clave, {'resultado': resultado}, settings.RELLENO_TTL)
+
+
+def _ejecutar(clave, funcion, args):
+    _clave_actual.set(clave)
+    try:
+        resultado = funcion(*args)
+    except Exception:
+        logger.exception("Error en turno diferido", extra={'clave': clave})
+        resultado = None
+    finally:
+        terminar_turno_diferido()
+        # Hilo fuera del ciclo de request: liberar la conexión a la BD
+        close_old_connections()
+    _guardar_resultado(clave, resultado)
+    _pendientes.pop(clave, None)
+    return resultado
+
+
+def iniciar(funcion, *args):
+    """
+    Lanza funcion(*args) en segundo plano
+
+    Returns:
+        Clave del turno, para esperar() o para la URL del <Redirect>
+    """
+    clave = uuid.uuid4().hex
+    diferir_turno()
+    # Con el contexto del request, para que los registros del turno lleven su
+    # CallSid y sus etapas se sumen al turno que abrió medir_turno
+    contexto = contextvars.copy_context()
+    _pendientes[clave] = _obtener_executor().submit(contexto.run, _ejecutar, clave, funcion, args)
+    return clave
+
+
+def esperar(clave, plazo=None):
+    """
+    Espera el resultado de un turno como mucho `plazo` segundos
+
+    Returns:
+        (listo, resultado): resultado es None si el turno falló
+    """
+    plazo = settings.RELLENO_ESPERA if plazo is None else plazo
+    futuro = _pendientes.get(clave)
+    if isinstance(futuro, Future):
+        try:
+            return True, futuro.result(timeout=plazo)
+        except TimeoutError:
+            return False, None
+
+    # Lanzado en otro proceso (o ya terminado): se consulta la caché
+    limite = time.monotonic() + plazo
+    while True:
+        datos = _cache().get(PREFIJO_CACHE + clave)
+        if datos is not None:
+            return True, datos['resultado']
+        if time.monotonic() >= limite:
+            return False, None
+        time.sleep(INTERVALO_CONSULTA)
+
+
+async def _ejecutar_async(clave, corrutina):
+    _clave_actual.set(clave)
+    try:
+        resultado = await corrutina
+    except Exception:
+        logger.exception("Error en turno diferido", extra={'clave': clave})
+        resultado = None
+    await terminar_turno_diferido_async()
+    await _cache().aset(PREFIJO_CACHE + clave, {'resultado': resultado}, settings.RELLENO_TTL)
+    _pendientes.pop(clave, None)
+    return resultado
+
+
+def iniciar_async(corrutina):
+    """
+    Versión asíncrona de iniciar(): la corrutina sigue corriendo en el event
+    loop aunque el webhook ya haya respondido con el relleno
+    """
+    clave = uuid.uuid4().hex
+    diferir_turno()
+    _pendientes[clave] = asyncio.ensure_future(_ejecutar_async(clave, corrutina))
+    return clave
+
+
+async def esperar_async(clave, plazo=None):
+    plazo = settings.RELLENO_ESPERA if plazo is None else plazo
+    tarea = _pendientes.get(clave)
+    if isinstance(tarea, asyncio.Future):
+        try:
+            # shield: que vencer el plazo no cancele el turno
+            return True, await asyncio.wait_for(asyncio.shield(tarea), plazo)
+        except asyncio.TimeoutError:
+            return False, None
+
+    limite = time.monotonic() + plazo
+    while True:
+        datos = await _cache().aget(PREFIJO_CACHE + clave)
+        if datos is not None:
+            return True, datos['resultado']
+        if time.monotonic() >= limite:
+            return False, None
+        await asyncio.sleep(INTERVALO_CONSULTA)
+
+
+def reclamar_entrega():
+    """
+    Desde el turno, antes de guardar la respuesta: True si el llamante la va a
+    escuchar (o el turno no es diferido), False si el webhook ya se rindió
+    """
+    clave = _clave_actual.get()
+    if clave is None:
+        return True
+    return _cache().add(PREFIJO_DESTINO + clave, 'entregada', settings.RELLENO_TTL)
+
+
+async def reclamar_entrega_async():
+    clave = _clave_actual.get()
+    if clave is None:
+        return True
+    return await _cache().aadd(PREFIJO_DESTINO + clave, 'entregada', settings.RELLENO_TTL)
+
+
+def abandonar(clave):
+    """
+    Desde el webhook, cuando ya no quedan esperas: descarta la respuesta del
+    turno, salvo que el turno ya la esté guardando; en ese caso la espera
+
+    Returns:
+        (listo, resultado) como esperar()
+    """
+    if _cache().add(PREFIJO_DESTINO + clave, 'abandonada', settings.RELLENO_TTL):
+        return False, None
+    return esperar(clave)
+
+
+async def abandonar_async(clave):
+    if await _cache().aadd(PREFIJO_DESTINO + clave, 'abandonada', settings.RELLENO_TTL):
+        return False, None
+    return await esperar_async(clave)
@@ -0,0 +1,123 @@
+"""
+Estadísticas de llamadas mantenidas de forma incremental
+
+EstadisticaLlamadas guarda, por hora de creación, estado y número de origen,
+cuántas llamadas hubo y la suma de sus duraciones. Se actualiza en el momento
+en que ocurre cada hecho:
+
+    - al crear una llamada (iniciar_llamada, campañas, llamadas entrantes):
+      +1 en la fila 'iniciada' de su hora
+    - cuando webhook_status la da por terminada: +1 y su duración en la fila
+      de su estado final (completada, fallida o cancelada) de la misma hora
+
+Cada hecho es un UPDATE con F() sobre una sola fila, y el panel de
+estadísticas lee solo esta tabla, cuyo tamaño depende de las horas y los
+números de origen y no de la cantidad de llamadas. Para reconstruirla desde
+Llamada (datos anteriores o una corrección): python manage.py recalcular_estadisticas
+"""
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import EstadisticaLlamadas
+
+
+ESTADO_INICIADA = 'iniciada'
+ESTADOS_FINALES = ('completada', 'fallida', 'cancelada')
+
+
+def truncar_hora(fecha):
+    return fecha.replace(minute=0, second=0, microsecond=0)
+
+
+def _sumar(hora, estado, numero_origen, duracion=0):
+    """
+    +1 llamada (y su duración) en la fila (hora, estado, origen), creándola si hace falta
+    """
+    filtro = {'hora': hora, 'estado': estado, 'numero_origen': numero_origen}
+    cambios = {'llamadas': F('llamadas') + 1, 'duracion_total': F('duracion_total') + duracion}
+    if EstadisticaLlamadas.objects.filter(**filtro).update(**cambios):
+        return
+    try:
+        with transaction.atomic():
+            EstadisticaLlamadas.objects.create(**filtro, llamadas=1, duracion_total=duracion)
+    except IntegrityError:
+        # Otro worker creó la fila entre el UPDATE y el INSERT
+        EstadisticaLlamadas.objects.filter(**filtro).update(**cambios)
+
+
+async def _sumar_async(hora, estado, numero_origen, duracion=0):
+    filtro = {'hora': hora, 'estado': estado, 'numero_origen': numero_origen}
+    cambios = {'llamadas': F('llamadas') + 1, 'duracion_total': F('duracion_total') + duracion}
+    if await EstadisticaLlamadas.objects.filter(**filtro).aupdate(**cambios):
+        return
+    try:
+        await EstadisticaLlamadas.objects.acreate(**filtro, llamadas=1, duracion_total=duracion)
+    except IntegrityError:
+        await EstadisticaLlamadas.objects.filter(**filtro).aupdate(**cambios)
+
+
+def registrar_inicio(llamada):
+    """Cuenta una llamada recién creada"""
+    _sumar(truncar_hora(llamada.fecha_creacion), ESTADO_INICIADA, llamada.numero_origen)
+
+
+async def registrar_inicio_async(llamada):
+    await _sumar_async(truncar_hora(llamada.fecha_creacion), ESTADO_INICIADA, llamada.numero_origen)
+
+
+def descontar_inicio(llamada):
+    """Resta una llamada contada con registrar_inicio que se descarta (duplicada)"""
+    EstadisticaLlamadas.objects.filter(
+        hora=truncar_hora(llamada.fecha_creacion), estado=ESTADO_INICIADA,
+        numero_origen=llamada.numero_origen, llamadas__gt=0,
+    ).update(llamadas=F('llamadas') - 1)
+
+
+def registrar_fin(llamada, estado, duracion):
+    """
+    Cuenta una llamada terminada en su hora de creación. El llamador garantiza
+    que se cuenta una sola vez (ver webhook_status)
+    """
+    if estado in ESTADOS_FINALES:
+        _sumar(truncar_hora(llamada.fecha_creacion), estado, llamada.numero_origen, duracion)
+
+
+def resumen_estadisticas(horas=24, ahora=None):
+    """
+    Datos del panel para las últimas `horas` horas, leídos solo de los agregados
+
+    Returns:
+        Diccionario con los totales por estado, la duración media de las
+        completadas, las llamadas por hora y por número de origen
+    """
+    ahora = ahora or timezone.now()
+    desde = truncar_hora(ahora) - timedelta(hours=horas - 1)
+    filas = EstadisticaLlamadas.objects.filter(hora__gte=desde)
+
+    por_estado = {
+        fila['estado']: fila
+        for fila in filas.values('estado').annotate(llamadas=Sum('llamadas'), duracion=Sum('duracion_total'))
+    }
+    completadas = por_estado.get('completada', {})
+    duracion_media = completadas['duracion'] / completadas['llamadas'] if completadas.get('llamadas') else 0
+
+    por_hora = {hora: 0 for hora in (desde + timedelta(hours=i) for i in range(horas))}
+    for fila in filas.filter(estado=ESTADO_INICIADA).values('hora').annotate(llamadas=Sum('llamadas')):
+        por_hora[fila['hora']] = fila['llamadas']
+
+    por_origen = {}
+    for fila in filas.values('numero_origen', 'estado').annotate(llamadas=Sum('llamadas')):
+        por_origen.setdefault(fila['numero_origen'], {})[fila['estado']] = fila['llamadas']
+
+    return {
+        'desde': desde,
+        'total': por_estado.get(ESTADO_INICIADA, {}).get('llamadas', 0),
+        'por_estado': {estado: por_estado.get(estado, {}).get('llamadas', 0) for estado in ESTADOS_FINALES},
+        'duracion_media': duracion_media,
+        'por_hora': sorted(por_hora.items()),
+        'max_por_hora': max(por_hora.values(), default=0),
+        'por_origen': sorted(por_origen.items()),
+    }
@@ -0,0 +1,178 @@
+"""
+Escritura diferida (write-behind) de Llamada.estado
+
+Cada petición del webhook de voz puede cambiar el estado de su llamada
+(ringing -> iniciada, in-progress -> en_progreso). Con campañas grandes ese
+UPDATE por petición se vuelve el camino de escritura más caliente sobre la
+tabla de llamadas. Con ESTADOS_DIFERIDOS los cambios intermedios se anotan en
+un buffer en memoria, que guarda solo el último valor de cada llamada; un hilo
+los escribe cada ESTADOS_INTERVALO segundos, o antes si se juntan
+ESTADOS_LOTE llamadas, con un solo UPDATE ... CASE WHEN por lote.
+
+Los estados finales (completada, fallida, cancelada) se siguen escribiendo
+en el momento: webhook_status los usa para contar la llamada una sola vez en
+las estadísticas y para liberar su lugar en la campaña. El UPDATE del buffer
+excluye las llamadas que ya están en un estado final, así que un cambio
+intermedio que se escribe tarde nunca pisa el final.
+
+El buffer se vacía al terminar el proceso (atexit). La cantidad de cambios
+pendientes y la duración de cada escritura se exponen en /metrics.
+"""
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Case, F, Value, When
+
+from .estadisticas import ESTADOS_FINALES
+from .metricas import histograma, registrar_indicador
+from .models import Llamada
+
+
+logger = logging.getLogger(__name__)
+
+
+def escribir_cambios(cambios):
+    """
+    Escribe los cambios de varias llamadas en un solo UPDATE, sin tocar las
+    que ya terminaron
+
+    Args:
+        cambios: {llamada_id: {campo: valor}}
+
+    Returns:
+        Filas actualizadas
+    """
+    campos = sorted({campo for valores in cambios.values() for campo in valores})
+    actualizacion = {
+        campo: Case(
+            *[When(pk=pk, then=Value(valores[campo])) for pk, valores in cambios.items() if campo in valores],
+            default=F(campo),
+            output_field=Llamada._meta.get_field(campo),
+        )
+        for campo in campos
+    }
+    return Llamada.objects.filter(pk__in=list(cambios)).exclude(estado__in=ESTADOS_FINALES).update(**actualizacion)
+
+
+class BufferEstados:
+    """
+    Cambios pendientes por llamada, escritos por lotes desde un hilo aparte
+    """
+
+    def __init__(self, intervalo=None, lote=None):
+        self.intervalo = intervalo or settings.ESTADOS_INTERVALO
+        self.lote = lote or settings.ESTADOS_LOTE
+        self.escritas = 0
+        self._pendientes = {}
+        self._condicion = threading.Condition()
+        self._activo = True
+        self._hilo = threading.Thread(target=self._ejecutar, name='escritor-estados', daemon=True)
+        self._hilo.start()
+        atexit.register(self.detener)
+
+    def registrar(self, llamada_id, **campos):
+        """
+        Anota los campos nuevos de la llamada; pisan a los pendientes
+        """
+        with self._condicion:
+            self._pendientes.setdefault(llamada_id, {}).update(campos)
+            if len(self._pendientes) >= self.lote:
+                self._condicion.notify()
+
+    def pendientes(self):
+        with self._condicion:
+            return len(self._pendientes)
+
+    def vaciar(self):
+        """
+        Escribe ahora todos los cambios pendientes
+        """
+        with self._condicion:
+            cambios, self._pendientes = self._pendientes, {}
+        if not cambios:
+            return
+        inicio = time.perf_counter()
+        try:
+            ids = list(cambios)
+            for i in range(0, len(ids), self.lote):
+                self.escritas += escribir_cambios({pk: cambios[pk] for pk in ids[i:i + self.lote]})
+        except Exception:
+            logger.exception("No se pudieron escribir los estados pendientes", extra={'llamadas': len(cambios)})
+            # Se reintentan en la próxima vuelta, salvo lo que ya se haya vuelto a cambiar
+            with self._condicion:
+                for pk, campos in cambios.items():
+                    self._pendientes[pk] = {**campos, **self._pendientes.get(pk, {})}
+        finally:
+            histograma('escritura_estados').observar(time.perf_counter() - inicio)
+
+    def _ejecutar(self):
+        while self._activo:
+            with self._condicion:
+                if len(self._pendientes) < self.lote:
+                    self._condicion.wait(self.intervalo)
+            self.vaciar()
+            # Hilo fuera del ciclo de request: liberar la conexión a la BD
+            close_old_connections()
+
+    def detener(self):
+        """
+        Detiene el hilo y escribe lo que quede pendiente
+        """
+        if not self._activo:
+            return
+        self._activo = False
+        with self._condicion:
+            self._condicion.notify()
+        self._hilo.join(timeout=5)
+        self.vaciar()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def obtener_buffer():
+    """
+    Buffer del proceso, o None si ESTADOS_DIFERIDOS está desactivado
+    """
+    global _buffer
+    if not settings.ESTADOS_DIFERIDOS:
+        return None
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = BufferEstados()
+    return _buffer
+
+
+def actualizar_estado_llamada(llamada_id, estado):
+    """
+    Actualiza Llamada.estado: en el buffer si es intermedio, en el momento si es final
+    """
+    buffer = obtener_buffer()
+    if buffer is None or estado in ESTADOS_FINALES:
+        Llamada.objects.filter(pk=llamada_id).update(estado=estado)
+    else:
+        buffer.registrar(llamada_id, estado=estado)
+
+
+def _pendientes():
+    return _buffer.pendientes() if _buffer is not None else 0
+
+
+def _escritas():
+    return _buffer.escritas if _buffer is not None else 0
+
+
+registrar_indicador(
+    'noxus_estados_pendientes', 'gauge',
+    'Llamadas con cambios de estado esperando en el buffer de escritura diferida', _pendientes,
+)
+registrar_indicador(
+    'noxus_estados_escritos_total', 'counter',
+    'Filas de llamadas actualizadas por el buffer de escritura diferida', _escritas,
+)
@@ -0,0 +1,159 @@
+"""
+Exportación masiva de llamadas y conversaciones en CSV o JSONL
+
+Las llamadas se recorren por lotes de clave primaria (keyset, como
+reconstruir_transcripciones) y los mensajes de cada lote se piden en una sola
+consulta sobre el índice (llamada, timestamp), así que la memoria depende del
+tamaño del lote y no del total exportado. Los mensajes de las llamadas
+archivadas se leen descomprimidos del archivo (ver archivo.py).
+
+    CSV:   una fila por mensaje con las columnas de su llamada (las llamadas
+           sin mensajes salen en una fila con las columnas de mensaje vacías)
+    JSONL: una línea por llamada con sus mensajes en "mensajes"
+
+La usan la vista api.exportar (StreamingHttpResponse) y el comando
+exportar_llamadas.
+"""
+import csv
+import json
+from datetime import datetime, time as dtime, timedelta
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .archivo import descomprimir
+from .models import ConversacionArchivada, Llamada, MensajeConversacion
+
+
+FORMATOS = ('csv', 'jsonl')
+CAMPOS_LLAMADA = (
+    'id', 'sid', 'numero_destino', 'numero_origen', 'estado', 'duracion',
+    'fecha_creacion', 'fecha_inicio', 'fecha_fin',
+)
+CAMPOS_MENSAJE = ('tipo', 'contenido', 'timestamp')
+COLUMNAS_CSV = [f"llamada_{campo}" for campo in CAMPOS_LLAMADA] + [f"mensaje_{campo}" for campo in CAMPOS_MENSAJE]
+LOTE_DEFECTO = 500
+
+
+def _fecha(valor, fin_del_dia=False):
+    fecha_hora = parse_datetime(valor)
+    if fecha_hora is None:
+        fecha = parse_date(valor)
+        if fecha is None:
+            raise ValueError(f"Fecha inválida: {valor} (usar AAAA-MM-DD o ISO 8601)")
+        # "hasta 2024-01-31" incluye todo ese día
+        fecha_hora = datetime.combine(fecha + timedelta(days=1) if fin_del_dia else fecha, dtime.min)
+    if timezone.is_naive(fecha_hora):
+        fecha_hora = timezone.make_aware(fecha_hora)
+    return fecha_hora
+
+
+def filtrar_llamadas(desde='', hasta='', estados=()):
+    """
+    Llamadas a exportar
+
+    Args:
+        desde: Fecha (AAAA-MM-DD) o fecha y hora ISO 8601 desde la que se exporta, inclusive
+        hasta: Fecha hasta la que se exporta, inclusive, o fecha y hora ISO 8601 (exclusiva)
+        estados: Estados de Llamada a incluir (vacío = todos)
+
+    Raises:
+        ValueError: Si una fecha o un estado no son válidos
+    """
+    llamadas = Llamada.objects.all()
+    if desde:
+        llamadas = llamadas.filter(fecha_creacion__gte=_fecha(desde))
+    if hasta:
+        llamadas = llamadas.filter(fecha_creacion__lt=_fecha(hasta, fin_del_dia=True))
+    if estados:
+        validos = {estado for estado, _ in Llamada.ESTADO_CHOICES}
+        invalidos = set(estados) - validos
+        if invalidos:
+            raise ValueError(f"Estado inválido: {', '.join(sorted(invalidos))}; válidos: {', '.join(sorted(validos))}")
+        llamadas = llamadas.filter(estado__in=estados)
+    return llamadas
+
+
+def _lotes(llamadas, lote):
+    """
+    Lotes de (llamada, [mensajes]) en orden de clave primaria
+    """
+    ultimo_id = 0
+    while True:
+        filas = list(llamadas.filter(pk__gt=ultimo_id).order_by('pk').values(*CAMPOS_LLAMADA)[:lote])
+        if not filas:
+            return
+        ultimo_id = filas[-1]['id']
+        ids = [fila['id'] for fila in filas]
+
+        mensajes = {pk: [] for pk in ids}
+        consulta = (
+            MensajeConversacion.objects.filter(llamada_id__in=ids)
+            .order_by('llamada_id', 'timestamp', 'pk')
+            .values_list('llamada_id', *CAMPOS_MENSAJE)
+        )
+        for llamada_id, tipo, contenido, fecha in consulta:
+            mensajes[llamada_id].append({'tipo': tipo, 'contenido': contenido, 'timestamp': fecha})
+        for archivo in ConversacionArchivada.objects.filter(llamada_id__in=ids):
+            mensajes[archivo.llamada_id][:0] = descomprimir(archivo.datos, archivo.formato)
+
+        yield [(fila, mensajes[fila['id']]) for fila in filas]
+
+
+class _Eco:
+    """Pseudo-archivo para csv.writer: devuelve la línea en lugar de guardarla"""
+
+    def write(self, valor):
+        return valor
+
+
+def _valor_csv(valor):
+    return valor.isoformat() if isinstance(valor, datetime) else valor
+
+
+def generar_csv(llamadas, lote=LOTE_DEFECTO):
+    """
+    Genera el CSV por trozos (un trozo por lote de llamadas)
+    """
+    escritor = csv.writer(_Eco())
+    yield escritor.writerow(COLUMNAS_CSV)
+    for filas in _lotes(llamadas, lote):
+        partes = []
+        for llamada, mensajes in filas:
+            columnas = [_valor_csv(llamada[campo]) for campo in CAMPOS_LLAMADA]
+            if not mensajes:
+                partes.append(escritor.writerow(columnas + [''] * len(CAMPOS_MENSAJE)))
+            for mensaje in mensajes:
+                partes.append(escritor.writerow(columnas + [_valor_csv(mensaje[campo]) for campo in CAMPOS_MENSAJE]))
+        yield ''.join(partes)
+
+
+def generar_jsonl(llamadas, lote=LOTE_DEFECTO):
+    """
+    Genera el JSONL por trozos (un trozo por lote de llamadas)
+    """
+    for filas in _lotes(llamadas, lote):
+        yield ''.join(
+            json.dumps({**llamada, 'mensajes': mensajes}, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+            for llamada, mensajes in filas
+        )
+
+
+def generar(formato, llamadas, lote=LOTE_DEFECTO):
+    return generar_csv(llamadas, lote) if formato == 'csv' else generar_jsonl(llamadas, lote)
+
+
+async def generar_async(iterador):
+    """
+    Recorre un generador síncrono desde ASGI trozo a trozo: StreamingHttpResponse
+    con un iterador síncrono lo consumiría entero en memoria antes de enviarlo
+    """
+    siguiente = sync_to_async(next)
+    fin = object()
+    while True:
+        parte = await siguiente(iterador, fin)
+        if parte is fin:
+            return
+        yield parte
@@ -0,0 +1,214 @@
+"""
+Webhooks idempotentes ante los reintentos de Twilio
+
+Si el webhook tarda, Twilio repite el mismo POST (la acción del <Gather> con
+el mismo SpeechResult). Sin protección, el reintento que llega mientras el
+original sigue esperando a OpenAI pasa la comprobación del token de turno
+(tokens.py), porque el turno todavía no avanzó, y paga otra respuesta de la
+IA y otra escritura de mensajes.
+
+El decorador @idempotente identifica cada petición por CallSid y una huella
+de sus parámetros (método, ruta, POST y GET) y la procesa una sola vez:
+
+    - la primera toma la huella con cache.add() (atómico también entre
+      procesos) y, al terminar, guarda el TwiML en la caché durante
+      IDEMPOTENCIA_TTL segundos
+    - un duplicado que llega mientras la original está en curso espera su
+      resultado como mucho IDEMPOTENCIA_ESPERA segundos: en el mismo proceso
+      directamente, en otro consultando la caché (como diferidas.py)
+    - un duplicado de una petición terminada recibe el TwiML guardado
+
+Si la original no termina a tiempo (o falló sin respuesta), el duplicado se
+procesa normalmente; el token de turno sigue evitando repetir un turno ya
+respondido. Las peticiones sin CallSid no se deduplican. Se usa la caché
+CONVERSACION_CACHE_ALIAS; con varios procesos hace falta una compartida
+(REDIS_URL).
+"""
+import asyncio
+import functools
+import hashlib
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+
+
+logger = logging.getLogger(__name__)
+
+
+PREFIJO_CACHE = 'idem:'
+PREFIJO_EN_CURSO = 'idem-en-curso:'
+
+# Cada cuánto se consulta la caché cuando la original corre en otro proceso (segundos)
+INTERVALO_CONSULTA = 0.1
+
+# huella -> threading.Event / asyncio.Future de las peticiones en curso en este proceso
+_en_curso = {}
+_contadores = {'originales': 0, 'cache': 0, 'espera': 0, 'vencidos': 0}
+_contadores_lock = threading.Lock()
+
+
+def _cache():
+    return caches[settings.CONVERSACION_CACHE_ALIAS]
+
+
+def _contar(resultado):
+    with _contadores_lock:
+        _contadores[resultado] += 1
+
+
+def estadisticas():
+    """
+    Peticiones procesadas y duplicados resueltos desde la caché, esperando a la
+    original o procesados de nuevo porque la original no terminó a tiempo
+    """
+    with _contadores_lock:
+        return dict(_contadores)
+
+
+def huella(request):
+    """
+    Clave de la petición: CallSid y parámetros, o None si no trae CallSid
+    """
+    call_sid = request.POST.get('CallSid') or request.GET.get('CallSid', '')
+    if not call_sid:
+        return None
+    parametros = sorted(
+        (origen, clave, tuple(valores))
+        for origen, datos in (('POST', request.POST), ('GET', request.GET))
+        for clave, valores in datos.lists()
+    )
+    crudo = repr((request.method, request.path, parametros)).encode('utf-8')
+    return f"{call_sid}:{hashlib.sha256(crudo).hexdigest()}"
+
+
+def _respuesta(datos):
+    return HttpResponse(datos['contenido'], status=datos['status'], content_type=datos['tipo'])
+
+
+def _datos(response):
+    """
+    Lo que se guarda de la respuesta, o None si no se puede repetir
+    """
+    if response.streaming or response.status_code >= 500:
+        return None
+    return {'contenido': response.content, 'status': response.status_code, 'tipo': response['Content-Type']}
+
+
+def _esperar(clave):
+    evento = _en_curso.get(clave)
+    if isinstance(evento, threading.Event):
+        evento.wait(settings.IDEMPOTENCIA_ESPERA)
+        return _cache().get(PREFIJO_CACHE + clave)
+
+    # Original en otro proceso: se consulta la caché hasta que aparezca el
+    # resultado o se libere la huella sin él
+    limite = time.monotonic() + settings.IDEMPOTENCIA_ESPERA
+    while True:
+        datos = _cache().get(PREFIJO_CACHE + clave)
+        if datos is not None or _cache().get(PREFIJO_EN_CURSO + clave) is None:
+            return datos
+        if time.monotonic() >= limite:
+            return None
+        time.sleep(INTERVALO_CONSULTA)
+
+
+async def _esperar_async(clave):
+    futuro = _en_curso.get(clave)
+    if isinstance(futuro, asyncio.Future):
+        try:
+            await asyncio.wait_for(asyncio.shield(futuro), settings.IDEMPOTENCIA_ESPERA)
+        except asyncio.TimeoutError:
+            pass
+        return await _cache().aget(PREFIJO_CACHE + clave)
+
+    limite = time.monotonic() + settings.IDEMPOTENCIA_ESPERA
+    while True:
+        datos = await _cache().aget(PREFIJO_CACHE + clave)
+        if datos is not None or await _cache().aget(PREFIJO_EN_CURSO + clave) is None:
+            return datos
+        if time.monotonic() >= limite:
+            return None
+        await asyncio.sleep(INTERVALO_CONSULTA)
+
+
+def idempotente(view_func):
+    """
+    Decorador de los webhooks de voz: cada petición repetida de Twilio se
+    procesa una sola vez y los duplicados reciben la misma respuesta
+    """
+    if asyncio.iscoroutinefunction(view_func):
+        @functools.wraps(view_func)
+        async def wrapper_async(request, *args, **kwargs):
+            clave = huella(request) if settings.IDEMPOTENCIA_ACTIVA else None
+            if clave is None:
+                return await view_func(request, *args, **kwargs)
+
+            datos = await _cache().aget(PREFIJO_CACHE + clave)
+            if datos is not None:
+                _contar('cache')
+                logger.info("Reintento de Twilio respondido desde la caché")
+                return _respuesta(datos)
+
+            if not await _cache().aadd(PREFIJO_EN_CURSO + clave, 1, settings.IDEMPOTENCIA_ESPERA):
+                datos = await _esperar_async(clave)
+                if datos is not None:
+                    _contar('espera')
+                    logger.info("Reintento de Twilio respondido con el resultado de la petición original")
+                    return _respuesta(datos)
+                _contar('vencidos')
+                logger.warning("La petición original no terminó a tiempo, se procesa el reintento")
+                return await view_func(request, *args, **kwargs)
+
+            _contar('originales')
+            futuro = _en_curso[clave] = asyncio.get_running_loop().create_future()
+            try:
+                response = await view_func(request, *args, **kwargs)
+                datos = _datos(response)
+                if datos is not None:
+                    await _cache().aset(PREFIJO_CACHE + clave, datos, settings.IDEMPOTENCIA_TTL)
+                return response
+            finally:
+                await _cache().adelete(PREFIJO_EN_CURSO + clave)
+                _en_curso.pop(clave, None)
+                futuro.set_result(None)
+        return wrapper_async
+
+    @functools.wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        clave = huella(request) if settings.IDEMPOTENCIA_ACTIVA else None
+        if clave is None:
+            return view_func(request, *args, **kwargs)
+
+        datos = _cache().get(PREFIJO_CACHE + clave)
+        if datos is not None:
+            _contar('cache')
+            logger.info("Reintento de Twilio respondido desde la caché")
+            return _respuesta(datos)
+
+        if not _cache().add(PREFIJO_EN_CURSO + clave, 1, settings.IDEMPOTENCIA_ESPERA):
+            datos = _esperar(clave)
+            if datos is not None:
+                _contar('espera')
+                logger.info("Reintento de Twilio respondido con el resultado de la petición original")
+                return _respuesta(datos)
+            _contar('vencidos')
+            logger.warning("La petición original no terminó a tiempo, se procesa el reintento")
+            return view_func(request, *args, **kwargs)
+
+        _contar('originales')
+        evento = _en_curso[clave] = threading.Event()
+        try:
+            response = view_func(request, *args, **kwargs)
+            datos = _datos(response)
+            if datos is not None:
+                _cache().set(PREFIJO_CACHE + clave, datos, settings.IDEMPOTENCIA_TTL)
+            return response
+        finally:
+            _cache().delete(PREFIJO_EN_CURSO + clave)
+            _en_curso.pop(clave, None)
+            evento.set()
+    return wrapper
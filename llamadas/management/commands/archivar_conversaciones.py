@@ -0,0 +1,60 @@
+"""
+Compacta los mensajes de las llamadas antiguas en ConversacionArchivada
+
+    python manage.py archivar_conversaciones                 # llamadas de hace más de ARCHIVO_DIAS días
+    python manage.py archivar_conversaciones --dias 30 --lote 200 --pausa 0.5
+    python manage.py archivar_conversaciones --simular       # solo cuenta lo que se archivaría
+
+Cada lote de llamadas se archiva en su propia transacción (ver archivo.py),
+así que el comando se puede interrumpir y volver a ejecutar; --pausa deja
+respirar a la base de datos entre lotes. Pensado para correr a diario (cron).
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from llamadas.archivo import archivar_llamadas, formato_compresion, llamadas_para_archivar
+from llamadas.models import MensajeConversacion
+
+
+class Command(BaseCommand):
+    help = 'Archiva comprimidas las conversaciones de las llamadas antiguas y borra sus mensajes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, help='Antigüedad mínima en días (por defecto ARCHIVO_DIAS)')
+        parser.add_argument('--lote', type=int, default=200, help='Llamadas por transacción')
+        parser.add_argument('--pausa', type=float, default=0.0, help='Segundos de espera entre lotes')
+        parser.add_argument('--simular', action='store_true', help='No archivar, solo contar')
+
+    def handle(self, *args, **options):
+        llamadas = llamadas_para_archivar(options['dias']).order_by('pk')
+
+        if options['simular']:
+            total = llamadas.count()
+            mensajes = MensajeConversacion.objects.filter(llamada__in=llamadas).count()
+            self.stdout.write(f"Se archivarían {total} llamadas con {mensajes} mensajes")
+            return
+
+        formato = formato_compresion()
+        llamadas_total = mensajes_total = original_total = comprimido_total = 0
+        ultimo_id = 0
+        while True:
+            ids = list(llamadas.filter(pk__gt=ultimo_id).values_list('pk', flat=True)[:options['lote']])
+            if not ids:
+                break
+            ultimo_id = ids[-1]
+
+            mensajes, original, comprimido = archivar_llamadas(ids, formato)
+            llamadas_total += len(ids)
+            mensajes_total += mensajes
+            original_total += original
+            comprimido_total += comprimido
+            self.stdout.write(f"{llamadas_total} llamadas archivadas ({mensajes_total} mensajes)")
+            if options['pausa']:
+                time.sleep(options['pausa'])
+
+        ratio = original_total / comprimido_total if comprimido_total else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Archivadas {llamadas_total} llamadas y {mensajes_total} mensajes con {formato}: "
+            f"{original_total / 1024:.0f} KB -> {comprimido_total / 1024:.0f} KB ({ratio:.1f}x)"
+        ))
@@ -0,0 +1,344 @@
+"""
+Prueba de carga: N llamadas simultáneas por el flujo completo de Twilio
+
+    python manage.py benchmark_carga --llamadas 50 --turnos 5 --latencia 0.8 --workers 16
+    python manage.py benchmark_carga --async --llamadas 200 --salida carga.json
+    python manage.py benchmark_carga --comparar carga.json   # diferencias con una corrida anterior
+
+Cada llamada simulada recorre el mismo camino que una real: el webhook
+inicial (crea la llamada entrante), --turnos turnos con SpeechResult que
+envían el token del <Gather> anterior (y siguen el <Redirect> del relleno si
+RELLENO_ACTIVO), y el callback de estado "completed". OpenAI es un stub local
+con --latencia; el resto de la configuración es la de settings.
+
+Para cada fase (inicial, turno, estado) se reporta p50/p95/p99, errores y
+consultas a la base de datos por petición. Con --salida el resultado queda en
+JSON junto con el commit, los parámetros y la base de datos usada, para
+comparar corridas entre commits (--comparar). Las llamadas de prueba usan SID
+"CARGA-..." y el número de origen NUMERO_ORIGEN, y se borran al terminar.
+"""
+import asyncio
+import contextvars
+import html
+import json
+import logging
+import platform
+import re
+import subprocess
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import django
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection, connections
+from django.db.backends.signals import connection_created
+from django.test import AsyncRequestFactory, RequestFactory
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from llamadas import views
+from llamadas.management.commands.benchmark_webhook import percentil
+from llamadas.management.stub_openai import StubOpenAI
+from llamadas.models import EstadisticaLlamadas, Llamada
+
+
+PREFIJO_SID = 'CARGA-'
+# Número ficticio (rango 555): identifica las estadísticas de la prueba para borrarlas
+NUMERO_ORIGEN = '+15550000000'
+FASES = ('inicial', 'turno', 'estado')
+
+_GATHER = re.compile(r'<Gather[^>]*\saction="([^"]*)"')
+_REDIRECT = re.compile(r'<Redirect[^>]*>([^<]*)</Redirect>')
+
+# Contador de consultas de la petición en curso (sigue a sync_to_async y a los hilos con el contexto copiado)
+_consultas = contextvars.ContextVar('consultas_carga', default=None)
+
+
+def _contar_consulta(execute, sql, params, many, context):
+    contador = _consultas.get()
+    if contador is not None:
+        contador[0] += 1
+    return execute(sql, params, many, context)
+
+
+def _instalar_contador(sender, connection, **kwargs):
+    if _contar_consulta not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_contar_consulta)
+
+
+def _ruta(url):
+    """
+    Ruta y query de una URL del TwiML (absoluta, con el BASE_URL de la prueba)
+    """
+    partes = urlsplit(html.unescape(url))
+    return f"{partes.path}?{partes.query}" if partes.query else partes.path
+
+
+def _commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=5, cwd=settings.BASE_DIR,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+class Medicion:
+    """Latencias, errores y consultas de una fase"""
+
+    def __init__(self):
+        self.latencias = []
+        self.consultas = []
+        self.errores = 0
+        self.causas = Counter()
+
+    def resumen(self):
+        peticiones = len(self.latencias) + self.errores
+        return {
+            'peticiones': peticiones,
+            'errores': self.errores,
+            'tasa_errores': round(self.errores / peticiones, 4) if peticiones else 0.0,
+            'p50_ms': round(percentil(self.latencias, 50) * 1000, 2),
+            'p95_ms': round(percentil(self.latencias, 95) * 1000, 2),
+            'p99_ms': round(percentil(self.latencias, 99) * 1000, 2),
+            'consultas_media': round(sum(self.consultas) / len(self.consultas), 2) if self.consultas else 0.0,
+            'consultas_max': max(self.consultas, default=0),
+            'causas_errores': dict(self.causas),
+        }
+
+
+class Command(BaseCommand):
+    help = 'Prueba de carga con llamadas simultáneas por el flujo completo de webhooks y un stub de OpenAI'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--llamadas', type=int, default=50, help='Llamadas simuladas')
+        parser.add_argument('--turnos', type=int, default=5, help='Turnos de voz por llamada')
+        parser.add_argument('--latencia', type=float, default=0.5, help='Latencia del stub de OpenAI (segundos)')
+        parser.add_argument('--workers', type=int, default=16, help='Hilos (llamadas simultáneas) del camino síncrono')
+        parser.add_argument('--pausa', type=float, default=0.0, help='Segundos que "habla" el usuario entre turnos')
+        parser.add_argument('--async', dest='modo_async', action='store_true', help='Usar los webhooks async (todas las llamadas a la vez)')
+        parser.add_argument('--con-cache', action='store_true', help='Activar la caché de respuestas')
+        parser.add_argument('--con-registros', action='store_true', help='No desactivar el logging durante la prueba')
+        parser.add_argument('--salida', help='Archivo JSON donde guardar el resultado')
+        parser.add_argument('--comparar', help='JSON de una corrida anterior para mostrar las diferencias')
+
+    def handle(self, *args, **options):
+        anterior = None
+        if options['comparar']:
+            try:
+                with open(options['comparar']) as f:
+                    anterior = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"No se pudo leer {options['comparar']}: {e}")
+
+        mediciones = {fase: Medicion() for fase in FASES}
+        cambios = {
+            'OPENAI_API_KEY': 'stub',
+            'BASE_URL': 'https://carga.local',
+            # Media Streams no se puede simular con peticiones HTTP
+            'VOZ_TIEMPO_REAL': False,
+            'CACHE_RESPUESTAS_ACTIVA': options['con_cache'],
+        }
+
+        connection_created.connect(_instalar_contador)
+        for conexion in connections.all():
+            _instalar_contador(None, conexion)
+        if not options['con_registros']:
+            logging.disable(logging.CRITICAL)
+        try:
+            with StubOpenAI(latencia=options['latencia']) as stub, override_settings(OPENAI_BASE_URL=stub.url, **cambios):
+                sids = [f"{PREFIJO_SID}{i}" for i in range(options['llamadas'])]
+                inicio = time.perf_counter()
+                if options['modo_async']:
+                    asyncio.run(self._correr_async(sids, options, mediciones))
+                else:
+                    self._correr_sync(sids, options, mediciones)
+                duracion = time.perf_counter() - inicio
+                peticiones_stub = stub.peticiones
+        finally:
+            logging.disable(logging.NOTSET)
+            connection_created.disconnect(_instalar_contador)
+            for conexion in connections.all():
+                if _contar_consulta in conexion.execute_wrappers:
+                    conexion.execute_wrappers.remove(_contar_consulta)
+            Llamada.objects.filter(sid__startswith=PREFIJO_SID).delete()
+            EstadisticaLlamadas.objects.filter(numero_origen=NUMERO_ORIGEN).delete()
+
+        resultado = self._resultado(options, mediciones, duracion, peticiones_stub)
+        self._reportar(resultado, anterior)
+        if options['salida']:
+            with open(options['salida'], 'w') as f:
+                json.dump(resultado, f, indent=2, ensure_ascii=False)
+            self.stdout.write(f"Resultado guardado en {options['salida']}")
+
+    # Peticiones de una llamada simulada
+
+    def _datos(self, sid, **extra):
+        return {'CallSid': sid, 'From': NUMERO_ORIGEN, 'To': settings.TWILIO_PHONE_NUMBER or '+15550000001', **extra}
+
+    def _error(self, respuesta, texto, validar=True):
+        """
+        Causa del error de la respuesta, o None si es la esperada
+        """
+        if respuesta.status_code != 200:
+            return f"http {respuesta.status_code}"
+        if validar and 'hubo un error' in texto:
+            return 'twiml de error'
+        if validar and '<Gather' not in texto:
+            return 'sin gather'
+        return None
+
+    def _accion(self, texto):
+        gather = _GATHER.search(texto)
+        return _ruta(gather.group(1)) if gather else '/webhook/'
+
+    def _registrar(self, medicion, inicio, contador, causa):
+        if causa is None:
+            medicion.latencias.append(time.perf_counter() - inicio)
+            medicion.consultas.append(contador[0])
+        else:
+            medicion.errores += 1
+            medicion.causas[causa] += 1
+
+    def _conversar(self, sid, options, mediciones, factory):
+        """
+        Una llamada completa con los webhooks síncronos
+        """
+        def peticion(fase, funcion, ruta, datos, validar=True):
+            contador = [0]
+            token = _consultas.set(contador)
+            inicio = time.perf_counter()
+            try:
+                respuesta = funcion(factory.post(ruta, datos))
+                texto = respuesta.content.decode('utf-8', 'replace')
+                # Relleno: seguir el <Redirect> hasta la respuesta del turno
+                while validar and '<Gather' not in texto and 'webhook-resultado' in texto:
+                    respuesta = views.webhook_resultado(factory.post(_ruta(_REDIRECT.search(texto).group(1)), {}))
+                    texto = respuesta.content.decode('utf-8', 'replace')
+                causa = self._error(respuesta, texto, validar)
+            except Exception as e:
+                causa, texto = type(e).__name__, ''
+            finally:
+                _consultas.reset(token)
+            self._registrar(mediciones[fase], inicio, contador, causa)
+            return texto
+
+        try:
+            texto = peticion('inicial', views.webhook_llamada, '/webhook/', self._datos(sid, CallStatus='ringing'))
+            for turno in range(options['turnos']):
+                if options['pausa']:
+                    time.sleep(options['pausa'])
+                texto = peticion('turno', views.webhook_llamada, self._accion(texto), self._datos(
+                    sid, CallStatus='in-progress', SpeechResult=f'Llamada {sid}: quiero saber el estado del pedido {turno}',
+                ))
+            duracion = str(int(options['turnos'] * (options['pausa'] + options['latencia'])) + 1)
+            peticion('estado', views.webhook_status, '/webhook-status/',
+                     self._datos(sid, CallStatus='completed', CallDuration=duracion), validar=False)
+        finally:
+            close_old_connections()
+
+    def _correr_sync(self, sids, options, mediciones):
+        factory = RequestFactory()
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            list(pool.map(lambda sid: self._conversar(sid, options, mediciones, factory), sids))
+
+    async def _correr_async(self, sids, options, mediciones):
+        factory = AsyncRequestFactory()
+        webhook_status = sync_to_async(views.webhook_status)
+
+        async def peticion(fase, funcion, ruta, datos, validar=True):
+            contador = [0]
+            token = _consultas.set(contador)
+            inicio = time.perf_counter()
+            try:
+                respuesta = await funcion(factory.post(ruta, datos))
+                texto = respuesta.content.decode('utf-8', 'replace')
+                while validar and '<Gather' not in texto and 'webhook-resultado' in texto:
+                    respuesta = await views.webhook_resultado_async(factory.post(_ruta(_REDIRECT.search(texto).group(1)), {}))
+                    texto = respuesta.content.decode('utf-8', 'replace')
+                causa = self._error(respuesta, texto, validar)
+            except Exception as e:
+                causa, texto = type(e).__name__, ''
+            finally:
+                _consultas.reset(token)
+            self._registrar(mediciones[fase], inicio, contador, causa)
+            return texto
+
+        async def conversar(sid):
+            texto = await peticion('inicial', views.webhook_llamada_async, '/webhook/', self._datos(sid, CallStatus='ringing'))
+            for turno in range(options['turnos']):
+                if options['pausa']:
+                    await asyncio.sleep(options['pausa'])
+                texto = await peticion('turno', views.webhook_llamada_async, self._accion(texto), self._datos(
+                    sid, CallStatus='in-progress', SpeechResult=f'Llamada {sid}: quiero saber el estado del pedido {turno}',
+                ))
+            duracion = str(int(options['turnos'] * (options['pausa'] + options['latencia'])) + 1)
+            await peticion('estado', webhook_status, '/webhook-status/',
+                           self._datos(sid, CallStatus='completed', CallDuration=duracion), validar=False)
+
+        await asyncio.gather(*(conversar(sid) for sid in sids))
+
+    # Resultado
+
+    def _resultado(self, options, mediciones, duracion, peticiones_stub):
+        fases = {fase: medicion.resumen() for fase, medicion in mediciones.items()}
+        errores = sum(f['errores'] for f in fases.values())
+        peticiones = sum(f['peticiones'] for f in fases.values())
+        return {
+            'fecha': timezone.now().isoformat(timespec='seconds'),
+            'commit': _commit(),
+            'entorno': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'base_de_datos': connection.vendor,
+                'almacen_conversaciones': settings.CONVERSACION_ALMACEN,
+                'relleno': settings.RELLENO_ACTIVO,
+            },
+            'parametros': {
+                clave: options[clave]
+                for clave in ('llamadas', 'turnos', 'latencia', 'workers', 'pausa', 'modo_async', 'con_cache', 'con_registros')
+            },
+            'duracion_s': round(duracion, 3),
+            'llamadas_por_s': round(options['llamadas'] / duracion, 2),
+            'turnos_por_s': round(fases['turno']['peticiones'] / duracion, 2),
+            'peticiones_stub': peticiones_stub,
+            'tasa_errores': round(errores / peticiones, 4) if peticiones else 0.0,
+            'fases': fases,
+        }
+
+    def _reportar(self, resultado, anterior):
+        p = resultado['parametros']
+        modo = 'async' if p['modo_async'] else f"sync, {p['workers']} workers"
+        self.stdout.write(
+            f"Commit {resultado['commit'] or '?'} | {resultado['entorno']['base_de_datos']} | "
+            f"{modo} | llamadas: {p['llamadas']}, "
+            f"turnos: {p['turnos']}, latencia LLM: {p['latencia']}s, pausa: {p['pausa']}s"
+        )
+        self.stdout.write(
+            f"Total: {resultado['duracion_s']:.2f}s  llamadas/s: {resultado['llamadas_por_s']:.2f}  "
+            f"turnos/s: {resultado['turnos_por_s']:.2f}  errores: {resultado['tasa_errores']:.2%}  "
+            f"peticiones al stub: {resultado['peticiones_stub']}"
+        )
+        for fase, datos in resultado['fases'].items():
+            linea = (
+                f"[{fase:7}] n: {datos['peticiones']:5}  p50: {datos['p50_ms']:8.1f}ms  p95: {datos['p95_ms']:8.1f}ms  "
+                f"p99: {datos['p99_ms']:8.1f}ms  consultas: {datos['consultas_media']:5.1f} (máx {datos['consultas_max']})  "
+                f"errores: {datos['errores']}"
+            )
+            if datos['causas_errores']:
+                linea += f" {datos['causas_errores']}"
+            previo = (anterior or {}).get('fases', {}).get(fase)
+            if previo:
+                linea += (
+                    f"  | vs {anterior.get('commit') or 'anterior'}: p50 {datos['p50_ms'] - previo['p50_ms']:+.1f}ms  "
+                    f"p99 {datos['p99_ms'] - previo['p99_ms']:+.1f}ms  consultas {datos['consultas_media'] - previo['consultas_media']:+.1f}"
+                )
+            self.stdout.write(linea)
+        if anterior:
+            self.stdout.write(
+                f"turnos/s vs {anterior.get('commit') or 'anterior'}: {resultado['turnos_por_s'] - anterior['turnos_por_s']:+.2f}"
+            )
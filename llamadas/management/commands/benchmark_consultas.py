@@ -0,0 +1,178 @@
+"""
+Mide las consultas del camino crítico con y sin los índices compuestos
+
+    DB_NAME=noxus_bench python manage.py benchmark_consultas --mensajes 2000000 --mensajes-por-llamada 20
+
+Siembra llamadas y mensajes de prueba (SID "BENCHDB-..."), mide las dos
+consultas que hacen los webhooks con el esquema anterior (solo el índice de
+la FK llamada_id) y con los índices de la migración 0003, y muestra el plan
+de ejecución de cada una. Al terminar deja los índices como estaban y borra
+los datos sembrados (salvo --conservar).
+
+Mientras mide borra y recrea índices de producción y siembra un millón de
+filas, así que solo corre contra una base de datos cuyo nombre contiene
+"bench" o con --confirmar.
+"""
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, models, transaction
+from django.utils import timezone
+
+from llamadas.management.commands.benchmark_webhook import percentil
+from llamadas.models import Llamada, MensajeConversacion
+
+
+PREFIJO_SID = 'BENCHDB-'
+
+# Índice que tenía MensajeConversacion antes de la migración 0003 (el de la FK)
+INDICE_ANTERIOR = models.Index(fields=['llamada'], name='bench_mensaje_llamada_idx')
+
+
+def _indice(modelo, nombre):
+    return next(indice for indice in modelo._meta.indexes if indice.name == nombre)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark de las consultas de llamadas activas e historial, con y sin índices compuestos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mensajes', type=int, default=1000000, help='Mensajes a sembrar')
+        parser.add_argument('--mensajes-por-llamada', type=int, default=20)
+        parser.add_argument('--repeticiones', type=int, default=200, help='Ejecuciones de cada consulta')
+        parser.add_argument('--lote', type=int, default=5000, help='Filas por bulk_create')
+        parser.add_argument('--conservar', action='store_true', help='No borrar los datos sembrados')
+        parser.add_argument(
+            '--confirmar', action='store_true',
+            help='Correr aunque la base de datos no sea una de benchmark (borra y recrea sus índices)',
+        )
+
+    def handle(self, *args, **options):
+        nombre_base = str(connection.settings_dict['NAME'])
+        if 'bench' not in nombre_base.lower() and not options['confirmar']:
+            raise CommandError(
+                f"La base de datos '{nombre_base}' no parece de benchmark: este comando borra y recrea sus "
+                "índices y siembra datos de prueba. Usar una base cuyo nombre contenga 'bench' o pasar --confirmar."
+            )
+
+        indice_estado = _indice(Llamada, 'llamada_estado_fecha_idx')
+        indice_mensajes = _indice(MensajeConversacion, 'mensaje_llamada_ts_idx')
+
+        try:
+            ids = self._sembrar(options['mensajes'], options['mensajes_por_llamada'], options['lote'])
+
+            try:
+                # Esquema anterior: sin índices compuestos, solo el índice de la FK
+                with connection.schema_editor() as editor:
+                    editor.remove_index(Llamada, indice_estado)
+                    editor.remove_index(MensajeConversacion, indice_mensajes)
+                    editor.add_index(MensajeConversacion, INDICE_ANTERIOR)
+                self._analizar()
+                antes = self._medir(ids, options['repeticiones'], 'sin índices compuestos')
+            finally:
+                with connection.schema_editor() as editor:
+                    editor.execute(f"DROP INDEX IF EXISTS {editor.quote_name(INDICE_ANTERIOR.name)}")
+                    for modelo, indice in [(Llamada, indice_estado), (MensajeConversacion, indice_mensajes)]:
+                        editor.execute(f"DROP INDEX IF EXISTS {editor.quote_name(indice.name)}")
+                        editor.add_index(modelo, indice)
+                self._analizar()
+
+            despues = self._medir(ids, options['repeticiones'], 'con índices compuestos')
+        finally:
+            if not options['conservar']:
+                self.stdout.write('Borrando los datos sembrados...')
+                MensajeConversacion.objects.filter(llamada__sid__startswith=PREFIJO_SID).delete()
+                Llamada.objects.filter(sid__startswith=PREFIJO_SID).delete()
+
+        self.stdout.write('')
+        for nombre in antes:
+            mejora = antes[nombre] / despues[nombre] if despues[nombre] else 0
+            self.stdout.write(
+                f"{nombre:16} antes: {antes[nombre] * 1000:8.3f}ms  después: {despues[nombre] * 1000:8.3f}ms  "
+                f"({mejora:.1f}x)"
+            )
+
+    def _sembrar(self, total_mensajes, por_llamada, lote):
+        """
+        Crea las llamadas y mensajes de prueba. Devuelve los IDs de las llamadas
+        """
+        n_llamadas = max(1, total_mensajes // por_llamada)
+        self.stdout.write(f"Sembrando {n_llamadas} llamadas y {n_llamadas * por_llamada} mensajes...")
+        inicio = time.perf_counter()
+        ahora = timezone.now()
+        # Casi todas terminadas, como en producción; unas pocas siguen activas
+        estados = ['completada'] * 90 + ['fallida'] * 7 + ['cancelada'] + ['iniciada'] + ['en_progreso']
+
+        for desde in range(0, n_llamadas, lote):
+            with transaction.atomic():
+                Llamada.objects.bulk_create([
+                    Llamada(
+                        sid=f"{PREFIJO_SID}{i}",
+                        numero_destino='+10000000000',
+                        numero_origen='+10000000001',
+                        estado=random.choice(estados),
+                    )
+                    for i in range(desde, min(desde + lote, n_llamadas))
+                ])
+        llamadas = Llamada.objects.filter(sid__startswith=PREFIJO_SID)
+        ids = list(llamadas.values_list('pk', flat=True))
+
+        # auto_now_add fija la fecha al insertar: se reparte en el último año para que el orden importe
+        with transaction.atomic():
+            for i in range(0, len(ids), 50):
+                Llamada.objects.filter(pk__in=ids[i:i + 50]).update(
+                    fecha_creacion=ahora - timezone.timedelta(minutes=random.randint(0, 525600))
+                )
+
+        pendientes = []
+        for pk in ids:
+            for j in range(por_llamada):
+                pendientes.append(MensajeConversacion(
+                    llamada_id=pk, tipo='usuario' if j % 2 == 0 else 'ia', contenido=f"Mensaje de prueba {j}",
+                ))
+                if len(pendientes) >= lote:
+                    MensajeConversacion.objects.bulk_create(pendientes)
+                    pendientes = []
+        if pendientes:
+            MensajeConversacion.objects.bulk_create(pendientes)
+
+        self.stdout.write(f"Sembrado en {time.perf_counter() - inicio:.1f}s")
+        return ids
+
+    def _analizar(self):
+        # Estadísticas del planificador al día después de crear o borrar índices
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def _consultas(self, ids):
+        return {
+            'llamada activa': lambda: list(
+                Llamada.objects.filter(estado__in=['iniciada', 'en_progreso']).order_by('-fecha_creacion')[:1]
+            ),
+            'historial': lambda: list(
+                MensajeConversacion.objects.filter(llamada_id=random.choice(ids))
+                .order_by('timestamp', 'pk').values_list('tipo', 'contenido')
+            ),
+        }
+
+    def _medir(self, ids, repeticiones, etiqueta):
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\n{etiqueta}"))
+        resultados = {}
+        for nombre, consulta in self._consultas(ids).items():
+            consulta()  # calentar la caché de páginas
+            tiempos = []
+            for _ in range(repeticiones):
+                inicio = time.perf_counter()
+                consulta()
+                tiempos.append(time.perf_counter() - inicio)
+            resultados[nombre] = percentil(tiempos, 50)
+            self.stdout.write(
+                f"{nombre:16} p50: {percentil(tiempos, 50) * 1000:8.3f}ms  p95: {percentil(tiempos, 95) * 1000:8.3f}ms"
+            )
+        self.stdout.write(f"  plan llamada activa: {self._plan(Llamada.objects.filter(estado__in=['iniciada', 'en_progreso']).order_by('-fecha_creacion')[:1])}")
+        self.stdout.write(f"  plan historial:      {self._plan(MensajeConversacion.objects.filter(llamada_id=ids[0]).order_by('timestamp', 'pk'))}")
+        return resultados
+
+    def _plan(self, queryset):
+        return ' | '.join(linea.strip() for linea in queryset.explain().splitlines())
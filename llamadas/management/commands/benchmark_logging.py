@@ -0,0 +1,162 @@
+"""
+Latencia del webhook de voz con el registro desactivado, en cola y síncrono
+
+    python manage.py benchmark_logging --llamadas 20 --turnos 10 --workers 4
+    python manage.py benchmark_logging --escritura-lenta 2   # destino que tarda 2ms por línea
+
+Cada modo atiende las mismas conversaciones contra un stub local de OpenAI
+(sin latencia por defecto, para que pese solo el costo propio del webhook):
+
+    desactivado:   logging.disable, la referencia
+    cola INFO/DEBUG: ManejadorCola (lo que usa settings.LOGGING)
+    síncrono DEBUG: StreamHandler directo, escribiendo en el hilo del request
+
+Los registros se escriben en un archivo temporal (o en --destino) en lugar de
+stdout. --escritura-lenta simula un colector de logs lento: el modo síncrono
+lo paga en cada petición; la cola no, y si se llena descarta y lo informa.
+Las llamadas de prueba se crean con SID "BENCHLOG-..." y se borran al terminar.
+"""
+import logging
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.test import RequestFactory
+from django.test.utils import override_settings
+
+from llamadas import views
+from llamadas.management.commands.benchmark_webhook import percentil
+from llamadas.management.stub_openai import StubOpenAI
+from llamadas.models import Llamada
+from llamadas.registro import FiltroLlamada, FormatoJSON, ManejadorCola
+
+
+PREFIJO_SID = 'BENCHLOG-'
+
+
+class DestinoLento(logging.StreamHandler):
+    """StreamHandler que tarda `retraso` segundos por registro (colector lento)"""
+
+    def __init__(self, stream, retraso=0.0):
+        super().__init__(stream)
+        self.retraso = retraso
+
+    def emit(self, record):
+        if self.retraso:
+            time.sleep(self.retraso)
+        super().emit(record)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark del webhook de voz con el registro desactivado, en cola y síncrono'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--llamadas', type=int, default=20, help='Conversaciones por modo')
+        parser.add_argument('--turnos', type=int, default=10, help='Turnos de voz por conversación')
+        parser.add_argument('--workers', type=int, default=4, help='Hilos que atienden peticiones')
+        parser.add_argument('--latencia', type=float, default=0.0, help='Latencia del stub de OpenAI (segundos)')
+        parser.add_argument('--escritura-lenta', type=float, default=0.0, help='Milisegundos por línea escrita')
+        parser.add_argument('--destino', help='Archivo donde escribir los registros (por defecto uno temporal)')
+
+    def handle(self, *args, **options):
+        logger = logging.getLogger('llamadas')
+        original = (logger.handlers[:], logger.level)
+        archivo = open(options['destino'], 'a') if options['destino'] else tempfile.TemporaryFile('w+')
+        retraso = options['escritura_lenta'] / 1000
+        modos = [
+            ('desactivado', None, None),
+            ('cola INFO', logging.INFO, 'cola'),
+            ('cola DEBUG', logging.DEBUG, 'cola'),
+            ('síncrono DEBUG', logging.DEBUG, 'sincrono'),
+        ]
+
+        resultados = []
+        with StubOpenAI(latencia=options['latencia']) as stub, override_settings(
+            OPENAI_API_KEY='stub',
+            OPENAI_BASE_URL=stub.url,
+            BASE_URL='https://benchmark.local',
+            VOZ_TIEMPO_REAL=False,
+            RELLENO_ACTIVO=False,
+            CACHE_RESPUESTAS_ACTIVA=False,
+        ):
+            try:
+                # Calentamiento (conexiones, imports, plantillas) fuera de la medición
+                logging.disable(logging.CRITICAL)
+                self._medir(self._crear_llamadas(f"{PREFIJO_SID}calentamiento", 2), options['turnos'], 2)
+                logging.disable(logging.NOTSET)
+                for i, (nombre, nivel, tipo) in enumerate(modos):
+                    sids = self._crear_llamadas(f"{PREFIJO_SID}{i}", options['llamadas'])
+                    manejador = self._configurar(logger, nivel, tipo, DestinoLento(archivo, retraso))
+                    try:
+                        duracion, latencias = self._medir(sids, options['turnos'], options['workers'])
+                    finally:
+                        inicio_vaciado = time.perf_counter()
+                        if isinstance(manejador, ManejadorCola):
+                            manejador.detener()
+                        vaciado = time.perf_counter() - inicio_vaciado
+                        logging.disable(logging.NOTSET)
+                        logger.handlers = []
+                    descartados = getattr(manejador, 'descartados', 0)
+                    resultados.append((nombre, duracion, latencias, descartados, vaciado))
+            finally:
+                logger.handlers, nivel_original = original
+                logger.setLevel(nivel_original)
+                Llamada.objects.filter(sid__startswith=PREFIJO_SID).delete()
+                archivo.close()
+
+        total = options['llamadas'] * options['turnos']
+        self.stdout.write(
+            f"Turnos por modo: {total}, workers: {options['workers']}, latencia LLM: {options['latencia']}s, "
+            f"escritura: {options['escritura_lenta']}ms/línea"
+        )
+        base = percentil(resultados[0][2], 50)
+        for nombre, duracion, latencias, descartados, vaciado in resultados:
+            p50 = percentil(latencias, 50)
+            self.stdout.write(
+                f"[{nombre:15}] turnos/s: {total / duracion:7.1f}  p50: {p50 * 1000:7.2f}ms  "
+                f"p99: {percentil(latencias, 99) * 1000:7.2f}ms  "
+                f"({(p50 - base) * 1000:+.2f}ms)  descartados: {descartados}  vaciado: {vaciado:.2f}s"
+            )
+
+    def _configurar(self, logger, nivel, tipo, destino):
+        if tipo is None:
+            logging.disable(logging.CRITICAL)
+            return None
+        destino.setFormatter(FormatoJSON())
+        manejador = ManejadorCola(destino=destino) if tipo == 'cola' else destino
+        manejador.addFilter(FiltroLlamada())
+        logger.handlers = [manejador]
+        logger.setLevel(nivel)
+        return manejador
+
+    def _crear_llamadas(self, prefijo, cantidad):
+        sids = [f"{prefijo}-{i}" for i in range(cantidad)]
+        Llamada.objects.bulk_create([
+            Llamada(sid=sid, numero_destino='+10000000000', numero_origen='+10000000001', estado='en_progreso')
+            for sid in sids
+        ])
+        return sids
+
+    def _medir(self, sids, turnos, workers):
+        factory = RequestFactory()
+        latencias = []
+
+        def conversar(sid):
+            try:
+                for turno in range(turnos):
+                    datos = {
+                        'CallSid': sid, 'CallStatus': 'in-progress', 'From': '+34600111222',
+                        'SpeechResult': f'Quiero saber el estado de mi pedido número {turno}',
+                    }
+                    inicio = time.perf_counter()
+                    views.webhook_llamada(factory.post('/webhook/', datos))
+                    latencias.append(time.perf_counter() - inicio)
+            finally:
+                close_old_connections()
+
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(conversar, sids))
+        return time.perf_counter() - inicio, latencias
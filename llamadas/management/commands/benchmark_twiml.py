@@ -0,0 +1,103 @@
+"""
+Verifica que las plantillas TwiML precompiladas producen los mismos bytes que
+los constructores de la librería de Twilio, y mide el costo por turno
+
+    python manage.py benchmark_twiml --iteraciones 20000
+"""
+import timeit
+from itertools import product
+
+from django.core.management.base import BaseCommand, CommandError
+
+from llamadas import twiml
+
+
+TEXTOS_PRUEBA = [
+    'Claro, con gusto te ayudo. ¿Necesitas algo más?',
+    'Precios: 10 € & 20 $ <sin IVA> "oferta" \'especial\'',
+    'Línea uno\nLínea dos\ttabulada\r\n',
+    'Emojis 😀 y acentos: áéíóú ñ ü ¿¡',
+    '&amp; ya escapado &lt;b&gt;',
+    ']]> <![CDATA[ x ]]>',
+    'x' * 2000,
+]
+
+URLS_PRUEBA = [
+    'https://abc123.ngrok.io/webhook/',
+    'https://example.com/webhook/?t=a&b="c"<d>',
+]
+
+# Frases fijas con audio pre-renderizado (<Play> en lugar de <Say>)
+AUDIOS_PRUEBA = (
+    (twiml.ALGO_MAS, 'https://example.com/media/audio/a.wav'),
+    (twiml.DESPEDIDA, 'https://example.com/media/audio/b.wav?v=1&x=2'),
+    (twiml.UN_MOMENTO, 'https://example.com/media/audio/c.wav'),
+)
+
+# Token de turno con el formato de tokens.firmar_turno
+TOKEN_PRUEBA = '1234-5:AbCdEfGhIjKlMnOpQrStUvWxYz0123456789_-abcde'
+
+
+class Command(BaseCommand):
+    help = 'Compara las plantillas TwiML precompiladas con los constructores de Twilio'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iteraciones', type=int, default=20000)
+
+    def handle(self, *args, **options):
+        voz, idioma = twiml.voz_e_idioma()
+
+        # 1. Salida idéntica byte a byte
+        casos = 0
+        for url, audios, token in product(URLS_PRUEBA, [(), AUDIOS_PRUEBA], ['', TOKEN_PRUEBA]):
+            url_turno = twiml.url_con_token(url, token)
+            self._comparar(
+                'inicial',
+                twiml.construir_twiml_inicial(url_turno, voz, idioma, audios),
+                twiml.twiml_inicial(url, voz, idioma, audios, token),
+            )
+            casos += 1
+            for texto in TEXTOS_PRUEBA + ['']:
+                self._comparar(
+                    'respuesta',
+                    twiml.construir_twiml_respuesta(texto, url_turno, voz, idioma, audios),
+                    twiml.twiml_respuesta(texto, url, voz, idioma, audios, token),
+                )
+                self._comparar(
+                    'final',
+                    twiml.construir_twiml_final(texto, voz, idioma, audios),
+                    twiml.twiml_final(texto, voz, idioma, audios),
+                )
+                casos += 2
+            self._comparar(
+                'espera',
+                twiml.construir_twiml_espera(url, voz, idioma, audios),
+                twiml.twiml_espera(url, voz, idioma, audios),
+            )
+            casos += 1
+        self.stdout.write(self.style.SUCCESS(f"Salida idéntica en {casos} casos"))
+
+        # 2. Costo por turno
+        n = options['iteraciones']
+        url = URLS_PRUEBA[0]
+        texto = TEXTOS_PRUEBA[0]
+        url_turno = twiml.url_con_token(url, TOKEN_PRUEBA)
+        mediciones = [
+            ('respuesta', lambda: twiml.construir_twiml_respuesta(texto, url_turno, voz, idioma),
+             lambda: twiml.twiml_respuesta(texto, url, voz, idioma, token=TOKEN_PRUEBA)),
+            ('inicial', lambda: twiml.construir_twiml_inicial(url_turno, voz, idioma),
+             lambda: twiml.twiml_inicial(url, voz, idioma, token=TOKEN_PRUEBA)),
+            ('final', lambda: twiml.construir_twiml_final(texto, voz, idioma),
+             lambda: twiml.twiml_final(texto, voz, idioma)),
+        ]
+        for nombre, construir, precompilado in mediciones:
+            t_construir = timeit.timeit(construir, number=n) / n * 1e6
+            t_precompilado = timeit.timeit(precompilado, number=n) / n * 1e6
+            self.stdout.write(
+                f"{nombre:10} árbol VoiceResponse: {t_construir:8.2f} µs  "
+                f"precompilado: {t_precompilado:6.2f} µs  ({t_construir / t_precompilado:5.1f}x)"
+            )
+
+    def _comparar(self, nombre, esperado, obtenido):
+        if esperado.encode('utf-8') != obtenido.encode('utf-8'):
+            raise CommandError(f"TwiML '{nombre}' distinto:\n{esperado}\n{obtenido}")
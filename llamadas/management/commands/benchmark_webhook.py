@@ -0,0 +1,130 @@
+"""
+Compara el webhook síncrono con el asíncrono usando un stub local de OpenAI
+
+    python manage.py benchmark_webhook --llamadas 100 --turnos 3 --latencia 0.5 --workers 4
+
+El camino síncrono se ejecuta con --workers hilos (como los workers de
+gunicorn); el asíncrono atiende todas las llamadas en un solo event loop.
+Las peticiones pasan por el handler de Django (resolver, middleware y
+decoradores de la ruta, con comprobación de CSRF) usando llamadas.urls_sync y
+llamadas.urls_async, no llamando a la vista directamente: un decorador que rompa la vista async
+aparece en el benchmark.
+Las llamadas de prueba se crean con SID "BENCH-..." y se borran al terminar.
+"""
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+
+from llamadas.management.stub_openai import StubOpenAI
+from llamadas.models import Llamada
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    indice = min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))
+    return ordenados[indice]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark del webhook de voz: camino síncrono vs asíncrono con un stub de OpenAI'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--llamadas', type=int, default=50, help='Llamadas concurrentes')
+        parser.add_argument('--turnos', type=int, default=3, help='Turnos de voz por llamada')
+        parser.add_argument('--latencia', type=float, default=0.5, help='Latencia del stub de OpenAI (segundos)')
+        parser.add_argument('--workers', type=int, default=4, help='Hilos para el camino síncrono')
+
+    def handle(self, *args, **options):
+        llamadas = options['llamadas']
+        turnos = options['turnos']
+
+        with StubOpenAI(latencia=options['latencia']) as stub, override_settings(
+            OPENAI_API_KEY='stub',
+            OPENAI_BASE_URL=stub.url,
+            BASE_URL='https://benchmark.local',
+            ALLOWED_HOSTS=['testserver'],
+            VOZ_TIEMPO_REAL=False,
+            # Medir el camino completo hasta el LLM, sin la caché de respuestas
+            CACHE_RESPUESTAS_ACTIVA=False,
+        ):
+            try:
+                sids_sync = self._crear_llamadas('BENCH-SYNC', llamadas)
+                sids_async = self._crear_llamadas('BENCH-ASYNC', llamadas)
+
+                # Sin registros durante la medición (ver benchmark_logging para su costo)
+                logging.disable(logging.CRITICAL)
+                try:
+                    resultado_sync = self._medir_sync(sids_sync, turnos, options['workers'])
+                    resultado_async = asyncio.run(self._medir_async(sids_async, turnos))
+                finally:
+                    logging.disable(logging.NOTSET)
+            finally:
+                Llamada.objects.filter(sid__startswith='BENCH-').delete()
+
+        self.stdout.write(f"Llamadas: {llamadas}, turnos: {turnos}, latencia LLM: {options['latencia']}s, "
+                          f"workers sync: {options['workers']}, peticiones al stub: {stub.peticiones}")
+        self._reportar('sync', resultado_sync, llamadas * turnos)
+        self._reportar('async', resultado_async, llamadas * turnos)
+
+    def _crear_llamadas(self, prefijo, cantidad):
+        sids = [f"{prefijo}-{i}" for i in range(cantidad)]
+        Llamada.objects.bulk_create([
+            Llamada(sid=sid, numero_destino='+10000000000', numero_origen='+10000000001', estado='en_progreso')
+            for sid in sids
+        ])
+        return sids
+
+    def _datos_turno(self, sid, turno):
+        return {'CallSid': sid, 'CallStatus': 'in-progress', 'SpeechResult': f'Pregunta número {turno}'}
+
+    def _medir_sync(self, sids, turnos, workers):
+        latencias = []
+
+        def conversar(sid):
+            cliente = Client(enforce_csrf_checks=True)
+            try:
+                for turno in range(turnos):
+                    inicio = time.perf_counter()
+                    self._comprobar(cliente.post('/webhook/', self._datos_turno(sid, turno)))
+                    latencias.append(time.perf_counter() - inicio)
+            finally:
+                close_old_connections()
+
+        inicio = time.perf_counter()
+        with override_settings(ROOT_URLCONF='llamadas.urls_sync'), ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(conversar, sids))
+        return time.perf_counter() - inicio, latencias
+
+    async def _medir_async(self, sids, turnos):
+        latencias = []
+
+        async def conversar(sid):
+            cliente = AsyncClient(enforce_csrf_checks=True)
+            for turno in range(turnos):
+                inicio = time.perf_counter()
+                self._comprobar(await cliente.post('/webhook/', self._datos_turno(sid, turno)))
+                latencias.append(time.perf_counter() - inicio)
+
+        inicio = time.perf_counter()
+        with override_settings(ROOT_URLCONF='llamadas.urls_async'):
+            await asyncio.gather(*(conversar(sid) for sid in sids))
+        return time.perf_counter() - inicio, latencias
+
+    def _comprobar(self, respuesta):
+        if respuesta.status_code != 200:
+            raise RuntimeError(f"El webhook respondió {respuesta.status_code}: {respuesta.content[:200]!r}")
+
+    def _reportar(self, nombre, resultado, total_turnos):
+        duracion, latencias = resultado
+        self.stdout.write(
+            f"[{nombre:5}] total: {duracion:7.2f}s  turnos/s: {total_turnos / duracion:7.1f}  "
+            f"p50: {percentil(latencias, 50) * 1000:7.0f}ms  p95: {percentil(latencias, 95) * 1000:7.0f}ms"
+        )
@@ -0,0 +1,37 @@
+"""
+Crea una campaña a partir de un archivo con un número por línea (o CSV con el
+número en la primera columna)
+
+    python manage.py crear_campana "Renovaciones enero" numeros.csv --cps 5 --max-activas 50
+"""
+import csv
+
+from django.core.management.base import BaseCommand
+
+from llamadas.campanas import agregar_numeros
+from llamadas.models import Campana
+
+
+class Command(BaseCommand):
+    help = 'Crea una campaña de llamadas salientes a partir de un archivo de números'
+
+    def add_arguments(self, parser):
+        parser.add_argument('nombre')
+        parser.add_argument('archivo')
+        parser.add_argument('--cps', type=float, default=1.0, help='Llamadas por segundo')
+        parser.add_argument('--max-activas', type=int, default=10, help='Llamadas simultáneas como máximo')
+        parser.add_argument('--max-intentos', type=int, default=3)
+        parser.add_argument('--espera-reintento', type=int, default=60, help='Espera base entre intentos (segundos)')
+
+    def handle(self, *args, **options):
+        campana = Campana.objects.create(
+            nombre=options['nombre'],
+            llamadas_por_segundo=options['cps'],
+            max_llamadas_activas=options['max_activas'],
+            max_intentos=options['max_intentos'],
+            espera_reintento=options['espera_reintento'],
+        )
+        with open(options['archivo'], newline='', encoding='utf-8') as archivo:
+            numeros = (fila[0] for fila in csv.reader(archivo) if fila)
+            total = agregar_numeros(campana, numeros)
+        self.stdout.write(self.style.SUCCESS(f"Campaña {campana.pk} creada con {total} números"))
@@ -0,0 +1,33 @@
+"""
+Ejecuta (o reanuda) el programador de una campaña
+
+    python manage.py ejecutar_campana <id>
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from llamadas.campanas import ProgramadorCampanas
+from llamadas.models import Campana
+
+
+class Command(BaseCommand):
+    help = 'Marca los números pendientes de una campaña respetando CPS y llamadas activas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('campana_id', type=int)
+        parser.add_argument('--intervalo', type=float, default=1.0, help='Espera entre pasadas sin llamadas nuevas (segundos)')
+
+    def handle(self, *args, **options):
+        try:
+            campana = Campana.objects.get(pk=options['campana_id'])
+        except Campana.DoesNotExist:
+            raise CommandError(f"No existe la campaña {options['campana_id']}")
+        if campana.estado == 'completada':
+            self.stdout.write(f"La campaña {campana.pk} ya está completada")
+            return
+
+        ProgramadorCampanas(campana, intervalo=options['intervalo']).ejecutar()
+        campana.refresh_from_db()
+        self.stdout.write(self.style.SUCCESS(
+            f"Campaña {campana.pk}: {campana.completadas} completadas, {campana.fallidas} fallidas, "
+            f"{campana.pendientes} pendientes, {campana.en_curso} en curso"
+        ))
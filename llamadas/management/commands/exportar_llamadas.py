@@ -0,0 +1,41 @@
+"""
+Exporta llamadas con sus mensajes a CSV o JSONL
+
+    python manage.py exportar_llamadas --formato csv --salida llamadas.csv
+    python manage.py exportar_llamadas --formato jsonl --desde 2024-01-01 --hasta 2024-01-31 --estado completada,fallida
+
+Sin --salida escribe en stdout. Recorre las llamadas por lotes (ver
+exportacion.py), así que la memoria no crece con la cantidad exportada.
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from llamadas import exportacion
+
+
+class Command(BaseCommand):
+    help = 'Exporta las llamadas y sus mensajes a CSV o JSONL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--formato', choices=exportacion.FORMATOS, default='csv')
+        parser.add_argument('--desde', default='', help='Fecha AAAA-MM-DD (o ISO 8601) desde la que se exporta')
+        parser.add_argument('--hasta', default='', help='Fecha AAAA-MM-DD (inclusive) hasta la que se exporta')
+        parser.add_argument('--estado', default='', help='Estados separados por coma')
+        parser.add_argument('--lote', type=int, default=exportacion.LOTE_DEFECTO, help='Llamadas por consulta')
+        parser.add_argument('--salida', help='Archivo de salida (por defecto stdout)')
+
+    def handle(self, *args, **options):
+        estados = [estado for estado in options['estado'].split(',') if estado]
+        try:
+            llamadas = exportacion.filtrar_llamadas(options['desde'], options['hasta'], estados)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        partes = exportacion.generar(options['formato'], llamadas, options['lote'])
+        if not options['salida']:
+            for parte in partes:
+                self.stdout.write(parte, ending='')
+            return
+        with open(options['salida'], 'w', encoding='utf-8', newline='') as salida:
+            for parte in partes:
+                salida.write(parte)
+        self.stderr.write(f"Exportado en {options['salida']}")
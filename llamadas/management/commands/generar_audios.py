@@ -0,0 +1,32 @@
+"""
+Pre-renderiza el audio de las frases fijas con el backend de TTS configurado
+y borra los archivos que quedaron obsoletos (texto o voz cambiados)
+
+    python manage.py generar_audios
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from llamadas import twiml
+from llamadas.audio import obtener_cache_audio
+
+
+class Command(BaseCommand):
+    help = 'Genera los audios de las frases fijas para usar <Play> en lugar de <Say>'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sin-limpiar', action='store_true', help='No borrar los audios obsoletos')
+
+    def handle(self, *args, **options):
+        cache = obtener_cache_audio()
+        if not cache:
+            raise CommandError('AUDIO_TTS_BACKEND no está configurado')
+
+        voz, idioma = twiml.voz_e_idioma()
+        for ruta, generado in cache.generar_frases_fijas(voz, idioma):
+            self.stdout.write(f"{'generado' if generado else 'existente'}: {ruta.name}")
+
+        if not options['sin_limpiar']:
+            for ruta in cache.limpiar_obsoletos(voz, idioma):
+                self.stdout.write(f"borrado: {ruta.name}")
+
+        self.stdout.write(self.style.SUCCESS(f"Audios en {cache.directorio}"))
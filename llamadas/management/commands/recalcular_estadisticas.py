@@ -0,0 +1,68 @@
+"""
+Reconstruye los agregados de EstadisticaLlamadas desde Llamada
+
+    python manage.py recalcular_estadisticas                      # todo el historial
+    python manage.py recalcular_estadisticas --desde 2024-01-01   # desde esa fecha
+
+Se usa una vez para cargar las llamadas anteriores a los agregados, o para
+corregirlos. Las horas recalculadas se reemplazan en una sola transacción;
+después los webhooks siguen actualizándolos de forma incremental.
+"""
+from datetime import datetime, time as dtime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from llamadas.estadisticas import ESTADO_INICIADA, ESTADOS_FINALES
+from llamadas.models import EstadisticaLlamadas, Llamada
+
+
+class Command(BaseCommand):
+    help = 'Recalcula las estadísticas por hora, estado y número de origen a partir de las llamadas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--desde', help='Fecha (AAAA-MM-DD) desde la que se recalcula')
+        parser.add_argument('--lote', type=int, default=1000, help='Filas por bulk_create')
+
+    def handle(self, *args, **options):
+        llamadas = Llamada.objects.all()
+        agregados = EstadisticaLlamadas.objects.all()
+        if options['desde']:
+            try:
+                fecha = datetime.strptime(options['desde'], '%Y-%m-%d')
+            except ValueError:
+                raise CommandError('--desde debe tener el formato AAAA-MM-DD')
+            desde = timezone.make_aware(datetime.combine(fecha, dtime.min))
+            llamadas = llamadas.filter(fecha_creacion__gte=desde)
+            agregados = agregados.filter(hora__gte=desde)
+
+        # Un solo GROUP BY en la base de datos; el resultado es pequeño (horas x orígenes x estados)
+        grupos = (
+            llamadas.annotate(hora=TruncHour('fecha_creacion'))
+            .values('hora', 'numero_origen', 'estado')
+            .annotate(llamadas=Count('id'), duracion_total=Sum('duracion'))
+            .order_by()
+        )
+        filas = {}
+        for grupo in grupos:
+            clave = (grupo['hora'], grupo['numero_origen'])
+            iniciadas = filas.setdefault((*clave, ESTADO_INICIADA), EstadisticaLlamadas(
+                hora=grupo['hora'], estado=ESTADO_INICIADA, numero_origen=grupo['numero_origen'],
+            ))
+            iniciadas.llamadas += grupo['llamadas']
+            if grupo['estado'] in ESTADOS_FINALES:
+                filas[(*clave, grupo['estado'])] = EstadisticaLlamadas(
+                    hora=grupo['hora'], estado=grupo['estado'], numero_origen=grupo['numero_origen'],
+                    llamadas=grupo['llamadas'], duracion_total=grupo['duracion_total'] or 0,
+                )
+
+        with transaction.atomic():
+            borradas, _ = agregados.delete()
+            EstadisticaLlamadas.objects.bulk_create(filas.values(), batch_size=options['lote'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Estadísticas recalculadas: {len(filas)} filas ({borradas} reemplazadas)"
+        ))
@@ -0,0 +1,56 @@
+"""
+Reconstruye Llamada.transcripcion desde MensajeConversacion en lotes
+
+    python manage.py reconstruir_transcripciones            # todas las llamadas
+    python manage.py reconstruir_transcripciones --vacias   # solo las que no tienen transcripción
+"""
+from itertools import groupby
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from llamadas.models import Llamada, MensajeConversacion
+from llamadas.persistencia import construir_transcripcion
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye las transcripciones de las llamadas a partir de sus mensajes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=500, help='Llamadas por lote')
+        parser.add_argument('--vacias', action='store_true', help='Solo llamadas sin transcripción')
+        parser.add_argument('--llamada', type=int, help='ID de una llamada concreta')
+
+    def handle(self, *args, **options):
+        llamadas = Llamada.objects.order_by('pk')
+        if options['vacias']:
+            llamadas = llamadas.filter(transcripcion='')
+        if options['llamada']:
+            llamadas = llamadas.filter(pk=options['llamada'])
+
+        total = 0
+        ultimo_id = 0
+        while True:
+            ids = list(llamadas.filter(pk__gt=ultimo_id).values_list('pk', flat=True)[:options['lote']])
+            if not ids:
+                break
+            ultimo_id = ids[-1]
+
+            mensajes = (
+                MensajeConversacion.objects.filter(llamada_id__in=ids)
+                .order_by('llamada_id', 'timestamp', 'pk')
+                .values_list('llamada_id', 'tipo', 'contenido')
+            )
+            transcripciones = dict.fromkeys(ids, '')
+            for llamada_id, filas in groupby(mensajes, key=lambda fila: fila[0]):
+                transcripciones[llamada_id] = construir_transcripcion((tipo, contenido) for _, tipo, contenido in filas)
+
+            with transaction.atomic():
+                Llamada.objects.bulk_update(
+                    [Llamada(pk=pk, transcripcion=texto) for pk, texto in transcripciones.items()],
+                    ['transcripcion'],
+                )
+            total += len(ids)
+            self.stdout.write(f"{total} llamadas procesadas")
+
+        self.stdout.write(self.style.SUCCESS(f"Transcripciones reconstruidas: {total}"))
@@ -0,0 +1,121 @@
+"""
+Cliente falso de Twilio Media Streams para probar el modo tiempo real
+
+ClienteMediaStream hace de Twilio contra la aplicación ASGI del WebSocket
+(streaming.MediaStreamHandler) dentro del mismo proceso: envía connected,
+start, media y stop, y guarda los eventos que devuelve el servidor. Con
+TranscriptorTexto y SintetizadorTexto el "audio" es texto UTF-8, así que una
+prueba puede decir una frase y leer las frases que respondió la IA sin
+reconocimiento ni síntesis de voz reales. Junto con StubOpenAI (modo stream)
+se prueba la conversación completa sin red.
+
+    async with ClienteMediaStream(MediaStreamHandler(...), call_sid='CA...') as cliente:
+        await cliente.decir('Hola')
+        frases = await cliente.esperar_frases(2)
+"""
+import asyncio
+import base64
+import json
+
+
+class TranscriptorTexto:
+    """Transcriptor falso: cada paquete de audio es una frase en UTF-8"""
+
+    def procesar_audio(self, audio):
+        texto = audio.decode('utf-8').strip()
+        return texto or None
+
+    def finalizar(self):
+        return None
+
+
+class SintetizadorTexto:
+    """Sintetizador falso: el audio de una frase es su texto en UTF-8"""
+
+    def sintetizar(self, texto):
+        return texto.encode('utf-8')
+
+
+class ClienteMediaStream:
+    """Hace de Twilio contra una aplicación ASGI de Media Streams"""
+
+    def __init__(self, aplicacion, call_sid='CA_STUB', stream_sid='MZ_STUB'):
+        self.aplicacion = aplicacion
+        self.call_sid = call_sid
+        self.stream_sid = stream_sid
+        self.recibidos = []
+        self.cerrado = False
+        self._entrada = asyncio.Queue()
+        self._nuevo = asyncio.Event()
+        self._tarea = None
+
+    async def _receive(self):
+        return await self._entrada.get()
+
+    async def _send(self, mensaje):
+        if mensaje['type'] == 'websocket.send':
+            self.recibidos.append(json.loads(mensaje['text']))
+        elif mensaje['type'] == 'websocket.close':
+            self.cerrado = True
+        self._nuevo.set()
+
+    async def _enviar(self, data):
+        await self._entrada.put({'type': 'websocket.receive', 'text': json.dumps(data)})
+
+    async def conectar(self):
+        scope = {'type': 'websocket', 'path': '/media-stream/'}
+        self._tarea = asyncio.ensure_future(self.aplicacion(scope, self._receive, self._send))
+        await self._entrada.put({'type': 'websocket.connect'})
+        await self._enviar({'event': 'connected', 'protocol': 'Call', 'version': '1.0.0'})
+        await self._enviar({
+            'event': 'start',
+            'streamSid': self.stream_sid,
+            'start': {'streamSid': self.stream_sid, 'callSid': self.call_sid, 'customParameters': {}},
+        })
+
+    async def decir(self, texto):
+        """Envía una frase del usuario como un paquete de audio"""
+        await self._enviar({
+            'event': 'media',
+            'streamSid': self.stream_sid,
+            'media': {'payload': base64.b64encode(texto.encode('utf-8')).decode('ascii')},
+        })
+
+    def frases(self):
+        """Frases habladas por la IA (audio de los eventos media recibidos)"""
+        return [
+            base64.b64decode(evento['media']['payload']).decode('utf-8')
+            for evento in self.recibidos if evento.get('event') == 'media'
+        ]
+
+    def eventos(self, tipo):
+        return [evento for evento in self.recibidos if evento.get('event') == tipo]
+
+    async def esperar(self, condicion, plazo=5.0):
+        """Espera hasta que condicion() sea verdadera o venza el plazo (TimeoutError)"""
+        async def _esperar():
+            while not condicion():
+                self._nuevo.clear()
+                await self._nuevo.wait()
+        await asyncio.wait_for(_esperar(), plazo)
+
+    async def esperar_frases(self, cantidad, plazo=5.0):
+        await self.esperar(lambda: len(self.frases()) >= cantidad, plazo)
+        return self.frases()
+
+    async def detener(self, plazo=5.0):
+        """Envía stop y espera a que el servidor cierre el WebSocket"""
+        await self._enviar({'event': 'stop', 'streamSid': self.stream_sid})
+        await asyncio.wait_for(self._tarea, plazo)
+
+    async def desconectar(self, plazo=5.0):
+        await self._entrada.put({'type': 'websocket.disconnect', 'code': 1000})
+        await asyncio.wait_for(self._tarea, plazo)
+
+    async def __aenter__(self):
+        await self.conectar()
+        return self
+
+    async def __aexit__(self, *exc):
+        if self._tarea and not self._tarea.done():
+            await self.desconectar()
@@ -0,0 +1,125 @@
+"""
+Servidor HTTP local que imita la API de chat completions de OpenAI
+
+Sirve para benchmarks y pruebas de carga sin gastar tokens ni depender de la
+red: responde siempre el mismo texto después de una latencia configurable.
+En modo stream entrega la respuesta palabra por palabra, con latencia_token
+segundos entre palabras (para probar interrupciones en el modo tiempo real).
+Se usa apuntando OPENAI_BASE_URL a StubOpenAI.url.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from llamadas.contexto import contar_tokens, tokens_mensajes
+
+
+RESPUESTA_STUB = 'Claro, con gusto te ayudo. ¿Necesitas algo más?'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        largo = int(self.headers.get('Content-Length') or 0)
+        peticion = json.loads(self.rfile.read(largo) or b'{}')
+        self.server.stub.registrar_peticion()
+        time.sleep(self.server.stub.latencia)
+
+        if peticion.get('stream'):
+            self._responder_stream(peticion)
+        else:
+            self._responder_json(peticion)
+
+    def _responder_json(self, peticion):
+        cuerpo = json.dumps({
+            'id': 'chatcmpl-stub',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': peticion.get('model', 'stub'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': self.server.stub.respuesta},
+                'finish_reason': 'stop',
+            }],
+            'usage': self._uso(peticion),
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def _uso(self, peticion):
+        prompt = tokens_mensajes(peticion.get('messages', []))
+        respuesta = contar_tokens(self.server.stub.respuesta)
+        return {'prompt_tokens': prompt, 'completion_tokens': respuesta, 'total_tokens': prompt + respuesta}
+
+    def _responder_stream(self, peticion):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        for i, palabra in enumerate(self.server.stub.respuesta.split(' ')):
+            if i and self.server.stub.latencia_token:
+                time.sleep(self.server.stub.latencia_token)
+            chunk = {
+                'id': 'chatcmpl-stub',
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': peticion.get('model', 'stub'),
+                'choices': [{'index': 0, 'delta': {'content': palabra + ' '}, 'finish_reason': None}],
+            }
+            try:
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+                self.wfile.flush()
+            except OSError:
+                # El cliente cerró el stream (respuesta interrumpida)
+                self.server.stub.registrar_corte()
+                self.close_connection = True
+                return
+            self.server.stub.tokens_enviados += 1
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubOpenAI:
+    """Stub de OpenAI en un hilo aparte; usar como context manager"""
+
+    def __init__(self, latencia=0.5, respuesta=RESPUESTA_STUB, host='127.0.0.1', puerto=0, latencia_token=0.0):
+        self.latencia = latencia
+        self.latencia_token = latencia_token
+        self.respuesta = respuesta
+        self.peticiones = 0
+        self.tokens_enviados = 0
+        self.cortes = 0
+        self._lock = threading.Lock()
+        self.servidor = ThreadingHTTPServer((host, puerto), _Handler)
+        self.servidor.daemon_threads = True
+        self.servidor.stub = self
+        self.hilo = threading.Thread(target=self.servidor.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, puerto = self.servidor.server_address[:2]
+        return f"http://{host}:{puerto}/v1"
+
+    def registrar_peticion(self):
+        with self._lock:
+            self.peticiones += 1
+
+    def registrar_corte(self):
+        with self._lock:
+            self.cortes += 1
+
+    def __enter__(self):
+        self.hilo.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.servidor.shutdown()
+        self.servidor.server_close()
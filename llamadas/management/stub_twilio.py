@@ -0,0 +1,112 @@
+"""
+Servidor HTTP local que imita la API REST de llamadas de Twilio
+
+Responde a POST /2010-04-01/Accounts/<sid>/Calls.json como Twilio: crea una
+llamada con un SID nuevo ("CA...") y devuelve su JSON. Guarda cada llamada
+pedida (to, from, url, status_callback) para que una prueba o un benchmark de
+campañas compruebe qué se marcó, sin red ni costo. Con fallar_cada=N una de
+cada N peticiones responde un error 400 como el de un número inválido.
+
+Se usa apuntando TWILIO_API_URL a StubTwilio.url (ver clientes.py):
+
+    with StubTwilio() as stub, override_settings(TWILIO_API_URL=stub.url, ...):
+        ProgramadorCampanas(campana).ciclo()
+    stub.llamadas  # [{'sid': 'CA...', 'to': '+34...', ...}]
+"""
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        largo = int(self.headers.get('Content-Length') or 0)
+        datos = {clave: valores[-1] for clave, valores in parse_qs(self.rfile.read(largo).decode('utf-8')).items()}
+        partes = self.path.split('?')[0].strip('/').split('/')
+        if len(partes) != 4 or partes[1] != 'Accounts' or partes[3] != 'Calls.json':
+            self._responder(404, {'code': 20404, 'message': 'The requested resource was not found', 'status': 404})
+            return
+
+        time.sleep(self.server.stub.latencia)
+        llamada = self.server.stub.registrar_llamada(partes[2], datos)
+        if llamada is None:
+            self._responder(400, {
+                'code': 21211, 'message': f"The 'To' number {datos.get('To')} is not a valid phone number.",
+                'more_info': 'https://www.twilio.com/docs/errors/21211', 'status': 400,
+            })
+            return
+        self._responder(201, llamada)
+
+    def _responder(self, status, datos):
+        cuerpo = json.dumps(datos).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def do_HEAD(self):
+        # Precalentamiento de clientes.py
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubTwilio:
+    """Stub de la API de Twilio en un hilo aparte; usar como context manager"""
+
+    def __init__(self, latencia=0.0, fallar_cada=0, host='127.0.0.1', puerto=0):
+        self.latencia = latencia
+        self.fallar_cada = fallar_cada
+        self.peticiones = 0
+        self.fallidas = 0
+        self.llamadas = []
+        self._lock = threading.Lock()
+        self.servidor = ThreadingHTTPServer((host, puerto), _Handler)
+        self.servidor.daemon_threads = True
+        self.servidor.stub = self
+        self.hilo = threading.Thread(target=self.servidor.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, puerto = self.servidor.server_address[:2]
+        return f"http://{host}:{puerto}"
+
+    def registrar_llamada(self, account_sid, datos):
+        """
+        Guarda la llamada pedida y devuelve su JSON, o None si esta petición falla
+        """
+        with self._lock:
+            self.peticiones += 1
+            if self.fallar_cada and self.peticiones % self.fallar_cada == 0:
+                self.fallidas += 1
+                return None
+            llamada = {
+                'sid': f"CA{uuid.uuid4().hex}",
+                'account_sid': account_sid,
+                'to': datos.get('To'),
+                'from': datos.get('From'),
+                'url': datos.get('Url'),
+                'status_callback': datos.get('StatusCallback'),
+                'status': 'queued',
+                'direction': 'outbound-api',
+                'api_version': '2010-04-01',
+            }
+            self.llamadas.append(llamada)
+            return llamada
+
+    def __enter__(self):
+        self.hilo.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.servidor.shutdown()
+        self.servidor.server_close()
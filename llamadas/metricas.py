@@ -0,0 +1,344 @@
+"""
+Latencia por etapa del turno de voz y endpoint /metrics (texto de Prometheus)
+
+Cada etapa se mide con `with medir('openai'):` o el decorador
+`@cronometrado('twiml')`:
+
+    conversacion  buscar la llamada y el estado de la conversación
+    resumen       leer el resumen del historial (contexto.py)
+    openai        obtener la respuesta de la IA (incluye la caché de respuestas)
+    guardar       insertar los mensajes del turno
+    twiml         generar el TwiML
+    twilio_api    crear la llamada saliente en Twilio
+    webhook       la petición completa (medir_turno)
+
+Fuera del turno también se miden escritura_estados (cada lote del buffer de
+estados.py) y escritura_mensajes (cada lote del escritor de persistencia.py); otros módulos agregan sus valores con registrar_indicador().
+
+Los tiempos se acumulan en un histograma por etapa en memoria del proceso:
+cubetas acumuladas, que Prometheus puede sumar entre procesos, y una ventana
+con las últimas muestras para p50/p95/p99. Con varios workers cada proceso
+expone los suyos.
+
+Además, con METRICAS_MUESTREO_TURNOS (fracción de turnos) o
+METRICAS_TURNO_LENTO (segundos) se guarda un TiempoTurno con el detalle de
+las etapas de ese turno, para revisar en el admin las llamadas lentas. Un
+turno diferido (RELLENO_ACTIVO, ver diferidas.py) lo guarda al terminar en
+segundo plano, con el total desde que llegó la petición: el webhook puede
+haber respondido antes con el relleno, sin la respuesta de la IA.
+"""
+import asyncio
+import bisect
+import contextvars
+import functools
+import logging
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from . import idempotencia
+from .cache_respuestas import obtener_cache_respuestas
+from .models import TiempoTurno
+from .registro import ManejadorCola, contexto_actual
+
+
+logger = logging.getLogger(__name__)
+
+# Segundos; el turno típico está dominado por OpenAI (0.5-3s)
+CUBETAS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CUANTILES = (0.5, 0.95, 0.99)
+VENTANA = 1024
+
+# Turno en curso, abierto por medir_turno:
+# {'etapas': {etapa: segundos}, 'inicio': perf_counter, 'diferido': bool}
+_turno_actual = contextvars.ContextVar('turno_actual', default=None)
+
+
+def percentil(ordenados, q):
+    if not ordenados:
+        return 0.0
+    return ordenados[min(len(ordenados) - 1, int(q * len(ordenados)))]
+
+
+class Histograma:
+    """Histograma de cubetas fijas más las últimas VENTANA muestras (thread-safe)"""
+
+    def __init__(self, cubetas=CUBETAS, ventana=VENTANA):
+        self.cubetas = cubetas
+        self.conteos = [0] * (len(cubetas) + 1)
+        self.suma = 0.0
+        self.total = 0
+        self.recientes = deque(maxlen=ventana)
+        self._lock = threading.Lock()
+
+    def observar(self, valor):
+        indice = bisect.bisect_left(self.cubetas, valor)
+        with self._lock:
+            self.conteos[indice] += 1
+            self.suma += valor
+            self.total += 1
+            self.recientes.append(valor)
+
+    def instantanea(self):
+        """
+        Returns:
+            Diccionario con cubetas [(límite, acumulado)], suma, total y cuantiles {q: valor}
+        """
+        with self._lock:
+            conteos = list(self.conteos)
+            suma, total = self.suma, self.total
+            recientes = sorted(self.recientes)
+        acumulado, cubetas = 0, []
+        for limite, conteo in zip(self.cubetas, conteos):
+            acumulado += conteo
+            cubetas.append((limite, acumulado))
+        return {
+            'cubetas': cubetas,
+            'suma': suma,
+            'total': total,
+            'cuantiles': {q: percentil(recientes, q) for q in CUANTILES},
+        }
+
+
+_histogramas = {}
+_histogramas_lock = threading.Lock()
+
+
+def histograma(etapa):
+    h = _histogramas.get(etapa)
+    if h is None:
+        with _histogramas_lock:
+            h = _histogramas.setdefault(etapa, Histograma())
+    return h
+
+
+def observar(etapa, segundos):
+    """
+    Registra la duración de una etapa en su histograma y en el turno en curso
+    """
+    histograma(etapa).observar(segundos)
+    turno = _turno_actual.get()
+    if turno is not None:
+        turno['etapas'][etapa] = turno['etapas'].get(etapa, 0.0) + segundos
+
+
+@contextmanager
+def medir(etapa):
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        observar(etapa, time.perf_counter() - inicio)
+
+
+def cronometrado(etapa):
+    """
+    Decorador: mide cada ejecución de la función (síncrona o asíncrona) como `etapa`
+    """
+    def decorador(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper_async(*args, **kwargs):
+                with medir(etapa):
+                    return await func(*args, **kwargs)
+            return wrapper_async
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with medir(etapa):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorador
+
+
+def _debe_guardarse(etapas, total):
+    # Solo los turnos en los que respondió la IA (no el saludo ni el relleno)
+    if 'openai' not in etapas:
+        return False
+    if settings.METRICAS_TURNO_LENTO and total >= settings.METRICAS_TURNO_LENTO:
+        return True
+    return random.random() < settings.METRICAS_MUESTREO_TURNOS
+
+
+def guardar_turno(etapas, total):
+    """
+    Guarda un TiempoTurno con las etapas del turno (llamada y turno del contexto de registro)
+    """
+    contexto = contexto_actual()
+    if not contexto.get('llamada_id'):
+        return
+    try:
+        TiempoTurno.objects.create(
+            llamada_id=contexto['llamada_id'],
+            turno=contexto.get('turno', 0),
+            total=total,
+            etapas={etapa: round(segundos, 4) for etapa, segundos in etapas.items()},
+        )
+    except Exception:
+        logger.exception("No se pudo guardar el tiempo del turno")
+
+
+def _nuevo_turno():
+    return {'etapas': {}, 'inicio': time.perf_counter(), 'diferido': False}
+
+
+def medir_turno(view_func):
+    """
+    Decorador de los webhooks de voz: mide la petición completa ('webhook'),
+    junta las etapas del turno y guarda las muestreadas o lentas (salvo las de
+    un turno diferido, que se guardan en terminar_turno_diferido)
+    """
+    if asyncio.iscoroutinefunction(view_func):
+        @functools.wraps(view_func)
+        async def wrapper_async(request, *args, **kwargs):
+            turno = _nuevo_turno()
+            token = _turno_actual.set(turno)
+            try:
+                return await view_func(request, *args, **kwargs)
+            finally:
+                total = time.perf_counter() - turno['inicio']
+                _turno_actual.reset(token)
+                histograma('webhook').observar(total)
+                if not turno['diferido'] and _debe_guardarse(turno['etapas'], total):
+                    await sync_to_async(guardar_turno)(turno['etapas'], total)
+        return wrapper_async
+
+    @functools.wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        turno = _nuevo_turno()
+        token = _turno_actual.set(turno)
+        try:
+            return view_func(request, *args, **kwargs)
+        finally:
+            total = time.perf_counter() - turno['inicio']
+            _turno_actual.reset(token)
+            histograma('webhook').observar(total)
+            if not turno['diferido'] and _debe_guardarse(turno['etapas'], total):
+                guardar_turno(turno['etapas'], total)
+    return wrapper
+
+
+def diferir_turno():
+    """
+    Desde el webhook, al lanzar el turno en segundo plano (diferidas.py): el
+    TiempoTurno lo guarda el turno al terminar, no la petición
+    """
+    turno = _turno_actual.get()
+    if turno is not None:
+        turno['diferido'] = True
+
+
+def _turno_diferido_a_guardar():
+    """
+    (etapas, total) del turno diferido que acaba de terminar si hay que
+    guardarlo; el total cuenta desde que llegó la petición
+    """
+    turno = _turno_actual.get()
+    if turno is None or not turno['diferido']:
+        return None
+    total = time.perf_counter() - turno['inicio']
+    if not _debe_guardarse(turno['etapas'], total):
+        return None
+    return dict(turno['etapas']), total
+
+
+def terminar_turno_diferido():
+    """
+    Desde el turno diferido (con el contexto copiado de la petición), al terminar
+    """
+    datos = _turno_diferido_a_guardar()
+    if datos is not None:
+        guardar_turno(*datos)
+
+
+async def terminar_turno_diferido_async():
+    datos = _turno_diferido_a_guardar()
+    if datos is not None:
+        await sync_to_async(guardar_turno)(*datos)
+
+
+# Valores que otros módulos exponen en /metrics: (nombre, tipo, ayuda, función)
+_indicadores = []
+
+
+def registrar_indicador(nombre, tipo, ayuda, funcion):
+    """
+    Agrega a /metrics un valor que se lee al pedir las métricas
+
+    Args:
+        nombre: Nombre de la métrica (noxus_...)
+        tipo: 'gauge' o 'counter'
+        ayuda: Texto de # HELP
+        funcion: Función sin argumentos que devuelve el valor actual
+    """
+    _indicadores.append((nombre, tipo, ayuda, funcion))
+
+
+def _numero(valor):
+    return f"{valor:.6g}" if isinstance(valor, float) else str(valor)
+
+
+def texto_prometheus():
+    """
+    Todas las métricas del proceso en el formato de texto de Prometheus 0.0.4
+    """
+    lineas = [
+        '# HELP noxus_etapa_segundos Duración de cada etapa del turno de voz',
+        '# TYPE noxus_etapa_segundos histogram',
+    ]
+    instantaneas = {etapa: h.instantanea() for etapa, h in sorted(_histogramas.items())}
+    for etapa, datos in instantaneas.items():
+        for limite, acumulado in datos['cubetas']:
+            lineas.append(f'noxus_etapa_segundos_bucket{{etapa="{etapa}",le="{limite}"}} {acumulado}')
+        lineas.append(f'noxus_etapa_segundos_bucket{{etapa="{etapa}",le="+Inf"}} {datos["total"]}')
+        lineas.append(f'noxus_etapa_segundos_sum{{etapa="{etapa}"}} {_numero(datos["suma"])}')
+        lineas.append(f'noxus_etapa_segundos_count{{etapa="{etapa}"}} {datos["total"]}')
+
+    lineas += [
+        f'# HELP noxus_etapa_segundos_recientes Percentiles de las últimas {VENTANA} muestras de cada etapa',
+        '# TYPE noxus_etapa_segundos_recientes gauge',
+    ]
+    for etapa, datos in instantaneas.items():
+        for q, valor in datos['cuantiles'].items():
+            lineas.append(f'noxus_etapa_segundos_recientes{{etapa="{etapa}",cuantil="{q}"}} {_numero(valor)}')
+
+    cache = obtener_cache_respuestas()
+    if cache:
+        datos = cache.estadisticas()
+        lineas += [
+            '# HELP noxus_cache_respuestas_consultas_total Consultas a la caché de respuestas por resultado',
+            '# TYPE noxus_cache_respuestas_consultas_total counter',
+            f'noxus_cache_respuestas_consultas_total{{resultado="exacto"}} {datos["aciertos_exactos"]}',
+            f'noxus_cache_respuestas_consultas_total{{resultado="aproximado"}} {datos["aciertos_aproximados"]}',
+            f'noxus_cache_respuestas_consultas_total{{resultado="fallo"}} {datos["fallos"]}',
+            '# TYPE noxus_cache_respuestas_expulsiones_total counter',
+            f'noxus_cache_respuestas_expulsiones_total {datos["expulsiones"]}',
+            '# TYPE noxus_cache_respuestas_entradas gauge',
+            f'noxus_cache_respuestas_entradas {datos["entradas"]}',
+        ]
+
+    peticiones = idempotencia.estadisticas()
+    lineas += [
+        '# HELP noxus_webhook_peticiones_total Peticiones de los webhooks de voz por resultado de la deduplicación',
+        '# TYPE noxus_webhook_peticiones_total counter',
+    ]
+    for resultado, total in peticiones.items():
+        lineas.append(f'noxus_webhook_peticiones_total{{resultado="{resultado}"}} {total}')
+
+    descartados = sum(
+        manejador.descartados for manejador in logging.getLogger('llamadas').handlers
+        if isinstance(manejador, ManejadorCola)
+    )
+    lineas += [
+        '# HELP noxus_registros_descartados_total Registros descartados con la cola de logging llena',
+        '# TYPE noxus_registros_descartados_total counter',
+        f'noxus_registros_descartados_total {descartados}',
+    ]
+    for nombre, tipo, ayuda, funcion in _indicadores:
+        lineas += [f'# HELP {nombre} {ayuda}', f'# TYPE {nombre} {tipo}', f'{nombre} {_numero(funcion())}']
+    return '\n'.join(lineas) + '\n'
@@ -0,0 +1,27 @@
+"""
+Operaciones de migración propias
+
+AgregarIndiceConcurrente es un AddIndex que en PostgreSQL crea (y al revertir
+borra) el índice con CONCURRENTLY, sin bloquear las escrituras de la tabla
+mientras se construye. Como CONCURRENTLY no puede ir dentro de una
+transacción, la migración que la use debe declarar atomic = False. Con otra
+base de datos se comporta igual que AddIndex.
+"""
+from django.db import migrations
+
+
+class AgregarIndiceConcurrente(migrations.AddIndex):
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            return super().database_forwards(app_label, schema_editor, from_state, to_state)
+        modelo = to_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, modelo):
+            schema_editor.add_index(modelo, self.index, concurrently=True)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            return super().database_backwards(app_label, schema_editor, from_state, to_state)
+        modelo = from_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, modelo):
+            schema_editor.remove_index(modelo, self.index, concurrently=True)
@@ -0,0 +1,59 @@
+# Generated by Django 4.2.7 on 2026-10-18 04:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('llamadas', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Campana',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=200)),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('en_curso', 'En Curso'), ('pausada', 'Pausada'), ('completada', 'Completada')], default='pendiente', max_length=20)),
+                ('llamadas_por_segundo', models.FloatField(default=1.0, help_text='Llamadas nuevas por segundo (CPS)')),
+                ('max_llamadas_activas', models.IntegerField(default=10, help_text='Llamadas simultáneas como máximo')),
+                ('max_intentos', models.IntegerField(default=3, help_text='Intentos por número (ocupado/sin respuesta se reintenta)')),
+                ('espera_reintento', models.IntegerField(default=60, help_text='Espera base entre intentos en segundos (se duplica en cada intento)')),
+                ('total_numeros', models.IntegerField(default=0)),
+                ('pendientes', models.IntegerField(default=0)),
+                ('en_curso', models.IntegerField(default=0)),
+                ('completadas', models.IntegerField(default=0)),
+                ('fallidas', models.IntegerField(default=0)),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('fecha_inicio', models.DateTimeField(blank=True, null=True)),
+                ('fecha_fin', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Campaña',
+                'verbose_name_plural': 'Campañas',
+                'ordering': ['-fecha_creacion'],
+            },
+        ),
+        migrations.CreateModel(
+            name='NumeroCampana',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('numero', models.CharField(max_length=20)),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('marcando', 'Marcando'), ('completado', 'Completado'), ('fallido', 'Fallido')], default='pendiente', max_length=20)),
+                ('intentos', models.IntegerField(default=0)),
+                ('proximo_intento', models.DateTimeField(default=django.utils.timezone.now, help_text='No se marca antes de esta fecha')),
+                ('ultimo_resultado', models.CharField(blank=True, help_text='Último CallStatus de Twilio', max_length=20)),
+                ('campana', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='numeros', to='llamadas.campana')),
+                ('llamada', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='numeros_campana', to='llamadas.llamada')),
+            ],
+            options={
+                'verbose_name': 'Número de Campaña',
+                'verbose_name_plural': 'Números de Campaña',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['campana', 'estado', 'proximo_intento'], name='llamadas_nu_campana_061a51_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.7 on 2026-10-18 04:32
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from llamadas.migraciones import AgregarIndiceConcurrente
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY en PostgreSQL (ver llamadas/migraciones.py)
+    atomic = False
+
+    dependencies = [
+        ('llamadas', '0002_campanas'),
+    ]
+
+    operations = [
+        AgregarIndiceConcurrente(
+            model_name='llamada',
+            index=models.Index(fields=['estado', '-fecha_creacion'], name='llamada_estado_fecha_idx'),
+        ),
+        AgregarIndiceConcurrente(
+            model_name='mensajeconversacion',
+            index=models.Index(fields=['llamada', 'timestamp'], name='mensaje_llamada_ts_idx'),
+        ),
+        # El índice de la FK se quita después de crear el compuesto que lo reemplaza
+        migrations.AlterField(
+            model_name='mensajeconversacion',
+            name='llamada',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='mensajes', to='llamadas.llamada'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-18 04:38
+
+from django.db import migrations, models
+
+from llamadas.migraciones import AgregarIndiceConcurrente
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY en PostgreSQL (ver llamadas/migraciones.py)
+    atomic = False
+
+    dependencies = [
+        ('llamadas', '0003_indices_consultas'),
+    ]
+
+    operations = [
+        AgregarIndiceConcurrente(
+            model_name='llamada',
+            index=models.Index(fields=['-fecha_creacion', '-id'], name='llamada_fecha_id_idx'),
+        ),
+    ]
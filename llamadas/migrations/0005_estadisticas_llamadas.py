@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-18 04:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('llamadas', '0004_indice_paginacion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EstadisticaLlamadas',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hora', models.DateTimeField(help_text='Hora de creación de las llamadas (truncada)')),
+                ('estado', models.CharField(choices=[('iniciada', 'Iniciada'), ('en_progreso', 'En Progreso'), ('completada', 'Completada'), ('fallida', 'Fallida'), ('cancelada', 'Cancelada')], max_length=20)),
+                ('numero_origen', models.CharField(max_length=20)),
+                ('llamadas', models.IntegerField(default=0)),
+                ('duracion_total', models.IntegerField(default=0, help_text='Suma de duraciones en segundos')),
+            ],
+            options={
+                'verbose_name': 'Estadística de Llamadas',
+                'verbose_name_plural': 'Estadísticas de Llamadas',
+                'ordering': ['-hora'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='estadisticallamadas',
+            constraint=models.UniqueConstraint(fields=('hora', 'estado', 'numero_origen'), name='estadistica_hora_estado_origen'),
+        ),
+    ]
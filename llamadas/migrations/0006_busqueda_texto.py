@@ -0,0 +1,94 @@
+"""
+Índice de texto completo sobre MensajeConversacion.contenido (ver llamadas/busqueda.py)
+
+SQLite: tabla FTS5 de contenido externo + triggers que la sincronizan.
+PostgreSQL: índice GIN sobre to_tsvector('spanish', contenido), creado con
+CONCURRENTLY para no bloquear las escrituras (por eso la migración no es atómica).
+Con otra base de datos (o SQLite sin FTS5) no hace nada y la búsqueda usa icontains.
+"""
+from django.db import migrations, transaction
+
+
+SQLITE_CREAR = [
+    # remove_diacritics: "numero" encuentra "número"
+    """CREATE VIRTUAL TABLE llamadas_mensaje_fts USING fts5(
+        contenido, content='llamadas_mensajeconversacion', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER llamadas_mensaje_fts_ai AFTER INSERT ON llamadas_mensajeconversacion BEGIN
+        INSERT INTO llamadas_mensaje_fts(rowid, contenido) VALUES (new.id, new.contenido);
+    END""",
+    """CREATE TRIGGER llamadas_mensaje_fts_ad AFTER DELETE ON llamadas_mensajeconversacion BEGIN
+        INSERT INTO llamadas_mensaje_fts(llamadas_mensaje_fts, rowid, contenido) VALUES ('delete', old.id, old.contenido);
+    END""",
+    """CREATE TRIGGER llamadas_mensaje_fts_au AFTER UPDATE OF contenido ON llamadas_mensajeconversacion BEGIN
+        INSERT INTO llamadas_mensaje_fts(llamadas_mensaje_fts, rowid, contenido) VALUES ('delete', old.id, old.contenido);
+        INSERT INTO llamadas_mensaje_fts(rowid, contenido) VALUES (new.id, new.contenido);
+    END""",
+    # Indexar los mensajes que ya existen
+    "INSERT INTO llamadas_mensaje_fts(llamadas_mensaje_fts) VALUES ('rebuild')",
+]
+
+SQLITE_BORRAR = [
+    "DROP TRIGGER IF EXISTS llamadas_mensaje_fts_au",
+    "DROP TRIGGER IF EXISTS llamadas_mensaje_fts_ad",
+    "DROP TRIGGER IF EXISTS llamadas_mensaje_fts_ai",
+    "DROP TABLE IF EXISTS llamadas_mensaje_fts",
+]
+
+POSTGRES_CREAR = [
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS mensaje_contenido_fts_idx ON llamadas_mensajeconversacion "
+    "USING GIN (to_tsvector('spanish'::regconfig, contenido))",
+]
+
+POSTGRES_BORRAR = [
+    "DROP INDEX CONCURRENTLY IF EXISTS mensaje_contenido_fts_idx",
+]
+
+
+def _fts5_disponible(schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('PRAGMA compile_options')
+        return any('FTS5' in opcion for opcion, in cursor.fetchall())
+
+
+def _sentencias(schema_editor, crear):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        return POSTGRES_CREAR if crear else POSTGRES_BORRAR
+    if vendor == 'sqlite' and (not crear or _fts5_disponible(schema_editor)):
+        return SQLITE_CREAR if crear else SQLITE_BORRAR
+    return []
+
+
+def _ejecutar(schema_editor, sentencias):
+    conexion = schema_editor.connection
+    if conexion.vendor == 'postgresql':
+        # CONCURRENTLY no admite transacción
+        for sentencia in sentencias:
+            schema_editor.execute(sentencia)
+        return
+    # La tabla FTS5 y sus triggers se crean (o se borran) juntos o nada
+    with transaction.atomic(using=conexion.alias):
+        for sentencia in sentencias:
+            schema_editor.execute(sentencia)
+
+
+def crear_indice(apps, schema_editor):
+    _ejecutar(schema_editor, _sentencias(schema_editor, crear=True))
+
+
+def borrar_indice(apps, schema_editor):
+    _ejecutar(schema_editor, _sentencias(schema_editor, crear=False))
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('llamadas', '0005_estadisticas_llamadas'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_indice, borrar_indice),
+    ]
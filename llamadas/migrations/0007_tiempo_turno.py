@@ -0,0 +1,30 @@
+# Generated by Django 4.2.7 on 2026-10-18 04:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('llamadas', '0006_busqueda_texto'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TiempoTurno',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('turno', models.IntegerField(default=0)),
+                ('total', models.FloatField(help_text='Duración de la petición en segundos')),
+                ('etapas', models.JSONField(default=dict, help_text='Segundos por etapa: conversacion, resumen, openai, guardar, twiml')),
+                ('fecha', models.DateTimeField(auto_now_add=True)),
+                ('llamada', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tiempos_turno', to='llamadas.llamada')),
+            ],
+            options={
+                'verbose_name': 'Tiempo de Turno',
+                'verbose_name_plural': 'Tiempos de Turno',
+                'ordering': ['-fecha'],
+            },
+        ),
+    ]
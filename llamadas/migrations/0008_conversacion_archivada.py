@@ -0,0 +1,30 @@
+# Generated by Django 4.2.7 on 2026-10-18 04:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('llamadas', '0007_tiempo_turno'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversacionArchivada',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('formato', models.CharField(choices=[('gzip', 'gzip'), ('zstd', 'zstd')], default='gzip', max_length=10)),
+                ('datos', models.BinaryField(help_text='Lista JSON de mensajes (tipo, contenido, timestamp) comprimida')),
+                ('mensajes', models.IntegerField(default=0, help_text='Cantidad de mensajes archivados')),
+                ('bytes_original', models.IntegerField(default=0, help_text='Tamaño del JSON sin comprimir')),
+                ('fecha', models.DateTimeField(auto_now_add=True)),
+                ('llamada', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='archivo', to='llamadas.llamada')),
+            ],
+            options={
+                'verbose_name': 'Conversación Archivada',
+                'verbose_name_plural': 'Conversaciones Archivadas',
+            },
+        ),
+    ]
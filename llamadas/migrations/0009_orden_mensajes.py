@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-18 05:38
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('llamadas', '0008_conversacion_archivada'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='mensajeconversacion',
+            options={'ordering': ['timestamp', 'id'], 'verbose_name': 'Mensaje de Conversación', 'verbose_name_plural': 'Mensajes de Conversación'},
+        ),
+    ]
@@ -35,6 +35,12 @@ class Llamada(models.Model):
         ordering = ['-fecha_creacion']
         verbose_name = 'Llamada'
         verbose_name_plural = 'Llamadas'
+        indexes = [
+            # Llamadas activas más recientes: estado__in=[...] ordenado por -fecha_creacion
+            models.Index(fields=['estado', '-fecha_creacion'], name='llamada_estado_fecha_idx'),
+            # Paginación por cursor de la API: (fecha_creacion, id) < (cursor) ordenado descendente
+            models.Index(fields=['-fecha_creacion', '-id'], name='llamada_fecha_id_idx'),
+        ]
     
     def __str__(self):
         return f"Llamada {self.sid} - {self.numero_destino} ({self.estado})"
@@ -48,16 +54,162 @@ class MensajeConversacion(models.Model):
         ('ia', 'IA'),
     ]
     
-    llamada = models.ForeignKey(Llamada, on_delete=models.CASCADE, related_name='mensajes')
+    # Sin índice propio: lo cubre el índice compuesto (llamada, timestamp)
+    llamada = models.ForeignKey(Llamada, on_delete=models.CASCADE, related_name='mensajes', db_index=False)
     tipo = models.CharField(max_length=10, choices=TIPO_CHOICES)
     contenido = models.TextField(help_text="Contenido del mensaje")
     timestamp = models.DateTimeField(auto_now_add=True)
     
     class Meta:
-        ordering = ['timestamp']
+        # Los mensajes de un turno se insertan juntos y pueden tener el mismo timestamp
+        ordering = ['timestamp', 'id']
         verbose_name = 'Mensaje de Conversación'
         verbose_name_plural = 'Mensajes de Conversación'
+        indexes = [
+            # Mensajes de una llamada en orden: llamada=... ordenado por timestamp
+            models.Index(fields=['llamada', 'timestamp'], name='mensaje_llamada_ts_idx'),
+        ]
     
     def __str__(self):
         return f"{self.tipo} - {self.llamada.sid}"
 
+
+class ConversacionArchivada(models.Model):
+    """
+    Mensajes de una llamada antigua compactados en un JSON comprimido (ver archivo.py)
+    """
+
+    FORMATO_CHOICES = [
+        ('gzip', 'gzip'),
+        ('zstd', 'zstd'),
+    ]
+
+    llamada = models.OneToOneField(Llamada, on_delete=models.CASCADE, related_name='archivo')
+    formato = models.CharField(max_length=10, choices=FORMATO_CHOICES, default='gzip')
+    datos = models.BinaryField(help_text="Lista JSON de mensajes (tipo, contenido, timestamp) comprimida")
+    mensajes = models.IntegerField(default=0, help_text="Cantidad de mensajes archivados")
+    bytes_original = models.IntegerField(default=0, help_text="Tamaño del JSON sin comprimir")
+    fecha = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Conversación Archivada'
+        verbose_name_plural = 'Conversaciones Archivadas'
+
+    def __str__(self):
+        return f"Archivo de {self.llamada_id} ({self.mensajes} mensajes)"
+
+
+class EstadisticaLlamadas(models.Model):
+    """
+    Agregado por hora de creación, estado y número de origen (ver estadisticas.py).
+    Las filas con estado 'iniciada' cuentan todas las llamadas creadas; las de
+    un estado final, las que terminaron en ese estado
+    """
+    
+    hora = models.DateTimeField(help_text="Hora de creación de las llamadas (truncada)")
+    estado = models.CharField(max_length=20, choices=Llamada.ESTADO_CHOICES)
+    numero_origen = models.CharField(max_length=20)
+    llamadas = models.IntegerField(default=0)
+    duracion_total = models.IntegerField(default=0, help_text="Suma de duraciones en segundos")
+    
+    class Meta:
+        ordering = ['-hora']
+        verbose_name = 'Estadística de Llamadas'
+        verbose_name_plural = 'Estadísticas de Llamadas'
+        constraints = [
+            models.UniqueConstraint(fields=['hora', 'estado', 'numero_origen'], name='estadistica_hora_estado_origen'),
+        ]
+    
+    def __str__(self):
+        return f"{self.hora:%Y-%m-%d %H}h {self.estado} {self.numero_origen}: {self.llamadas}"
+
+
+class TiempoTurno(models.Model):
+    """
+    Duración de las etapas de un turno de voz, para los turnos muestreados o
+    lentos (ver metricas.py)
+    """
+
+    llamada = models.ForeignKey(Llamada, on_delete=models.CASCADE, related_name='tiempos_turno')
+    turno = models.IntegerField(default=0)
+    total = models.FloatField(help_text="Duración de la petición en segundos")
+    etapas = models.JSONField(default=dict, help_text="Segundos por etapa: conversacion, resumen, openai, guardar, twiml")
+    fecha = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-fecha']
+        verbose_name = 'Tiempo de Turno'
+        verbose_name_plural = 'Tiempos de Turno'
+
+    def __str__(self):
+        return f"{self.llamada_id} turno {self.turno}: {self.total:.2f}s"
+
+
+class Campana(models.Model):
+    """Campaña de llamadas salientes masivas (ver campanas.py)"""
+    
+    ESTADO_CHOICES = [
+        ('pendiente', 'Pendiente'),
+        ('en_curso', 'En Curso'),
+        ('pausada', 'Pausada'),
+        ('completada', 'Completada'),
+    ]
+    
+    nombre = models.CharField(max_length=200)
+    estado = models.CharField(max_length=20, choices=ESTADO_CHOICES, default='pendiente')
+    
+    # Límites del programador
+    llamadas_por_segundo = models.FloatField(default=1.0, help_text="Llamadas nuevas por segundo (CPS)")
+    max_llamadas_activas = models.IntegerField(default=10, help_text="Llamadas simultáneas como máximo")
+    max_intentos = models.IntegerField(default=3, help_text="Intentos por número (ocupado/sin respuesta se reintenta)")
+    espera_reintento = models.IntegerField(default=60, help_text="Espera base entre intentos en segundos (se duplica en cada intento)")
+    
+    # Contadores de progreso (se actualizan de forma incremental)
+    total_numeros = models.IntegerField(default=0)
+    pendientes = models.IntegerField(default=0)
+    en_curso = models.IntegerField(default=0)
+    completadas = models.IntegerField(default=0)
+    fallidas = models.IntegerField(default=0)
+    
+    # Timestamps
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_inicio = models.DateTimeField(null=True, blank=True)
+    fecha_fin = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-fecha_creacion']
+        verbose_name = 'Campaña'
+        verbose_name_plural = 'Campañas'
+    
+    def __str__(self):
+        return f"Campaña {self.nombre} ({self.estado})"
+
+
+class NumeroCampana(models.Model):
+    """Número a marcar dentro de una campaña; la tabla hace de cola persistente"""
+    
+    ESTADO_CHOICES = [
+        ('pendiente', 'Pendiente'),
+        ('marcando', 'Marcando'),
+        ('completado', 'Completado'),
+        ('fallido', 'Fallido'),
+    ]
+    
+    campana = models.ForeignKey(Campana, on_delete=models.CASCADE, related_name='numeros')
+    numero = models.CharField(max_length=20)
+    estado = models.CharField(max_length=20, choices=ESTADO_CHOICES, default='pendiente')
+    intentos = models.IntegerField(default=0)
+    proximo_intento = models.DateTimeField(default=timezone.now, help_text="No se marca antes de esta fecha")
+    llamada = models.ForeignKey(Llamada, on_delete=models.SET_NULL, null=True, blank=True, related_name='numeros_campana')
+    ultimo_resultado = models.CharField(max_length=20, blank=True, help_text="Último CallStatus de Twilio")
+    
+    class Meta:
+        ordering = ['id']
+        verbose_name = 'Número de Campaña'
+        verbose_name_plural = 'Números de Campaña'
+        indexes = [
+            models.Index(fields=['campana', 'estado', 'proximo_intento']),
+        ]
+    
+    def __str__(self):
+        return f"{self.numero} - {self.campana.nombre} ({self.estado})"
@@ -0,0 +1,289 @@
+"""
+Escritura de los mensajes de la conversación
+
+Cada turno guarda sus mensajes y, en la misma transacción, agrega las líneas
+correspondientes a Llamada.transcripcion con un UPDATE que concatena en la
+base de datos. Así la transcripción siempre está al día y webhook_status no
+tiene que reconstruirla al terminar la llamada.
+
+Con settings.MENSAJES_DIFERIDOS los turnos no se escriben dentro del request:
+guardar_mensajes los deja en una cola acotada (MENSAJES_COLA_MAX) y un hilo
+escritor los guarda por lotes, varios turnos en una sola transacción, después
+de que el webhook ya respondió. El historial que usa el siguiente turno sale
+del almacén de conversaciones, que se actualiza en el momento (si el almacén
+la pierde justo entonces, se reconstruye sin los turnos aún en cola). Si la cola
+está llena, el request espera a que haya lugar (contrapresión): todos los turnos
+pasan por el escritor, así que los de una llamada se guardan en orden. Una
+espera de más de MENSAJES_ESPERA_COLA segundos se registra y se cuenta.
+
+Los turnos que no se pudieron escribir (la base de datos no responde, por
+ejemplo) se reintentan con espera exponencial hasta MENSAJES_REINTENTOS veces,
+y mientras tanto los turnos siguientes de la misma llamada esperan detrás de
+ellos. Al terminar el proceso se escribe todo lo que quede en la cola.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, models, transaction
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Concat
+
+from .metricas import histograma, registrar_indicador
+from .models import Llamada, MensajeConversacion
+
+
+logger = logging.getLogger(__name__)
+
+# Espera antes de reintentar un turno que no se pudo escribir; se duplica en cada intento
+REINTENTO_ESPERA_BASE = 0.5
+REINTENTO_ESPERA_MAX = 30.0
+
+TIPOS_DISPLAY = dict(MensajeConversacion.TIPO_CHOICES)
+
+
+def linea_transcripcion(tipo, contenido):
+    return f"{TIPOS_DISPLAY.get(tipo, tipo)}: {contenido}"
+
+
+def construir_transcripcion(mensajes):
+    """
+    Transcripción completa a partir de pares (tipo, contenido) en orden
+    """
+    return "\n".join(linea_transcripcion(tipo, contenido) for tipo, contenido in mensajes)
+
+
+def escribir_turnos(turnos):
+    """
+    Guarda los mensajes de varios turnos y su transcripción en una sola transacción
+
+    Args:
+        turnos: Lista de (llamada_id, [(tipo, contenido), ...]) en orden
+    """
+    por_llamada = {}
+    for llamada_id, mensajes in turnos:
+        por_llamada.setdefault(llamada_id, []).extend(mensajes)
+    with transaction.atomic():
+        MensajeConversacion.objects.bulk_create([
+            MensajeConversacion(llamada_id=llamada_id, tipo=tipo, contenido=contenido)
+            for llamada_id, mensajes in turnos
+            for tipo, contenido in mensajes
+        ])
+        for llamada_id, mensajes in por_llamada.items():
+            texto = construir_transcripcion(mensajes)
+            Llamada.objects.filter(pk=llamada_id).update(transcripcion=Case(
+                When(transcripcion='', then=Value(texto)),
+                default=Concat(F('transcripcion'), Value('\n' + texto), output_field=models.TextField()),
+                output_field=models.TextField(),
+            ))
+
+
+class EscritorMensajes:
+    """
+    Cola acotada de turnos y el hilo que los escribe por lotes
+    """
+
+    _FIN = object()
+
+    def __init__(self, max_cola=None, lote=None, max_reintentos=None):
+        self.cola = queue.Queue(max_cola or settings.MENSAJES_COLA_MAX)
+        self.lote = lote or settings.MENSAJES_LOTE
+        self.max_reintentos = settings.MENSAJES_REINTENTOS if max_reintentos is None else max_reintentos
+        # Turnos que esperaron más de MENSAJES_ESPERA_COLA a que hubiera lugar en la cola
+        self.esperas_cola = 0
+        # Turnos que se perdieron después de agotar los reintentos
+        self.descartados = 0
+        # {llamada_id: {'turnos': [...], 'intentos': n, 'proximo': instante}} en orden de llegada
+        self._reintentos = {}
+        self._hilo = threading.Thread(target=self._ejecutar, name='escritor-mensajes', daemon=True)
+        self._hilo.start()
+        atexit.register(self.detener)
+
+    def encolar(self, llamada_id, mensajes):
+        if not self._hilo.is_alive():
+            # Proceso terminando (detener ya corrió): no queda quien vacíe la cola
+            escribir_turnos([(llamada_id, mensajes)])
+            return
+        try:
+            self.cola.put((llamada_id, mensajes), timeout=settings.MENSAJES_ESPERA_COLA)
+        except queue.Full:
+            self.esperas_cola += 1
+            logger.warning("Cola de mensajes llena, el request espera al escritor")
+            self.cola.put((llamada_id, mensajes))
+
+    def reintentos_pendientes(self):
+        return sum(len(pendiente['turnos']) for pendiente in list(self._reintentos.values()))
+
+    def _espera_reintento(self, intentos):
+        return min(REINTENTO_ESPERA_BASE * 2 ** (intentos - 1), REINTENTO_ESPERA_MAX)
+
+    def _aplazar(self, turno, ahora):
+        pendiente = self._reintentos.get(turno[0])
+        if pendiente is None:
+            self._reintentos[turno[0]] = {
+                'turnos': [turno], 'intentos': 1, 'proximo': ahora + self._espera_reintento(1),
+            }
+        else:
+            pendiente['turnos'].append(turno)
+
+    def _escribir(self, turnos):
+        inicio = time.perf_counter()
+        # Los turnos de una llamada con reintentos pendientes van detrás de ellos
+        listos = []
+        for turno in turnos:
+            if turno[0] in self._reintentos:
+                self._reintentos[turno[0]]['turnos'].append(turno)
+            else:
+                listos.append(turno)
+        try:
+            if listos:
+                escribir_turnos(listos)
+        except Exception:
+            # Un turno inválido no debe arrastrar al resto del lote
+            logger.exception("Error al escribir un lote de mensajes, se reintenta turno por turno")
+            for turno in listos:
+                if turno[0] in self._reintentos:
+                    self._reintentos[turno[0]]['turnos'].append(turno)
+                    continue
+                try:
+                    escribir_turnos([turno])
+                except Exception:
+                    logger.exception("No se pudieron guardar los mensajes del turno, se reintentará",
+                                     extra={'llamada_id': turno[0]})
+                    self._aplazar(turno, time.monotonic())
+        finally:
+            histograma('escritura_mensajes').observar(time.perf_counter() - inicio)
+
+    def _reintentar(self, todos=False):
+        """
+        Vuelve a escribir los turnos aplazados cuya espera ya venció (o todos)
+        """
+        ahora = time.monotonic()
+        for llamada_id, pendiente in list(self._reintentos.items()):
+            if not todos and pendiente['proximo'] > ahora:
+                continue
+            try:
+                escribir_turnos(pendiente['turnos'])
+            except Exception:
+                pendiente['intentos'] += 1
+                if pendiente['intentos'] > self.max_reintentos or todos:
+                    self.descartados += len(pendiente['turnos'])
+                    del self._reintentos[llamada_id]
+                    logger.exception("Se descartan los mensajes de la llamada tras agotar los reintentos",
+                                     extra={'llamada_id': llamada_id, 'turnos': len(pendiente['turnos'])})
+                else:
+                    pendiente['proximo'] = ahora + self._espera_reintento(pendiente['intentos'])
+                    logger.warning("Reintento fallido al guardar mensajes",
+                                   extra={'llamada_id': llamada_id, 'intentos': pendiente['intentos']})
+            else:
+                del self._reintentos[llamada_id]
+
+    def _proximo_reintento(self):
+        """
+        Segundos hasta el próximo reintento, o None si no hay ninguno pendiente
+        """
+        if not self._reintentos:
+            return None
+        return max(0.0, min(pendiente['proximo'] for pendiente in self._reintentos.values()) - time.monotonic())
+
+    def _ejecutar(self):
+        terminar = False
+        while not terminar:
+            # Espera el primer turno (o el próximo reintento) y junta los que ya estén en la cola
+            try:
+                turnos = [self.cola.get(timeout=self._proximo_reintento())]
+            except queue.Empty:
+                turnos = []
+            while turnos and len(turnos) < self.lote:
+                try:
+                    turnos.append(self.cola.get_nowait())
+                except queue.Empty:
+                    break
+            if self._FIN in turnos:
+                terminar = True
+                turnos = [turno for turno in turnos if turno is not self._FIN]
+            if turnos:
+                self._escribir(turnos)
+            # Al terminar, un último intento con todos los aplazados
+            self._reintentar(todos=terminar)
+            # Hilo fuera del ciclo de request: liberar la conexión a la BD
+            close_old_connections()
+
+    def detener(self):
+        """Escribe lo que quede en la cola y detiene el hilo"""
+        if not self._hilo.is_alive():
+            return
+        self.cola.put(self._FIN)
+        self._hilo.join()
+
+
+_escritor = None
+_escritor_lock = threading.Lock()
+
+
+def obtener_escritor():
+    """
+    Escritor del proceso, o None si MENSAJES_DIFERIDOS está desactivado
+    """
+    global _escritor
+    if not settings.MENSAJES_DIFERIDOS:
+        return None
+    if _escritor is None:
+        with _escritor_lock:
+            if _escritor is None:
+                _escritor = EscritorMensajes()
+    return _escritor
+
+
+def guardar_mensajes(llamada_id, mensajes):
+    """
+    Guarda los mensajes de un turno y los agrega a la transcripción
+
+    Args:
+        llamada_id: ID de la Llamada
+        mensajes: Lista de pares (tipo, contenido), p. ej. [('usuario', '...'), ('ia', '...')]
+    """
+    if not mensajes:
+        return
+    escritor = obtener_escritor()
+    if escritor is None:
+        escribir_turnos([(llamada_id, mensajes)])
+    else:
+        escritor.encolar(llamada_id, mensajes)
+
+
+def _en_cola():
+    return _escritor.cola.qsize() if _escritor is not None else 0
+
+
+def _esperas_cola():
+    return _escritor.esperas_cola if _escritor is not None else 0
+
+
+def _reintentos():
+    return _escritor.reintentos_pendientes() if _escritor is not None else 0
+
+
+def _descartados():
+    return _escritor.descartados if _escritor is not None else 0
+
+
+registrar_indicador(
+    'noxus_mensajes_en_cola', 'gauge',
+    'Turnos esperando al escritor de mensajes en segundo plano', _en_cola,
+)
+registrar_indicador(
+    'noxus_mensajes_esperas_cola_total', 'counter',
+    'Turnos que esperaron más de MENSAJES_ESPERA_COLA a que hubiera lugar en la cola de mensajes', _esperas_cola,
+)
+registrar_indicador(
+    'noxus_mensajes_reintentos', 'gauge',
+    'Turnos que no se pudieron escribir y esperan un reintento', _reintentos,
+)
+registrar_indicador(
+    'noxus_mensajes_descartados_total', 'counter',
+    'Turnos perdidos después de agotar MENSAJES_REINTENTOS', _descartados,
+)
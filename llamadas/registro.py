@@ -0,0 +1,212 @@
+"""
+Registro estructurado y sin bloqueos
+
+Los módulos registran con logging.getLogger(__name__) y la configuración
+(settings.LOGGING) arma el camino de cada registro:
+
+    - FiltroLlamada (en el hilo del request): agrega call_sid, llamada_id y
+      turno de la llamada en curso (contexto_llamada) y muestrea los registros
+      por debajo de WARNING según LOG_MUESTREO. El muestreo se decide por
+      CallSid, así que una llamada muestreada queda registrada completa.
+    - ManejadorCola: el request solo encola el registro, sin I/O. Un hilo
+      (QueueListener) lo formatea y lo escribe en stdout. Si la cola se llena
+      (LOG_COLA_MAX) el registro se descarta y se cuenta en vez de bloquear.
+    - FormatoJSON / FormatoTexto (en el hilo del listener): una línea JSON por
+      registro, o texto legible para desarrollo. Los números de teléfono se
+      enmascaran dejando los últimos 4 dígitos: los campos que son teléfonos
+      (From, To, numero_*) siempre, y en el resto del texto los números con
+      prefijo internacional ("+34 600-111-222"), no cualquier serie de dígitos.
+"""
+import asyncio
+import atexit
+import contextvars
+import functools
+import json
+import logging
+import queue
+import random
+import re
+import sys
+import zlib
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+
+# Atributos propios de LogRecord: lo demás son campos pasados con extra={...}
+_ATRIBUTOS_RECORD = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+# +34600111222, +34 600 111 222, +34-600-111-222 (o %2B34... en una URL). Exige el
+# prefijo: una serie de dígitos suelta puede ser un timestamp o un ID, no un teléfono
+PATRON_TELEFONO = re.compile(r'(?<![\w+%])(?:\+|%2[Bb])\d(?:[ -]?\d){8,14}(?![\w-])')
+
+# Campos de registro (extra=...) que son teléfonos, con o sin prefijo
+CAMPOS_TELEFONO = {'From', 'To', 'Caller', 'Called', 'from', 'to', 'telefono'}
+
+_contexto = contextvars.ContextVar('contexto_llamada', default=None)
+
+
+def enmascarar_numero(valor):
+    """
+    '***' y los últimos 4 dígitos de un teléfono
+    """
+    if valor in (None, ''):
+        return valor
+    return '***' + re.sub(r'\D', '', str(valor))[-4:]
+
+
+def enmascarar_telefonos(texto):
+    return PATRON_TELEFONO.sub(lambda m: enmascarar_numero(m.group().replace('%2B', '').replace('%2b', '')), texto)
+
+
+def es_campo_telefono(nombre):
+    return nombre in CAMPOS_TELEFONO or nombre.startswith('numero')
+
+
+def contexto_llamada(**campos):
+    """
+    Agrega campos (call_sid, llamada_id, turno) a los registros del request en curso
+    """
+    actual = _contexto.get()
+    if actual is not None:
+        actual.update({k: v for k, v in campos.items() if v not in (None, '')})
+
+
+def contexto_actual():
+    """
+    Copia de los campos de la llamada en curso (vacía fuera de un webhook)
+    """
+    return dict(_contexto.get() or {})
+
+
+def con_contexto_llamada(view_func):
+    """
+    Decorador de los webhooks: abre un contexto de registro por petición con
+    el CallSid de Twilio (síncrono o asíncrono)
+    """
+    def _abrir(request):
+        call_sid = request.POST.get('CallSid') or request.GET.get('CallSid', '')
+        return _contexto.set({'call_sid': call_sid} if call_sid else {})
+
+    if asyncio.iscoroutinefunction(view_func):
+        @functools.wraps(view_func)
+        async def wrapper_async(request, *args, **kwargs):
+            token = _abrir(request)
+            try:
+                return await view_func(request, *args, **kwargs)
+            finally:
+                _contexto.reset(token)
+        return wrapper_async
+
+    @functools.wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        token = _abrir(request)
+        try:
+            return view_func(request, *args, **kwargs)
+        finally:
+            _contexto.reset(token)
+    return wrapper
+
+
+class FiltroLlamada(logging.Filter):
+    """
+    Agrega el contexto de la llamada y muestrea los registros por debajo de WARNING
+    """
+
+    def __init__(self, muestreo=1.0):
+        super().__init__()
+        self.muestreo = muestreo
+
+    def filter(self, record):
+        for campo, valor in (_contexto.get() or {}).items():
+            if not hasattr(record, campo):
+                setattr(record, campo, valor)
+        if self.muestreo >= 1 or record.levelno >= logging.WARNING:
+            return True
+        call_sid = getattr(record, 'call_sid', '')
+        if call_sid:
+            return zlib.crc32(call_sid.encode()) % 10000 < self.muestreo * 10000
+        return random.random() < self.muestreo
+
+
+def _campos_extra(record):
+    return {
+        k: enmascarar_numero(v) if es_campo_telefono(k) else v
+        for k, v in vars(record).items() if k not in _ATRIBUTOS_RECORD
+    }
+
+
+class FormatoJSON(logging.Formatter):
+    """Una línea JSON por registro"""
+
+    def format(self, record):
+        datos = {
+            'fecha': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'nivel': record.levelname,
+            'logger': record.name,
+            'mensaje': record.getMessage(),
+        }
+        datos.update(_campos_extra(record))
+        if record.exc_info:
+            datos['error'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            datos['error'] = record.exc_text
+        return enmascarar_telefonos(json.dumps(datos, ensure_ascii=False, default=str))
+
+
+class FormatoTexto(logging.Formatter):
+    """Texto legible para desarrollo, con los mismos campos y enmascarado"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s %(message)s')
+
+    def format(self, record):
+        texto = super().format(record)
+        extra = _campos_extra(record)
+        if extra:
+            texto += ' ' + ' '.join(f"{k}={v}" for k, v in extra.items())
+        return enmascarar_telefonos(texto)
+
+
+class ManejadorCola(QueueHandler):
+    """
+    QueueHandler con cola acotada y su propio QueueListener hacia stdout.
+    El formatter configurado se aplica en el hilo del listener
+    """
+
+    def __init__(self, max_cola=10000, destino=None):
+        super().__init__(queue.Queue(max_cola))
+        self.destino = destino or logging.StreamHandler(sys.stdout)
+        self.descartados = 0
+        self.listener = QueueListener(self.queue, self.destino)
+        self.listener.start()
+        atexit.register(self.detener)
+
+    def setFormatter(self, fmt):
+        self.destino.setFormatter(fmt)
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.descartados += 1
+
+    def prepare(self, record):
+        # Solo lo imprescindible en el hilo del request: fijar el mensaje y el
+        # traceback (los argumentos y exc_info no se pueden usar en otro hilo)
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def detener(self):
+        """Escribe lo que quede en la cola y detiene el hilo"""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def close(self):
+        self.detener()
+        super().close()
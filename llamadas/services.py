@@ -1,12 +1,20 @@
 """
 Servicios para manejar Twilio y OpenAI
 """
-import os
-from twilio.rest import Client
-from twilio.twiml.voice_response import VoiceResponse, Gather
+import logging
+from twilio.twiml.voice_response import VoiceResponse, Connect
 from django.conf import settings
-from openai import OpenAI
-import json
+
+from . import twiml
+from .audio import audios_frases_fijas
+from .cache_respuestas import obtener_cache_respuestas
+from .clientes import obtener_cliente_openai, obtener_cliente_openai_async, obtener_cliente_twilio
+from .contexto import mensaje_resumen, recortar_texto, tokens_mensajes, ventana_historial
+from .metricas import cronometrado
+from .tokens import firmar_turno
+
+
+logger = logging.getLogger(__name__)
 
 
 class TwilioService:
@@ -16,15 +24,22 @@ class TwilioService:
         self.account_sid = settings.TWILIO_ACCOUNT_SID
         self.auth_token = settings.TWILIO_AUTH_TOKEN
         self.phone_number = settings.TWILIO_PHONE_NUMBER
-        self.client = Client(self.account_sid, self.auth_token) if self.account_sid else None
+
+    @property
+    def client(self):
+        # Cliente del hilo que hace la petición, con el pool de conexiones del proceso (ver clientes.py)
+        return obtener_cliente_twilio()
     
-    def hacer_llamada(self, numero_destino, webhook_url):
+    @cronometrado('twilio_api')
+    def hacer_llamada(self, numero_destino, webhook_url, llamada_id=None):
         """
         Realiza una llamada saliente usando Twilio
         
         Args:
             numero_destino: Número de teléfono destino
             webhook_url: URL del webhook para manejar la llamada
+            llamada_id: Llamada ya creada para este número; su token va en la URL
+                del webhook para que el primer evento la encuentre sin el CallSid
             
         Returns:
             Objeto Call de Twilio
@@ -32,132 +47,86 @@ class TwilioService:
         if not self.client:
             raise ValueError("Twilio no está configurado correctamente")
         
-        print(f"[TwilioService] Haciendo llamada a {numero_destino}")
-        print(f"[TwilioService] Webhook URL: {webhook_url}")
-        
-        # Desbloquear ngrok antes de hacer la llamada (para evitar página de advertencia)
-        # Solo hacer GET para desbloquear, no POST (para no interferir con Twilio)
-        try:
-            import requests
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8'
-            }
-            # Solo GET para desbloquear ngrok (no POST para no interferir)
-            response_get = requests.get(webhook_url, timeout=5, headers=headers, allow_redirects=True)
-            print(f"[TwilioService] Ngrok desbloqueado (GET) - Status: {response_get.status_code}")
-        except Exception as e:
-            print(f"[TwilioService] Advertencia: No se pudo desbloquear ngrok: {e}")
-        
         # IMPORTANTE: Twilio necesita que el webhook sea accesible cuando se contesta la llamada
         # Asegurarnos de que la URL sea HTTPS y accesible
         if not webhook_url.startswith('https://'):
             raise ValueError(f"El webhook URL debe ser HTTPS: {webhook_url}")
         
-        print(f"[TwilioService] Creando llamada con webhook: {webhook_url}")
+        logger.info("Creando llamada", extra={'numero_destino': numero_destino, 'webhook_url': webhook_url})
         
         # Crear la llamada con el webhook
         # Twilio llamará a esta URL cuando se conteste la llamada
         call = self.client.calls.create(
             to=numero_destino,
             from_=self.phone_number,
-            url=webhook_url,
+            url=twiml.url_con_token(webhook_url, self.token_turno(llamada_id, 0)),
             method='POST',
             status_callback=f"{webhook_url.replace('/webhook/', '/webhook-status/')}",
             status_callback_event=['initiated', 'ringing', 'answered', 'completed'],
             status_callback_method='POST'
         )
         
-        print(f"[TwilioService] Llamada creada - SID: {call.sid}, Status: {call.status}")
+        logger.info("Llamada creada", extra={'call_sid': call.sid, 'status': call.status})
         
         return call
     
-    def generar_twiml_inicial(self, webhook_url):
+    def token_turno(self, llamada_id, turno):
         """
-        Genera TwiML para el inicio de la llamada
+        Token firmado que identifica la llamada y el turno en la URL del Gather (ver tokens.py)
         """
-        response = VoiceResponse()
-        
-        # Saludo inicial más corto y directo
-        response.say(
-            'Hola, soy tu asistente virtual. ¿En qué puedo ayudarte?',
-            language='es-ES',
-            voice='Polly.Lupe'
-        )
-        
-        # Pausa breve antes de capturar
-        response.pause(length=1)
-        
-        # Gather para capturar la voz del usuario
-        gather = Gather(
-            input='speech',
-            language='es-ES',
-            speech_timeout='auto',
-            action=webhook_url,
-            method='POST',
-            timeout=10,  # Timeout de 10 segundos
-            finish_on_key='#'  # Opcional: terminar con #
+        return firmar_turno(llamada_id, turno) if llamada_id else ''
+    
+    @cronometrado('twiml')
+    def generar_twiml_inicial(self, webhook_url, llamada_id=None, turno=0):
+        """
+        Genera TwiML para el inicio de la llamada (precompilado, ver twiml.py)
+        """
+        voz, idioma = twiml.voz_e_idioma()
+        return twiml.twiml_inicial(
+            webhook_url, voz, idioma, audios_frases_fijas(voz, idioma), self.token_turno(llamada_id, turno)
         )
-        # No agregar otro Say dentro del Gather, solo esperar
-        response.append(gather)
-        
-        # Si no hay respuesta, redirigir al webhook para intentar de nuevo
-        response.say('No escuché tu respuesta. Por favor, intenta de nuevo.', language='es-ES', voice='Polly.Lupe')
-        response.redirect(webhook_url)
-        
-        return str(response)
     
-    def generar_twiml_respuesta(self, mensaje_ia, webhook_url):
+    @cronometrado('twiml')
+    def generar_twiml_respuesta(self, mensaje_ia, webhook_url, llamada_id=None, turno=0):
         """
         Genera TwiML con la respuesta de la IA y espera más input
         """
-        response = VoiceResponse()
-        
-        # Pausa breve antes de responder
-        response.pause(length=1)
-        
-        # Decir la respuesta de la IA
-        response.say(
-            mensaje_ia,
-            language='es-ES',
-            voice='Polly.Lupe'
-        )
-        
-        # Pausa después de la respuesta
-        response.pause(length=1)
-        
-        # Gather para capturar más input del usuario
-        gather = Gather(
-            input='speech',
-            language='es-ES',
-            speech_timeout='auto',
-            action=webhook_url,
-            method='POST',
-            timeout=10,  # Timeout de 10 segundos
-            finish_on_key='#'  # Opcional: terminar con #
+        voz, idioma = twiml.voz_e_idioma()
+        return twiml.twiml_respuesta(
+            mensaje_ia, webhook_url, voz, idioma, audios_frases_fijas(voz, idioma), self.token_turno(llamada_id, turno)
         )
-        gather.say('¿Algo más en lo que pueda ayudarte?', language='es-ES', voice='Polly.Lupe')
-        response.append(gather)
-        
-        # Si no hay respuesta, finalizar
-        response.pause(length=2)
-        response.say('Gracias por llamar. Hasta luego.', language='es-ES', voice='Polly.Lupe')
-        response.hangup()
-        
-        return str(response)
     
+    @cronometrado('twiml')
     def generar_twiml_final(self, mensaje_ia):
         """
         Genera TwiML final para cerrar la llamada
         """
+        voz, idioma = twiml.voz_e_idioma()
+        return twiml.twiml_final(mensaje_ia, voz, idioma, audios_frases_fijas(voz, idioma))
+    
+    @cronometrado('twiml')
+    def generar_twiml_espera(self, redirect_url):
+        """
+        Genera TwiML de relleno que vuelve a pedir la respuesta a redirect_url
+        """
+        voz, idioma = twiml.voz_e_idioma()
+        return twiml.twiml_espera(redirect_url, voz, idioma, audios_frases_fijas(voz, idioma))
+    
+    @cronometrado('twiml')
+    def generar_twiml_stream(self, stream_url, call_sid=''):
+        """
+        Genera TwiML que conecta la llamada a un Media Stream bidireccional
+        
+        Args:
+            stream_url: URL wss:// del endpoint WebSocket (ver llamadas/streaming.py)
+            call_sid: SID de la llamada, se envía como parámetro personalizado
+        """
         response = VoiceResponse()
-        response.say(
-            mensaje_ia,
-            language='es-ES',
-            voice='Polly.Lupe'
-        )
-        response.say('Gracias por llamar. Hasta luego.', language='es-ES', voice='Polly.Lupe')
-        response.hangup()
+        connect = Connect()
+        stream = connect.stream(url=stream_url)
+        if call_sid:
+            stream.parameter(name='call_sid', value=call_sid)
+        response.append(connect)
         
         return str(response)
 
@@ -168,22 +137,18 @@ class AIService:
     def __init__(self):
         self.api_key = settings.OPENAI_API_KEY
         self.model = settings.OPENAI_MODEL
-        self.client = OpenAI(api_key=self.api_key) if self.api_key else None
+        # Cliente compartido por proceso (pool de conexiones persistentes, ver clientes.py)
+        self.client = obtener_cliente_openai()
+    
+    @property
+    def async_client(self):
+        """Cliente AsyncOpenAI compartido del event loop actual"""
+        return obtener_cliente_openai_async()
     
-    def obtener_respuesta(self, mensaje_usuario, historial_conversacion=None):
+    def _construir_mensajes(self, mensaje_usuario, historial_conversacion=None, resumen=None):
         """
-        Obtiene una respuesta de la IA basada en el mensaje del usuario
-        
-        Args:
-            mensaje_usuario: Texto del mensaje del usuario
-            historial_conversacion: Lista de mensajes previos en formato [{"role": "user/assistant", "content": "..."}]
-            
-        Returns:
-            Respuesta de la IA como string
+        Construye la lista de mensajes que se envía a OpenAI
         """
-        if not self.client:
-            return "Lo siento, el servicio de IA no está configurado correctamente."
-        
         # Preparar el historial de conversación
         messages = [
             {
@@ -192,20 +157,64 @@ class AIService:
             }
         ]
         
-        # Agregar historial si existe (solo los últimos 5 mensajes para no exceder tokens)
+        # Lo más antiguo va resumido; del resto, los mensajes recientes que
+        # entren en el presupuesto de tokens (ver contexto.py)
+        if resumen:
+            messages.append(mensaje_resumen(resumen))
         if historial_conversacion:
-            # Tomar solo los últimos mensajes para mantener el contexto pero no exceder tokens
-            historial_limitado = historial_conversacion[-5:] if len(historial_conversacion) > 5 else historial_conversacion
-            messages.extend(historial_limitado)
+            messages.extend(ventana_historial(historial_conversacion, resumen, modelo=self.model))
         
         # Agregar el mensaje actual del usuario
         messages.append({
             "role": "user",
-            "content": mensaje_usuario
+            "content": recortar_texto(mensaje_usuario, settings.MENSAJE_MAX_TOKENS, self.model)
         })
+        return messages
+    
+    def _reportar_tokens(self, messages, response=None, modo='sync'):
+        """
+        Registra los tokens de la petición: los reportados por OpenAI si vienen
+        en la respuesta, si no la estimación local
+        """
+        usage = getattr(response, 'usage', None)
+        if usage and usage.prompt_tokens:
+            logger.info("Tokens de OpenAI", extra={
+                'modo': modo, 'tokens_prompt': usage.prompt_tokens,
+                'tokens_respuesta': usage.completion_tokens, 'tokens_total': usage.total_tokens,
+            })
+        else:
+            logger.info("Tokens de OpenAI (estimados)", extra={
+                'modo': modo, 'tokens_prompt': tokens_mensajes(messages, self.model),
+            })
+    
+    @cronometrado('openai')
+    def obtener_respuesta(self, mensaje_usuario, historial_conversacion=None, resumen=None):
+        """
+        Obtiene una respuesta de la IA basada en el mensaje del usuario
+        
+        Args:
+            mensaje_usuario: Texto del mensaje del usuario
+            historial_conversacion: Lista de mensajes previos en formato [{"role": "user/assistant", "content": "..."}]
+            resumen: Resumen de los mensajes más antiguos (contexto.Resumen), opcional
+            
+        Returns:
+            Respuesta de la IA como string
+        """
+        if not self.client:
+            return "Lo siento, el servicio de IA no está configurado correctamente."
+        
+        # Preguntas repetidas se responden desde la caché (ver cache_respuestas.py)
+        cache = obtener_cache_respuestas()
+        if cache:
+            respuesta = cache.obtener(mensaje_usuario, historial_conversacion)
+            if respuesta is not None:
+                logger.debug("Respuesta desde caché", extra={'caracteres': len(respuesta)})
+                return respuesta
+        
+        messages = self._construir_mensajes(mensaje_usuario, historial_conversacion, resumen)
         
         try:
-            print(f"[DEBUG] Enviando a OpenAI: {len(messages)} mensajes")
+            logger.debug("Enviando a OpenAI", extra={'mensajes': len(messages)})
             response = self.client.chat.completions.create(
                 model=self.model,
                 messages=messages,
@@ -214,11 +223,94 @@ class AIService:
             )
             
             respuesta = response.choices[0].message.content.strip()
-            print(f"[DEBUG] Respuesta recibida de OpenAI: {respuesta}")
+            logger.debug("Respuesta recibida de OpenAI", extra={'caracteres': len(respuesta)})
+            self._reportar_tokens(messages, response)
+            if cache:
+                cache.guardar(mensaje_usuario, historial_conversacion, respuesta)
             return respuesta
-        except Exception as e:
-            print(f"[ERROR] Error en OpenAI: {str(e)}")
-            import traceback
-            traceback.print_exc()
+        except Exception:
+            logger.exception("Error en OpenAI")
             return f"Lo siento, hubo un error al procesar tu solicitud. Por favor, intenta de nuevo."
-
+    
+    @cronometrado('openai')
+    async def obtener_respuesta_async(self, mensaje_usuario, historial_conversacion=None, resumen=None):
+        """
+        Versión asíncrona de obtener_respuesta (usa AsyncOpenAI, no bloquea el event loop)
+        
+        Args:
+            mensaje_usuario: Texto del mensaje del usuario
+            historial_conversacion: Lista de mensajes previos en formato [{"role": "user/assistant", "content": "..."}]
+            resumen: Resumen de los mensajes más antiguos (contexto.Resumen), opcional
+            
+        Returns:
+            Respuesta de la IA como string
+        """
+        if not self.async_client:
+            return "Lo siento, el servicio de IA no está configurado correctamente."
+        
+        cache = obtener_cache_respuestas()
+        if cache:
+            respuesta = cache.obtener(mensaje_usuario, historial_conversacion)
+            if respuesta is not None:
+                return respuesta
+        
+        messages = self._construir_mensajes(mensaje_usuario, historial_conversacion, resumen)
+        
+        try:
+            logger.debug("Enviando a OpenAI", extra={'mensajes': len(messages), 'modo': 'async'})
+            response = await self.async_client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                max_tokens=200,
+                temperature=0.7
+            )
+            
+            respuesta = response.choices[0].message.content.strip()
+            logger.debug("Respuesta recibida de OpenAI", extra={'caracteres': len(respuesta), 'modo': 'async'})
+            self._reportar_tokens(messages, response, 'async')
+            if cache:
+                cache.guardar(mensaje_usuario, historial_conversacion, respuesta)
+            return respuesta
+        except Exception:
+            logger.exception("Error en OpenAI (async)")
+            return "Lo siento, hubo un error al procesar tu solicitud. Por favor, intenta de nuevo."
+    
+    def obtener_respuesta_stream(self, mensaje_usuario, historial_conversacion=None, resumen=None):
+        """
+        Igual que obtener_respuesta, pero devuelve los tokens a medida que llegan
+        
+        Args:
+            mensaje_usuario: Texto del mensaje del usuario
+            historial_conversacion: Lista de mensajes previos en formato [{"role": "user/assistant", "content": "..."}]
+            resumen: Resumen de los mensajes más antiguos (contexto.Resumen), opcional
+            
+        Yields:
+            Fragmentos de texto de la respuesta de la IA
+        """
+        if not self.client:
+            yield "Lo siento, el servicio de IA no está configurado correctamente."
+            return
+        
+        messages = self._construir_mensajes(mensaje_usuario, historial_conversacion, resumen)
+        
+        try:
+            logger.debug("Enviando a OpenAI", extra={'mensajes': len(messages), 'modo': 'stream'})
+            self._reportar_tokens(messages, modo='stream')
+            stream = self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                max_tokens=200,
+                temperature=0.7,
+                stream=True
+            )
+            # Cerrar el stream corta la respuesta en OpenAI si se deja de leer (interrupción)
+            with stream:
+                for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    token = chunk.choices[0].delta.content
+                    if token:
+                        yield token
+        except Exception:
+            logger.exception("Error en OpenAI (stream)")
+            yield "Lo siento, hubo un error al procesar tu solicitud. Por favor, intenta de nuevo."
@@ -0,0 +1,328 @@
+"""
+Modo de voz en tiempo real sobre Twilio Media Streams
+
+Twilio abre un WebSocket contra RUTA_MEDIA_STREAM (enrutado en noxus/asgi.py)
+y envía eventos JSON: connected, start, media, mark y stop. El audio entrante
+(mulaw 8kHz en base64) se entrega a un transcriptor; cuando éste detecta el fin
+de una frase del usuario se pide la respuesta a OpenAI en modo stream y se
+devuelve frase por frase a medida que llegan los tokens, sin esperar a que la
+respuesta esté completa.
+
+El reconocimiento y la síntesis de voz son intercambiables y se configuran en
+settings:
+
+    MEDIA_STREAM_TRANSCRIPTOR: ruta a una clase con procesar_audio(bytes) y
+        finalizar(), ambos devuelven el texto de una frase completa o None.
+        Se crea una instancia por conexión y sus métodos corren en un hilo
+        aparte, fuera del bucle de eventos.
+    MEDIA_STREAM_SINTETIZADOR: ruta a una clase con sintetizar(texto) que
+        devuelve audio mulaw 8kHz listo para reproducir en la llamada.
+"""
+import asyncio
+import base64
+import json
+import logging
+import re
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+from .contexto import obtener_resumen_async, programar_resumen
+from .conversaciones import agregar_mensajes, cargar_conversacion, obtener_conversacion
+from .models import Llamada
+from .persistencia import guardar_mensajes
+from .services import AIService
+
+
+logger = logging.getLogger(__name__)
+
+
+RUTA_MEDIA_STREAM = '/media-stream/'
+
+# Fin de frase: puntuación final seguida de espacio (evita cortar "3.5" o "Sr.Pérez")
+FIN_DE_FRASE = re.compile(r'[.!?…]+["\')\]»]*\s+')
+
+
+class FragmentadorFrases:
+    """Acumula tokens y entrega frases completas en cuanto se cierran"""
+
+    def __init__(self):
+        self.buffer = ''
+
+    def agregar(self, token):
+        """
+        Agrega un token y devuelve la lista de frases que quedaron completas
+        """
+        self.buffer += token
+        frases = []
+        while True:
+            match = FIN_DE_FRASE.search(self.buffer)
+            if not match:
+                break
+            frase = self.buffer[:match.end()].strip()
+            self.buffer = self.buffer[match.end():]
+            if frase:
+                frases.append(frase)
+        return frases
+
+    def terminar(self):
+        """
+        Devuelve lo que quede en el buffer al terminar el stream
+        """
+        resto = self.buffer.strip()
+        self.buffer = ''
+        return resto or None
+
+
+def dividir_en_frases(tokens):
+    """
+    Convierte un iterable de tokens en un generador de frases completas
+    """
+    fragmentador = FragmentadorFrases()
+    for token in tokens:
+        yield from fragmentador.agregar(token)
+    resto = fragmentador.terminar()
+    if resto:
+        yield resto
+
+
+async def iterar_en_hilo(generador):
+    """
+    Consume un generador síncrono (p. ej. el stream de OpenAI) en un hilo
+    aparte y entrega sus elementos al event loop sin bloquearlo.
+
+    Si el consumidor deja de iterar (aclose() o cancelación), el hilo se
+    detiene en el siguiente elemento y cierra el generador, lo que cierra el
+    stream de OpenAI en lugar de seguir leyéndolo hasta el final
+    """
+    loop = asyncio.get_running_loop()
+    cola = asyncio.Queue()
+    fin = object()
+    cancelado = threading.Event()
+
+    def entregar(item):
+        try:
+            loop.call_soon_threadsafe(cola.put_nowait, item)
+        except RuntimeError:
+            # El event loop ya se cerró
+            cancelado.set()
+
+    def producir():
+        try:
+            for item in generador:
+                if cancelado.is_set():
+                    break
+                entregar(item)
+        finally:
+            cerrar = getattr(generador, 'close', None)
+            if cerrar:
+                cerrar()
+            entregar(fin)
+
+    threading.Thread(target=producir, daemon=True).start()
+    try:
+        while True:
+            item = await cola.get()
+            if item is fin:
+                return
+            yield item
+    finally:
+        cancelado.set()
+
+
+def _cargar_clase(nombre_setting):
+    ruta = getattr(settings, nombre_setting, '')
+    return import_string(ruta) if ruta else None
+
+
+def configuracion_incompleta():
+    """
+    Settings que faltan para el modo tiempo real (sin ellos las llamadas no
+    tendrían reconocimiento ni voz, solo eventos mark)
+    """
+    return [
+        nombre for nombre in ('MEDIA_STREAM_TRANSCRIPTOR', 'MEDIA_STREAM_SINTETIZADOR')
+        if not getattr(settings, nombre, '')
+    ]
+
+
+class SesionMediaStream:
+    """Estado de una conexión de Media Stream (una llamada)"""
+
+    def __init__(self, send, ai_service, transcriptor=None, sintetizador=None):
+        self.send = send
+        self.ai_service = ai_service
+        self.transcriptor = transcriptor
+        self.sintetizador = sintetizador
+        self.stream_sid = None
+        self.call_sid = None
+        self.conversacion = None
+        self.historial = []
+        self.respuesta_actual = None
+        self.marcas_enviadas = 0
+
+    async def procesar_evento(self, data):
+        evento = data.get('event')
+
+        if evento == 'start':
+            start = data.get('start', {})
+            self.stream_sid = start.get('streamSid') or data.get('streamSid')
+            parametros = start.get('customParameters') or {}
+            self.call_sid = start.get('callSid') or parametros.get('call_sid', '')
+            await self._cargar_llamada()
+            logger.info("Stream iniciado", extra={'stream_sid': self.stream_sid, 'call_sid': self.call_sid})
+
+        elif evento == 'media':
+            if not self.transcriptor:
+                return
+            audio = base64.b64decode(data.get('media', {}).get('payload', ''))
+            # El reconocimiento puede ser pesado: fuera del bucle de eventos
+            texto = await sync_to_async(self.transcriptor.procesar_audio, thread_sensitive=False)(audio)
+            if texto:
+                await self.nuevo_turno(texto)
+
+        elif evento == 'stop':
+            texto = None
+            if self.transcriptor:
+                texto = await sync_to_async(self.transcriptor.finalizar, thread_sensitive=False)()
+            if texto:
+                await self.nuevo_turno(texto)
+            logger.info("Stream detenido", extra={'stream_sid': self.stream_sid, 'call_sid': self.call_sid})
+
+    async def nuevo_turno(self, texto):
+        """
+        Arranca la respuesta a una frase del usuario. Si la IA todavía estaba
+        hablando (el usuario la interrumpió) se corta y se vacía el audio pendiente
+        """
+        if self.respuesta_actual and not self.respuesta_actual.done():
+            self.respuesta_actual.cancel()
+            await self._enviar({'event': 'clear', 'streamSid': self.stream_sid})
+        self.respuesta_actual = asyncio.ensure_future(self._responder(texto))
+
+    async def esperar_respuesta(self):
+        if self.respuesta_actual:
+            try:
+                await self.respuesta_actual
+            except asyncio.CancelledError:
+                pass
+
+    async def cerrar(self):
+        if self.respuesta_actual and not self.respuesta_actual.done():
+            self.respuesta_actual.cancel()
+        await self.esperar_respuesta()
+
+    async def _responder(self, texto):
+        historial = list(self.historial)
+        resumen = await obtener_resumen_async(self.call_sid)
+        self.historial.append({"role": "user", "content": texto})
+        await self._guardar_mensaje('usuario', texto)
+
+        fragmentador = FragmentadorFrases()
+        frases = []
+        tokens = iterar_en_hilo(self.ai_service.obtener_respuesta_stream(texto, historial, resumen))
+        try:
+            async for token in tokens:
+                for frase in fragmentador.agregar(token):
+                    frases.append(frase)
+                    await self._enviar_frase(frase)
+            resto = fragmentador.terminar()
+            if resto:
+                frases.append(resto)
+                await self._enviar_frase(resto)
+        finally:
+            # Si se interrumpió la respuesta, dejar de consumir el stream de OpenAI
+            await tokens.aclose()
+            # Se guarda lo que alcanzó a decirse, aunque haya habido interrupción
+            if frases:
+                respuesta = ' '.join(frases)
+                self.historial.append({"role": "assistant", "content": respuesta})
+                await self._guardar_mensaje('ia', respuesta)
+            programar_resumen(self.call_sid, self.historial, resumen)
+
+    async def _enviar_frase(self, frase):
+        if self.sintetizador:
+            audio = await sync_to_async(self.sintetizador.sintetizar, thread_sensitive=False)(frase)
+            if audio:
+                await self._enviar({
+                    'event': 'media',
+                    'streamSid': self.stream_sid,
+                    'media': {'payload': base64.b64encode(audio).decode('ascii')},
+                })
+        # La marca vuelve desde Twilio cuando termina de reproducirse el audio
+        self.marcas_enviadas += 1
+        await self._enviar({
+            'event': 'mark',
+            'streamSid': self.stream_sid,
+            'mark': {'name': f'frase-{self.marcas_enviadas}'},
+        })
+
+    async def _enviar(self, data):
+        await self.send({'type': 'websocket.send', 'text': json.dumps(data)})
+
+    @sync_to_async
+    def _cargar_llamada(self):
+        if not self.call_sid:
+            return
+        self.conversacion = obtener_conversacion(self.call_sid)
+        if self.conversacion is None:
+            llamada = Llamada.objects.filter(sid=self.call_sid).first()
+            if llamada:
+                self.conversacion = cargar_conversacion(llamada)
+        if self.conversacion:
+            self.historial = list(self.conversacion['mensajes'])
+
+    @sync_to_async
+    def _guardar_mensaje(self, tipo, contenido):
+        if self.conversacion:
+            guardar_mensajes(self.conversacion['llamada_id'], [(tipo, contenido)])
+            agregar_mensajes(self.conversacion, [
+                {"role": "user" if tipo == "usuario" else "assistant", "content": contenido}
+            ])
+
+
+class MediaStreamHandler:
+    """Aplicación ASGI para el WebSocket de Twilio Media Streams"""
+
+    def __init__(self, ai_service=None, transcriptor_class=None, sintetizador=None):
+        faltan = configuracion_incompleta()
+        if settings.VOZ_TIEMPO_REAL and faltan and not (transcriptor_class and sintetizador):
+            raise ImproperlyConfigured(f"VOZ_TIEMPO_REAL=True requiere {' y '.join(faltan)}")
+        self.ai_service = ai_service
+        self.transcriptor_class = transcriptor_class or _cargar_clase('MEDIA_STREAM_TRANSCRIPTOR')
+        sintetizador_class = _cargar_clase('MEDIA_STREAM_SINTETIZADOR')
+        self.sintetizador = sintetizador or (sintetizador_class() if sintetizador_class else None)
+
+    async def __call__(self, scope, receive, send):
+        sesion = SesionMediaStream(
+            send,
+            self.ai_service or AIService(),
+            transcriptor=self.transcriptor_class() if self.transcriptor_class else None,
+            sintetizador=self.sintetizador,
+        )
+
+        while True:
+            mensaje = await receive()
+            tipo = mensaje['type']
+
+            if tipo == 'websocket.connect':
+                await send({'type': 'websocket.accept'})
+
+            elif tipo == 'websocket.receive':
+                contenido = mensaje.get('text') or mensaje.get('bytes') or b''
+                try:
+                    data = json.loads(contenido)
+                except ValueError:
+                    logger.warning("Frame que no es JSON, ignorado")
+                    continue
+                await sesion.procesar_evento(data)
+                if data.get('event') == 'stop':
+                    await sesion.esperar_respuesta()
+                    await send({'type': 'websocket.close', 'code': 1000})
+                    return
+
+            elif tipo == 'websocket.disconnect':
+                await sesion.cerrar()
+                return
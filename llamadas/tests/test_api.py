@@ -0,0 +1,29 @@
+from django.test import TestCase, override_settings
+
+from llamadas.models import Llamada
+
+
+RUTAS = ['/api/llamadas/', '/api/llamadas/{id}/', '/api/llamadas/{id}/mensajes/', '/api/exportar/', '/metrics']
+
+
+class AutenticacionApiTests(TestCase):
+    """La API JSON y /metrics nunca quedan abiertas"""
+
+    def setUp(self):
+        llamada = Llamada.objects.create(sid='CA_API', numero_destino='+1')
+        self.rutas = [ruta.format(id=llamada.pk) for ruta in RUTAS]
+
+    @override_settings(API_TOKEN='')
+    def test_sin_token_configurado_no_responde(self):
+        for ruta in self.rutas:
+            with self.subTest(ruta=ruta):
+                self.assertEqual(self.client.get(ruta).status_code, 404)
+                self.assertEqual(self.client.get(ruta, HTTP_AUTHORIZATION='Bearer ').status_code, 404)
+
+    @override_settings(API_TOKEN='secreto')
+    def test_exige_el_token(self):
+        for ruta in self.rutas:
+            with self.subTest(ruta=ruta):
+                self.assertEqual(self.client.get(ruta).status_code, 401)
+                self.assertEqual(self.client.get(ruta, HTTP_AUTHORIZATION='Bearer otro').status_code, 401)
+                self.assertEqual(self.client.get(ruta, HTTP_AUTHORIZATION='Bearer secreto').status_code, 200)
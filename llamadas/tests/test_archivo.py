@@ -0,0 +1,58 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+from llamadas import archivo
+from llamadas.archivo import archivar_llamadas, llamadas_para_archivar, mensajes_llamada, transcripcion_llamada
+from llamadas.models import Llamada, MensajeConversacion
+
+
+class ArchivoTests(TestCase):
+
+    def llamada(self, sid, transcripcion=''):
+        llamada = Llamada.objects.create(
+            sid=sid, numero_destino='+1', numero_origen='+2', estado='completada', transcripcion=transcripcion,
+        )
+        Llamada.objects.filter(pk=llamada.pk).update(fecha_creacion=timezone.now() - timedelta(days=100))
+        return llamada
+
+    def test_archiva_los_mensajes_y_vacia_la_transcripcion(self):
+        llamada = self.llamada('CA_ARCH1', transcripcion='Usuario: Hola\nIA: Buenas')
+        MensajeConversacion.objects.create(llamada=llamada, tipo='usuario', contenido='Hola')
+        MensajeConversacion.objects.create(llamada=llamada, tipo='ia', contenido='Buenas')
+
+        self.assertEqual(archivar_llamadas([llamada.pk])[0], 2)
+
+        llamada.refresh_from_db()
+        self.assertEqual(llamada.transcripcion, '')
+        self.assertEqual([m.contenido for m in mensajes_llamada(llamada)], ['Hola', 'Buenas'])
+        self.assertIn('Buenas', transcripcion_llamada(llamada))
+
+    def test_llamada_sin_mensajes_conserva_la_transcripcion_y_no_se_vuelve_a_elegir(self):
+        llamada = self.llamada('CA_ARCH2', transcripcion='Usuario: Hola')
+        self.assertIn(llamada, llamadas_para_archivar(90))
+
+        archivar_llamadas([llamada.pk])
+
+        llamada.refresh_from_db()
+        self.assertEqual(llamada.transcripcion, 'Usuario: Hola')
+        self.assertEqual(transcripcion_llamada(llamada), 'Usuario: Hola')
+        self.assertEqual(llamada.archivo.mensajes, 0)
+        self.assertNotIn(llamada, llamadas_para_archivar(90))
+
+    def test_no_borra_los_mensajes_guardados_despues_de_leer(self):
+        llamada = self.llamada('CA_ARCH3')
+        MensajeConversacion.objects.create(llamada=llamada, tipo='usuario', contenido='Hola')
+        comprimir = archivo.comprimir
+
+        def comprimir_y_llega_un_turno(mensajes, formato):
+            # Un turno que se guarda entre la lectura y el borrado
+            MensajeConversacion.objects.create(llamada=llamada, tipo='ia', contenido='Buenas')
+            return comprimir(mensajes, formato)
+
+        with mock.patch.object(archivo, 'comprimir', comprimir_y_llega_un_turno):
+            self.assertEqual(archivar_llamadas([llamada.pk])[0], 1)
+
+        self.assertEqual([m.contenido for m in mensajes_llamada(llamada)], ['Hola', 'Buenas'])
@@ -0,0 +1,71 @@
+import tempfile
+from pathlib import Path
+
+from django.test import SimpleTestCase, override_settings
+
+from llamadas import audio, twiml
+from llamadas.services import TwilioService
+
+
+class AudioPreRenderizadoTests(SimpleTestCase):
+    """Frases fijas sintetizadas con el backend de prueba y servidas por audio_frase"""
+
+    def setUp(self):
+        self.directorio = tempfile.TemporaryDirectory()
+        self.ajustes = override_settings(
+            AUDIO_TTS_BACKEND='llamadas.audio.TTSArchivoLocal', AUDIO_CACHE_DIR=Path(self.directorio.name),
+            AUDIO_CACHE_URL='', BASE_URL='https://prueba.example', TWILIO_VOZ='Polly.Lupe', TWILIO_IDIOMA='es-ES',
+        )
+        self.ajustes.enable()
+        audio._cache = None
+        self.cache = audio.obtener_cache_audio()
+        self.cache.generar_frases_fijas('Polly.Lupe', 'es-ES')
+
+    def tearDown(self):
+        audio._cache = None
+        self.ajustes.disable()
+        self.directorio.cleanup()
+
+    def test_twiml_usa_play_con_la_url_publica(self):
+        nombre = self.cache.nombre_archivo(twiml.DESPEDIDA, 'Polly.Lupe', 'es-ES')
+
+        documento = TwilioService().generar_twiml_final('Adiós')
+
+        self.assertIn(f'<Play>https://prueba.example/audio/{nombre}</Play>', documento)
+        self.assertNotIn('Gracias por llamar', documento)
+
+    def test_la_url_sigue_a_la_url_publica(self):
+        with override_settings(BASE_URL='https://otra.example'):
+            urls = dict(audio.audios_frases_fijas('Polly.Lupe', 'es-ES'))
+        self.assertTrue(urls[twiml.SALUDO_INICIAL].startswith('https://otra.example/audio/'))
+
+    def test_audio_cache_url_explicita(self):
+        self.cache.url_base = 'https://cdn.example/audio/'
+        nombre = self.cache.nombre_archivo(twiml.ALGO_MAS, 'Polly.Lupe', 'es-ES')
+        self.cache._urls = {}
+        urls = dict(audio.audios_frases_fijas('Polly.Lupe', 'es-ES'))
+        self.assertEqual(urls[twiml.ALGO_MAS], f'https://cdn.example/audio/{nombre}')
+
+    def test_urls_por_voz_e_idioma(self):
+        self.cache.generar_frases_fijas('Polly.Conchita', 'es-ES')
+        lupe = dict(audio.audios_frases_fijas('Polly.Lupe', 'es-ES'))
+        conchita = dict(audio.audios_frases_fijas('Polly.Conchita', 'es-ES'))
+
+        nombre = self.cache.nombre_archivo(twiml.DESPEDIDA, 'Polly.Conchita', 'es-ES')
+        self.assertEqual(conchita[twiml.DESPEDIDA], f'https://prueba.example/audio/{nombre}')
+        self.assertNotEqual(lupe[twiml.DESPEDIDA], conchita[twiml.DESPEDIDA])
+        self.assertEqual(audio.audios_frases_fijas('Polly.Mia', 'es-MX'), ())
+
+    @override_settings(DEBUG=False)
+    def test_la_vista_sirve_el_archivo_sin_debug(self):
+        nombre = self.cache.nombre_archivo(twiml.SALUDO_INICIAL, 'Polly.Lupe', 'es-ES')
+
+        respuesta = self.client.get(f'/audio/{nombre}')
+
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(b''.join(respuesta.streaming_content)[:4], b'RIFF')
+        self.assertIn('immutable', respuesta['Cache-Control'])
+
+    def test_la_vista_solo_sirve_nombres_generados(self):
+        self.assertEqual(self.client.get('/audio/..%2Fsettings.py').status_code, 404)
+        self.assertEqual(self.client.get(f"/audio/{'0' * 24}.wav").status_code, 404)
@@ -0,0 +1,35 @@
+from django.test import SimpleTestCase
+
+from llamadas.cache_respuestas import CacheRespuestas, palabras_criticas
+
+
+class CacheRespuestasTests(SimpleTestCase):
+
+    def setUp(self):
+        self.cache = CacheRespuestas(max_entradas=100, ttl=60, similitud=0.92)
+
+    def test_coincidencia_exacta_normalizada(self):
+        self.cache.guardar('¿A qué hora abren?', [], 'A las nueve.')
+        self.assertEqual(self.cache.obtener('a que hora abren', []), 'A las nueve.')
+
+    def test_coincidencia_aproximada(self):
+        self.cache.guardar('cuál es el horario de atención al cliente', [], 'De nueve a seis.')
+        self.assertEqual(self.cache.obtener('cual es el horario de atencion al cliente por favor', []), None)
+        self.assertEqual(self.cache.obtener('cuál es el horario de atención al clientes', []), 'De nueve a seis.')
+
+    def test_no_reutiliza_con_otra_negacion(self):
+        self.cache.guardar('quiero cancelar mi suscripción ahora mismo', [], 'Listo, cancelada.')
+        self.assertIsNone(self.cache.obtener('no quiero cancelar mi suscripción ahora mismo', []))
+
+    def test_no_reutiliza_con_otro_dia_o_numero(self):
+        self.cache.guardar('tienen turnos disponibles para el lunes por la tarde', [], 'Sí, a las cinco.')
+        self.cache.guardar('quiero reservar una mesa para 4 personas hoy', [], 'Reservada.')
+        self.assertIsNone(self.cache.obtener('tienen turnos disponibles para el martes por la tarde', []))
+        self.assertIsNone(self.cache.obtener('quiero reservar una mesa para 5 personas hoy', []))
+
+    def test_otro_contexto_no_coincide(self):
+        self.cache.guardar('y cuánto cuesta', [{'role': 'user', 'content': 'el plan básico'}], 'Diez euros.')
+        self.assertIsNone(self.cache.obtener('y cuánto cuesta', [{'role': 'user', 'content': 'el plan premium'}]))
+
+    def test_palabras_criticas(self):
+        self.assertEqual(palabras_criticas('no abren el sabado 12 de marzo'), {'no', 'sabado', '12', 'marzo'})
@@ -0,0 +1,147 @@
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from llamadas.campanas import (
+    MAX_DURACION_LLAMADA, PREFIJO_SID_PROVISIONAL, ProgramadorCampanas, agregar_numeros, registrar_resultado,
+)
+from llamadas.clientes import cerrar_clientes
+from llamadas.management.stub_twilio import StubTwilio
+from llamadas.models import Campana, EstadisticaLlamadas, Llamada, NumeroCampana
+
+
+WEBHOOK = 'https://prueba.example/webhook/'
+
+
+class CampanasTests(TestCase):
+    """El programador contra el stub de la API REST de Twilio"""
+
+    def setUp(self):
+        self.stub = StubTwilio().__enter__()
+        self.ajustes = override_settings(
+            TWILIO_ACCOUNT_SID='ACprueba', TWILIO_AUTH_TOKEN='token', TWILIO_PHONE_NUMBER='+34900000000',
+            TWILIO_API_URL=self.stub.url,
+        )
+        self.ajustes.enable()
+        self.campana = Campana.objects.create(
+            nombre='Prueba', llamadas_por_segundo=0, max_llamadas_activas=10, max_intentos=3,
+        )
+
+    def tearDown(self):
+        self.ajustes.disable()
+        cerrar_clientes()
+        self.stub.__exit__(None, None, None)
+
+    def programador(self):
+        return ProgramadorCampanas(self.campana, webhook_url=WEBHOOK)
+
+    def test_marca_los_pendientes_con_el_sid_de_twilio(self):
+        agregar_numeros(self.campana, ['+34600000001', '+34600000002'])
+
+        self.assertEqual(self.programador().ciclo(), 2)
+
+        self.assertEqual([llamada['to'] for llamada in self.stub.llamadas], ['+34600000001', '+34600000002'])
+        self.assertEqual(self.stub.llamadas[0]['status_callback'], 'https://prueba.example/webhook-status/')
+        for numero in NumeroCampana.objects.all():
+            self.assertEqual(numero.estado, 'marcando')
+            self.assertIn(numero.llamada.sid, [llamada['sid'] for llamada in self.stub.llamadas])
+        self.campana.refresh_from_db()
+        self.assertEqual((self.campana.pendientes, self.campana.en_curso), (0, 2))
+
+    def marcar_con_webhook_adelantado(self, con_token=True):
+        """
+        Ciclo en el que el primer webhook de Twilio llega antes de que el
+        programador guarde el CallSid
+        """
+        cache.clear()
+        programador = self.programador()
+        hacer_llamada = programador.twilio_service.hacer_llamada
+
+        def llamar_y_contestar(*args, **kwargs):
+            call = hacer_llamada(*args, **kwargs)
+            pedida = self.stub.llamadas[-1]
+            url = pedida['url'] if con_token else WEBHOOK
+            self.client.post(url.replace('https://prueba.example', ''), {
+                'CallSid': call.sid, 'CallStatus': 'in-progress', 'To': pedida['to'], 'From': '+34900000000',
+            })
+            return call
+
+        programador.twilio_service.hacer_llamada = llamar_y_contestar
+        return programador.ciclo()
+
+    def test_webhook_antes_que_el_sid_usa_la_llamada_provisional(self):
+        agregar_numeros(self.campana, ['+34600000001'])
+
+        self.assertEqual(self.marcar_con_webhook_adelantado(), 1)
+
+        llamada = Llamada.objects.get()
+        self.assertEqual(llamada.sid, self.stub.llamadas[0]['sid'])
+        self.assertEqual(NumeroCampana.objects.get().llamada, llamada)
+
+    def test_webhook_sin_token_antes_que_el_sid_une_las_llamadas(self):
+        agregar_numeros(self.campana, ['+34600000001'])
+
+        self.assertEqual(self.marcar_con_webhook_adelantado(con_token=False), 1)
+
+        llamada = Llamada.objects.get()
+        self.assertEqual(llamada.sid, self.stub.llamadas[0]['sid'])
+        self.assertEqual(NumeroCampana.objects.get().llamada, llamada)
+        iniciadas = EstadisticaLlamadas.objects.filter(estado='iniciada').values_list('llamadas', flat=True)
+        self.assertEqual(sum(iniciadas), 1)
+
+    def test_error_de_twilio_cierra_el_numero_sin_reintentar(self):
+        self.stub.fallar_cada = 1
+        agregar_numeros(self.campana, ['+34600000001'])
+
+        self.assertEqual(self.programador().ciclo(), 0)
+
+        numero = NumeroCampana.objects.get()
+        self.assertEqual((numero.estado, numero.ultimo_resultado), ('fallido', 'failed'))
+        self.assertEqual(numero.llamada.estado, 'fallida')
+        self.assertTrue(numero.llamada.sid.startswith(PREFIJO_SID_PROVISIONAL))
+
+    def test_ocupado_se_reprograma(self):
+        agregar_numeros(self.campana, ['+34600000001'])
+        self.programador().ciclo()
+        numero = NumeroCampana.objects.get()
+
+        registrar_resultado(numero.llamada, 'busy')
+
+        numero.refresh_from_db()
+        self.assertEqual(numero.estado, 'pendiente')
+        self.assertGreater(numero.proximo_intento, timezone.now())
+
+    def test_recuperar_devuelve_a_la_cola_las_llamadas_provisionales(self):
+        agregar_numeros(self.campana, ['+34600000001'])
+        llamada = Llamada.objects.create(sid=f'{PREFIJO_SID_PROVISIONAL}x', numero_destino='+34600000001')
+        NumeroCampana.objects.update(
+            estado='marcando', llamada=llamada, intentos=1, proximo_intento=timezone.now() - timedelta(minutes=10),
+        )
+
+        self.programador().recuperar()
+
+        numero = NumeroCampana.objects.get()
+        self.assertEqual((numero.estado, numero.llamada), ('pendiente', None))
+        llamada.refresh_from_db()
+        self.assertEqual(llamada.estado, 'fallida')
+        self.campana.refresh_from_db()
+        self.assertEqual((self.campana.pendientes, self.campana.en_curso), (1, 0))
+
+    def test_vence_los_numeros_sin_callback(self):
+        agregar_numeros(self.campana, ['+34600000001', '+34600000002'])
+        programador = self.programador()
+        programador.ciclo()
+        NumeroCampana.objects.filter(numero='+34600000001').update(
+            proximo_intento=timezone.now() - MAX_DURACION_LLAMADA - timedelta(minutes=1),
+        )
+
+        self.assertEqual(programador.vencer_sin_resultado(), 1)
+
+        vencido = NumeroCampana.objects.get(numero='+34600000001')
+        self.assertEqual((vencido.estado, vencido.ultimo_resultado), ('fallido', 'sin-callback'))
+        self.assertEqual(vencido.llamada.estado, 'fallida')
+        self.assertEqual(NumeroCampana.objects.get(numero='+34600000002').estado, 'marcando')
+        self.campana.refresh_from_db()
+        self.assertEqual((self.campana.en_curso, self.campana.fallidas), (1, 1))
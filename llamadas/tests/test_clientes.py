@@ -0,0 +1,92 @@
+import asyncio
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.test import SimpleTestCase, override_settings
+
+from llamadas import clientes
+from llamadas.management.stub_twilio import StubTwilio
+
+
+@override_settings(OPENAI_API_KEY='x', OPENAI_BASE_URL='http://127.0.0.1:9')
+class CerrarClientesTests(SimpleTestCase):
+
+    def tearDown(self):
+        clientes.cerrar_clientes()
+
+    def test_cierra_el_cliente_async_en_su_loop(self):
+        loop = asyncio.new_event_loop()
+        try:
+            async def obtener():
+                return clientes.obtener_cliente_openai_async()
+
+            cliente = loop.run_until_complete(obtener())
+            clientes.cerrar_clientes()
+            self.assertTrue(cliente.is_closed())
+        finally:
+            loop.close()
+
+    def test_loop_cerrado_no_falla(self):
+        loop = asyncio.new_event_loop()
+
+        async def obtener():
+            return clientes.obtener_cliente_openai_async()
+
+        loop.run_until_complete(obtener())
+        loop.close()
+        clientes.cerrar_clientes()
+        self.assertEqual(len(clientes._clientes_async), 0)
+
+    async def test_cerrar_clientes_async(self):
+        cliente = clientes.obtener_cliente_openai_async()
+        await clientes.cerrar_clientes_async()
+        self.assertTrue(cliente.is_closed())
+        self.assertIsNot(clientes.obtener_cliente_openai_async(), cliente)
+
+
+class ClienteTwilioTests(SimpleTestCase):
+    """Un cliente de Twilio por hilo, con un solo pool de conexiones"""
+
+    def setUp(self):
+        self.stub = StubTwilio(latencia=0.02).__enter__()
+        self.ajustes = override_settings(
+            TWILIO_ACCOUNT_SID='ACprueba', TWILIO_AUTH_TOKEN='token', TWILIO_API_URL=self.stub.url,
+        )
+        self.ajustes.enable()
+
+    def tearDown(self):
+        self.ajustes.disable()
+        clientes.cerrar_clientes()
+        self.stub.__exit__(None, None, None)
+
+    def test_llamadas_concurrentes_reciben_su_respuesta(self):
+        def llamar(i):
+            cliente = clientes.obtener_cliente_twilio()
+            numero = f"+3460000{i:04d}"
+            call = cliente.calls.create(to=numero, from_='+34900000000', url='https://prueba.example/webhook/')
+            return numero, call.to, call.sid, (threading.get_ident(), cliente.http_client)
+
+        # Cambios de hilo muy frecuentes: con un cliente compartido es más
+        # probable que un hilo reciba la respuesta de otro
+        intervalo = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                resultados = list(pool.map(llamar, range(40)))
+        finally:
+            sys.setswitchinterval(intervalo)
+
+        for numero, destino, sid, _ in resultados:
+            self.assertEqual(destino, numero)
+        self.assertEqual(len({sid for _, _, sid, _ in resultados}), 40)
+        # Ningún TwilioHttpClient (que guarda la última respuesta) se comparte entre hilos
+        hilos = {hilo: http_client for *_, (hilo, http_client) in resultados}
+        self.assertEqual(len({id(http_client) for http_client in hilos.values()}), len(hilos))
+        self.assertEqual(len({id(http_client.session) for http_client in hilos.values()}), 1)
+
+    def test_cerrar_clientes_renueva_el_del_hilo(self):
+        cliente = clientes.obtener_cliente_twilio()
+        self.assertIs(clientes.obtener_cliente_twilio(), cliente)
+        clientes.cerrar_clientes()
+        self.assertIsNot(clientes.obtener_cliente_twilio(), cliente)
@@ -0,0 +1,43 @@
+from django.test import SimpleTestCase, override_settings
+
+from llamadas.contexto import MAX_SIN_RESUMIR_LOTES, Resumen, tokens_mensaje, ventana_historial
+
+
+def historial(cantidad):
+    return [
+        {'role': 'user' if i % 2 == 0 else 'assistant', 'content': f'mensaje {i} ' + 'x' * 36}
+        for i in range(cantidad)
+    ]
+
+
+def presupuesto(mensajes):
+    # Justo lo que ocupan los 4 últimos mensajes
+    return sum(tokens_mensaje(m) for m in mensajes[-4:])
+
+
+@override_settings(RESUMEN_LOTE=4)
+class VentanaHistorialTests(SimpleTestCase):
+
+    @override_settings(RESUMEN_ACTIVO=False)
+    def test_sin_resumen_solo_la_ventana(self):
+        mensajes = historial(10)
+        self.assertEqual(ventana_historial(mensajes, presupuesto=presupuesto(mensajes)), mensajes[-4:])
+
+    @override_settings(RESUMEN_ACTIVO=True)
+    def test_conserva_lo_que_falta_resumir(self):
+        mensajes = historial(10)
+        # El resumen cubre los 3 primeros: del 3 al 5 quedan fuera de la ventana sin resumir
+        ventana = ventana_historial(mensajes, Resumen('...', 3), presupuesto=presupuesto(mensajes))
+        self.assertEqual(ventana, mensajes[3:])
+
+    @override_settings(RESUMEN_ACTIVO=True)
+    def test_sin_resumen_todavia_va_todo(self):
+        mensajes = historial(7)
+        self.assertEqual(ventana_historial(mensajes, presupuesto=presupuesto(mensajes)), mensajes)
+
+    @override_settings(RESUMEN_ACTIVO=True)
+    def test_lo_pendiente_tiene_limite(self):
+        mensajes = historial(40)
+        ventana = ventana_historial(mensajes, Resumen('...', 2), presupuesto=presupuesto(mensajes))
+        self.assertEqual(len(ventana), 4 + 4 * MAX_SIN_RESUMIR_LOTES)
+        self.assertEqual(ventana[-1], mensajes[-1])
@@ -0,0 +1,29 @@
+from django.core.cache import cache
+from django.test import TestCase
+from django.utils import timezone
+
+from llamadas.conversaciones import cargar_conversacion
+from llamadas.models import Llamada, MensajeConversacion
+
+
+class CargarConversacionTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_mensajes_con_el_mismo_timestamp_en_orden_de_insercion(self):
+        llamada = Llamada.objects.create(sid='CA_ORDEN', numero_destino='+1')
+        MensajeConversacion.objects.bulk_create([
+            MensajeConversacion(llamada=llamada, tipo=tipo, contenido=contenido)
+            for tipo, contenido in [('usuario', 'Hola'), ('ia', 'Buenas'), ('usuario', 'Adiós'), ('ia', 'Chao')]
+        ])
+        # Un turno se inserta en un solo bulk_create: el timestamp puede coincidir
+        MensajeConversacion.objects.update(timestamp=timezone.now())
+
+        conversacion = cargar_conversacion(llamada)
+
+        self.assertEqual([m['content'] for m in conversacion['mensajes']], ['Hola', 'Buenas', 'Adiós', 'Chao'])
+        self.assertEqual(conversacion['turno'], 2)
+        self.assertEqual(
+            list(MensajeConversacion.objects.values_list('contenido', flat=True)), ['Hola', 'Buenas', 'Adiós', 'Chao'],
+        )
@@ -0,0 +1,117 @@
+import re
+import threading
+import time
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+
+from llamadas import diferidas
+from llamadas.management.stub_openai import StubOpenAI
+from llamadas.models import Llamada, MensajeConversacion, TiempoTurno
+from llamadas.views import DEMORA_TURNO
+
+
+class EntregaTests(SimpleTestCase):
+    """reclamar_entrega() y abandonar() deciden quién gana con la misma clave"""
+
+    def turno(self, liberar, reclamar_antes=False):
+        resultado = {}
+
+        def funcion():
+            if reclamar_antes:
+                resultado['entregada'] = diferidas.reclamar_entrega()
+            liberar.wait(5)
+            if not reclamar_antes:
+                resultado['entregada'] = diferidas.reclamar_entrega()
+            return 'respuesta'
+
+        return diferidas.iniciar(funcion), resultado
+
+    def test_abandonar_antes_descarta_la_respuesta(self):
+        liberar = threading.Event()
+        clave, resultado = self.turno(liberar)
+
+        self.assertEqual(diferidas.abandonar(clave), (False, None))
+        liberar.set()
+
+        self.assertEqual(diferidas.esperar(clave, 5), (True, 'respuesta'))
+        self.assertFalse(resultado['entregada'])
+
+    def test_abandonar_despues_espera_la_respuesta(self):
+        liberar = threading.Event()
+        clave, resultado = self.turno(liberar, reclamar_antes=True)
+        while 'entregada' not in resultado:
+            time.sleep(0.01)
+        threading.Timer(0.1, liberar.set).start()
+
+        self.assertEqual(diferidas.abandonar(clave), (True, 'respuesta'))
+        self.assertTrue(resultado['entregada'])
+
+    def test_fuera_de_un_turno_diferido_siempre_entrega(self):
+        self.assertTrue(diferidas.reclamar_entrega())
+
+
+@override_settings(
+    BASE_URL='https://prueba.example', RELLENO_ACTIVO=True, RELLENO_ESPERA=0.05, RELLENO_MAX_ESPERAS=1,
+    CACHE_RESPUESTAS_ACTIVA=False, IDEMPOTENCIA_ACTIVA=False, MENSAJES_DIFERIDOS=False,
+)
+class RespuestaTardiaTests(TransactionTestCase):
+    """Una respuesta que llega después de la última espera no queda en el historial"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_respuesta_tardia_no_se_guarda(self):
+        llamada = Llamada.objects.create(sid='CA_TARDE', numero_destino='+1', numero_origen='+2')
+        with StubOpenAI(latencia=0.5) as stub, override_settings(OPENAI_API_KEY='x', OPENAI_BASE_URL=stub.url):
+            espera = self.client.post('/webhook/', {'CallSid': 'CA_TARDE', 'CallStatus': 'in-progress',
+                                                    'SpeechResult': 'Hola'})
+            self.assertIn(b'Un momento', espera.content)
+            redirect = re.search(rb'<Redirect method="POST">([^<]+)</Redirect>', espera.content).group(1)
+            ruta = redirect.decode().replace('&amp;', '&').replace('https://prueba.example', '')
+
+            final = self.client.post(ruta, {'CallSid': 'CA_TARDE'})
+            self.assertIn(DEMORA_TURNO.split('.')[0].encode(), final.content)
+
+            # El turno termina en segundo plano después de que el webhook se rindió
+            clave = re.search(r'clave=(\w+)', ruta).group(1)
+            self.assertEqual(diferidas.esperar(clave, 5)[0], True)
+
+        self.assertFalse(MensajeConversacion.objects.filter(llamada=llamada).exists())
+
+    @override_settings(RELLENO_MAX_ESPERAS=20, METRICAS_TURNO_LENTO=0.3, METRICAS_MUESTREO_TURNOS=0.0)
+    def test_turno_lento_con_relleno_se_guarda_al_terminar(self):
+        llamada = Llamada.objects.create(sid='CA_LENTO', numero_destino='+1', numero_origen='+2')
+        with StubOpenAI(latencia=0.5) as stub, override_settings(OPENAI_API_KEY='x', OPENAI_BASE_URL=stub.url):
+            espera = self.client.post('/webhook/', {'CallSid': 'CA_LENTO', 'CallStatus': 'in-progress',
+                                                    'SpeechResult': 'Hola'})
+            self.assertIn(b'Un momento', espera.content)
+            clave = re.search(rb'clave=(\w+)', espera.content).group(1).decode()
+            self.assertEqual(diferidas.esperar(clave, 5)[0], True)
+
+        tiempo = TiempoTurno.objects.get(llamada=llamada)
+        self.assertGreaterEqual(tiempo.total, 0.5)
+        self.assertIn('openai', tiempo.etapas)
+
+    def test_reintento_despues_de_un_turno_descartado_no_se_procesa_dos_veces(self):
+        llamada = Llamada.objects.create(sid='CA_DESCARTE', numero_destino='+1', numero_origen='+2')
+        with StubOpenAI(latencia=0.5) as stub, override_settings(OPENAI_API_KEY='x', OPENAI_BASE_URL=stub.url):
+            espera = self.client.post('/webhook/', {'CallSid': 'CA_DESCARTE', 'CallStatus': 'in-progress',
+                                                    'SpeechResult': 'Hola'})
+            redirect = re.search(rb'<Redirect method="POST">([^<]+)</Redirect>', espera.content).group(1)
+            ruta = redirect.decode().replace('&amp;', '&').replace('https://prueba.example', '')
+            demora = self.client.post(ruta, {'CallSid': 'CA_DESCARTE'})
+            diferidas.esperar(re.search(r'clave=(\w+)', ruta).group(1), 5)
+        self.assertFalse(MensajeConversacion.objects.filter(llamada=llamada).exists())
+
+        # El siguiente turno usa el Gather de la demora; Twilio lo reintenta
+        gather = re.search(rb'<Gather action="([^"]+)"', demora.content).group(1)
+        ruta = gather.decode().replace('&amp;', '&').replace('https://prueba.example', '')
+        datos = {'CallSid': 'CA_DESCARTE', 'CallStatus': 'in-progress', 'SpeechResult': 'Otra vez'}
+        with StubOpenAI() as stub, override_settings(
+            OPENAI_API_KEY='x', OPENAI_BASE_URL=stub.url, RELLENO_ACTIVO=False,
+        ):
+            self.client.post(ruta, datos)
+            self.client.post(ruta, datos)
+
+        self.assertEqual(MensajeConversacion.objects.filter(llamada=llamada).count(), 2)
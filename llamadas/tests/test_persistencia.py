@@ -0,0 +1,62 @@
+import time
+
+from django.test import TransactionTestCase, override_settings
+
+from llamadas import persistencia
+from llamadas.models import Llamada, MensajeConversacion
+from llamadas.persistencia import EscritorMensajes
+
+
+@override_settings(MENSAJES_ESPERA_COLA=0.01)
+class EscritorMensajesTests(TransactionTestCase):
+    """El escritor diferido no pierde ni desordena los turnos de una llamada"""
+
+    def setUp(self):
+        self.espera_base = persistencia.REINTENTO_ESPERA_BASE
+        persistencia.REINTENTO_ESPERA_BASE = 0.05
+
+    def tearDown(self):
+        persistencia.REINTENTO_ESPERA_BASE = self.espera_base
+
+    def esperar(self, condicion, limite=5):
+        fin = time.monotonic() + limite
+        while not condicion():
+            self.assertLess(time.monotonic(), fin, 'el escritor no llegó al estado esperado')
+            time.sleep(0.01)
+
+    def test_turno_fallido_se_reintenta_y_los_siguientes_esperan_detras(self):
+        escritor = EscritorMensajes(max_reintentos=1000)
+        # La llamada todavía no existe: la FK hace fallar la escritura hasta que se cree
+        escritor.encolar(4242, [('usuario', 'primero')])
+        self.esperar(lambda: escritor.reintentos_pendientes() == 1)
+        escritor.encolar(4242, [('usuario', 'segundo')])
+        self.esperar(lambda: escritor.reintentos_pendientes() == 2)
+
+        Llamada.objects.create(pk=4242, sid='CA_REINTENTO', numero_destino='+1', numero_origen='+2')
+        self.esperar(lambda: escritor.reintentos_pendientes() == 0)
+        escritor.detener()
+
+        contenidos = MensajeConversacion.objects.filter(llamada_id=4242).order_by('pk').values_list('contenido', flat=True)
+        self.assertEqual(list(contenidos), ['primero', 'segundo'])
+        self.assertEqual(Llamada.objects.get(pk=4242).transcripcion, 'Usuario: primero\nUsuario: segundo')
+        self.assertEqual(escritor.descartados, 0)
+
+    def test_un_turno_invalido_no_arrastra_al_lote(self):
+        llamada = Llamada.objects.create(sid='CA_LOTE', numero_destino='+1', numero_origen='+2')
+        escritor = EscritorMensajes(max_reintentos=0)
+        escritor.encolar(4343, [('usuario', 'sin llamada')])
+        escritor.encolar(llamada.pk, [('usuario', 'hola')])
+        escritor.detener()
+
+        self.assertEqual(list(MensajeConversacion.objects.values_list('contenido', flat=True)), ['hola'])
+        self.assertEqual(escritor.descartados, 1)
+        self.assertEqual(escritor.reintentos_pendientes(), 0)
+
+    def test_despues_de_detener_escribe_en_el_request(self):
+        llamada = Llamada.objects.create(sid='CA_FIN', numero_destino='+1', numero_origen='+2')
+        escritor = EscritorMensajes()
+        escritor.detener()
+
+        escritor.encolar(llamada.pk, [('ia', 'adiós')])
+
+        self.assertTrue(MensajeConversacion.objects.filter(llamada=llamada, contenido='adiós').exists())
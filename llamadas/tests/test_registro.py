@@ -0,0 +1,38 @@
+import json
+import logging
+
+from django.test import SimpleTestCase
+
+from llamadas.registro import FormatoJSON, FormatoTexto, enmascarar_telefonos
+
+
+def registro(mensaje, **extra):
+    record = logging.LogRecord('llamadas.prueba', logging.INFO, __file__, 1, mensaje, (), None)
+    for campo, valor in extra.items():
+        setattr(record, campo, valor)
+    return record
+
+
+class EnmascaradoTests(SimpleTestCase):
+
+    def test_campos_de_telefono_siempre(self):
+        datos = json.loads(FormatoJSON().format(registro(
+            'Llamada creada', numero_destino='600111222', numero_origen='+34 600 333 444', To='sip:600555666',
+        )))
+        self.assertEqual(
+            (datos['numero_destino'], datos['numero_origen'], datos['To']), ('***1222', '***3444', '***5666'),
+        )
+
+    def test_texto_con_prefijo_y_separadores(self):
+        for telefono in ['+34600111222', '+34 600 111 222', '+34-600-111-222', '%2B34600111222']:
+            with self.subTest(telefono=telefono):
+                self.assertEqual(enmascarar_telefonos(f"destino {telefono}."), 'destino ***1222.')
+
+    def test_no_toca_timestamps_ni_ids(self):
+        texto = 'ts=1739999999123 id=123456789012 sid=CA1234567890123 fecha=2024-01-31'
+        self.assertEqual(enmascarar_telefonos(texto), texto)
+
+    def test_formato_texto(self):
+        texto = FormatoTexto().format(registro('Marcando +34 600 111 222', numero_destino='+34600111222'))
+        self.assertNotIn('600 111', texto)
+        self.assertIn('numero_destino=***1222', texto)
@@ -0,0 +1,110 @@
+import asyncio
+import base64
+import threading
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase, override_settings
+
+from llamadas.checks import comprobar_voz_tiempo_real
+from llamadas.management.stub_media_stream import ClienteMediaStream, SintetizadorTexto, TranscriptorTexto
+from llamadas.management.stub_openai import StubOpenAI
+from llamadas.models import Llamada, MensajeConversacion
+from llamadas.services import AIService
+from llamadas.streaming import MediaStreamHandler, SesionMediaStream
+
+
+class LLMLento:
+    """LLM falso en modo stream: una palabra cada `pausa` segundos"""
+
+    def __init__(self, palabras=50, pausa=0.02):
+        self.palabras = palabras
+        self.pausa = pausa
+        self.entregadas = 0
+        self.cerrado = threading.Event()
+
+    def obtener_respuesta_stream(self, mensaje_usuario, historial_conversacion=None, resumen=None):
+        try:
+            yield 'Primera frase. '
+            for i in range(self.palabras):
+                time.sleep(self.pausa)
+                self.entregadas += 1
+                yield f'palabra{i} '
+        finally:
+            self.cerrado.set()
+
+
+class TranscriptorHilos(TranscriptorTexto):
+    """Transcriptor falso que anota en qué hilo corre"""
+
+    def __init__(self):
+        self.hilos = []
+
+    def procesar_audio(self, audio):
+        self.hilos.append(threading.get_ident())
+        return None
+
+    def finalizar(self):
+        self.hilos.append(threading.get_ident())
+        return None
+
+
+def _handler(ai_service):
+    return MediaStreamHandler(ai_service, transcriptor_class=TranscriptorTexto, sintetizador=SintetizadorTexto())
+
+
+class MediaStreamTests(TestCase):
+
+    async def test_responde_frase_por_frase_y_guarda_el_turno(self):
+        llamada = await Llamada.objects.acreate(sid='CA_MS1', numero_destino='+1', numero_origen='+2')
+        with StubOpenAI(latencia=0) as stub, override_settings(OPENAI_API_KEY='x', OPENAI_BASE_URL=stub.url):
+            async with ClienteMediaStream(_handler(AIService()), call_sid='CA_MS1') as cliente:
+                await cliente.decir('Hola')
+                frases = await cliente.esperar_frases(2)
+                await cliente.detener()
+
+        self.assertEqual(frases, ['Claro, con gusto te ayudo.', '¿Necesitas algo más?'])
+        self.assertEqual(len(cliente.eventos('mark')), 2)
+        self.assertTrue(cliente.cerrado)
+        mensajes = [m async for m in MensajeConversacion.objects.filter(llamada=llamada).order_by('pk').values_list('tipo', 'contenido')]
+        self.assertEqual(mensajes, [('usuario', 'Hola'), ('ia', 'Claro, con gusto te ayudo. ¿Necesitas algo más?')])
+
+    async def test_interrupcion_corta_el_stream_del_llm(self):
+        await Llamada.objects.acreate(sid='CA_MS2', numero_destino='+1', numero_origen='+2')
+        llm = LLMLento()
+        async with ClienteMediaStream(_handler(llm), call_sid='CA_MS2') as cliente:
+            await cliente.decir('Cuéntame algo largo')
+            await cliente.esperar_frases(1)
+            # El usuario habla mientras la IA sigue respondiendo
+            await cliente.decir('Espera')
+            await cliente.esperar(lambda: cliente.eventos('clear'))
+            cerrado = await asyncio.to_thread(llm.cerrado.wait, 2)
+
+        self.assertTrue(cerrado)
+        self.assertLess(llm.entregadas, llm.palabras)
+
+    async def test_el_transcriptor_corre_fuera_del_bucle_de_eventos(self):
+        transcriptor = TranscriptorHilos()
+        sesion = SesionMediaStream(send=None, ai_service=None, transcriptor=transcriptor)
+
+        await sesion.procesar_evento({'event': 'media', 'media': {'payload': base64.b64encode(b'Hola').decode()}})
+        await sesion.procesar_evento({'event': 'stop'})
+
+        self.assertEqual(len(transcriptor.hilos), 2)
+        self.assertNotIn(threading.get_ident(), transcriptor.hilos)
+
+    @override_settings(VOZ_TIEMPO_REAL=True, MEDIA_STREAM_TRANSCRIPTOR='', MEDIA_STREAM_SINTETIZADOR='')
+    def test_modo_tiempo_real_sin_voz_no_arranca(self):
+        with self.assertRaises(ImproperlyConfigured):
+            MediaStreamHandler()
+        errores = comprobar_voz_tiempo_real(None)
+        self.assertEqual([e.id for e in errores], ['llamadas.E001', 'llamadas.E001'])
+
+    @override_settings(
+        VOZ_TIEMPO_REAL=True,
+        MEDIA_STREAM_TRANSCRIPTOR='llamadas.management.stub_media_stream.TranscriptorTexto',
+        MEDIA_STREAM_SINTETIZADOR='llamadas.management.stub_media_stream.SintetizadorTexto',
+    )
+    def test_modo_tiempo_real_configurado(self):
+        self.assertEqual(comprobar_voz_tiempo_real(None), [])
+        self.assertIsInstance(MediaStreamHandler().sintetizador, SintetizadorTexto)
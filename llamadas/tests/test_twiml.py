@@ -0,0 +1,87 @@
+"""
+TwiML contra documentos de referencia fijos
+
+Los documentos GOLDEN_* son la salida de los VoiceResponse originales de
+TwilioService (antes de las plantillas precompiladas de twiml.py), copiada
+literalmente: no dependen de los constructores construir_* que compara
+benchmark_twiml, así que un cambio en esos constructores también se detecta.
+"""
+from django.test import SimpleTestCase, override_settings
+
+from llamadas import twiml
+from llamadas.services import TwilioService
+
+
+URL = 'https://prueba.example/webhook/'
+TOKEN = '12-3:AbCdEfGhIjKlMnOpQrStUvWxYz0123456789_-abcde'
+TEXTO = 'Hola & <adiós> "ya"'
+
+GOLDEN_INICIAL = (
+    '<?xml version="1.0" encoding="UTF-8"?><Response>'
+    '<Say language="es-ES" voice="Polly.Lupe">Hola, soy tu asistente virtual. ¿En qué puedo ayudarte?</Say>'
+    '<Pause length="1" />'
+    '<Gather action="{url}" finishOnKey="#" input="speech" language="es-ES" method="POST" '
+    'speechTimeout="auto" timeout="10" />'
+    '<Say language="es-ES" voice="Polly.Lupe">No escuché tu respuesta. Por favor, intenta de nuevo.</Say>'
+    '<Redirect>{url}</Redirect></Response>'
+)
+
+GOLDEN_RESPUESTA = (
+    '<?xml version="1.0" encoding="UTF-8"?><Response><Pause length="1" />'
+    '<Say language="es-ES" voice="Polly.Lupe">Hola &amp; &lt;adiós&gt; "ya"</Say><Pause length="1" />'
+    '<Gather action="{url}" finishOnKey="#" input="speech" language="es-ES" method="POST" '
+    'speechTimeout="auto" timeout="10">'
+    '<Say language="es-ES" voice="Polly.Lupe">¿Algo más en lo que pueda ayudarte?</Say></Gather>'
+    '<Pause length="2" /><Say language="es-ES" voice="Polly.Lupe">Gracias por llamar. Hasta luego.</Say>'
+    '<Hangup /></Response>'
+)
+
+GOLDEN_FINAL = (
+    '<?xml version="1.0" encoding="UTF-8"?><Response>'
+    '<Say language="es-ES" voice="Polly.Lupe">Hola &amp; &lt;adiós&gt; "ya"</Say>'
+    '<Say language="es-ES" voice="Polly.Lupe">Gracias por llamar. Hasta luego.</Say><Hangup /></Response>'
+)
+
+GOLDEN_ESPERA = (
+    '<?xml version="1.0" encoding="UTF-8"?><Response>'
+    '<Say language="es-ES" voice="Polly.Lupe">Un momento, por favor.</Say>'
+    '<Redirect method="POST">https://prueba.example/webhook-resultado/?id=1&amp;t=2</Redirect></Response>'
+)
+
+
+@override_settings(TWILIO_VOZ='Polly.Lupe', TWILIO_IDIOMA='es-ES', AUDIO_TTS_BACKEND='')
+class TwimlTests(SimpleTestCase):
+
+    def test_inicial(self):
+        self.assertEqual(TwilioService().generar_twiml_inicial(URL), GOLDEN_INICIAL.format(url=URL))
+
+    def test_inicial_con_token(self):
+        documento = twiml.twiml_inicial(URL, 'Polly.Lupe', 'es-ES', token=TOKEN)
+        self.assertEqual(documento, GOLDEN_INICIAL.format(url=f'{URL}?t={TOKEN}'))
+
+    def test_respuesta(self):
+        self.assertEqual(TwilioService().generar_twiml_respuesta(TEXTO, URL), GOLDEN_RESPUESTA.format(url=URL))
+
+    def test_respuesta_con_token(self):
+        documento = twiml.twiml_respuesta(TEXTO, URL, 'Polly.Lupe', 'es-ES', token=TOKEN)
+        self.assertEqual(documento, GOLDEN_RESPUESTA.format(url=f'{URL}?t={TOKEN}'))
+
+    def test_respuesta_repetida_usa_la_plantilla(self):
+        # La segunda llamada sale de la plantilla compilada, la primera la compila
+        for _ in range(2):
+            self.assertEqual(TwilioService().generar_twiml_respuesta(TEXTO, URL), GOLDEN_RESPUESTA.format(url=URL))
+
+    def test_final(self):
+        self.assertEqual(TwilioService().generar_twiml_final(TEXTO), GOLDEN_FINAL)
+
+    def test_espera(self):
+        documento = TwilioService().generar_twiml_espera('https://prueba.example/webhook-resultado/?id=1&t=2')
+        self.assertEqual(documento, GOLDEN_ESPERA)
+
+    def test_audio_pre_renderizado(self):
+        audios = ((twiml.DESPEDIDA, 'https://prueba.example/media/audio/d.wav'),)
+        documento = twiml.twiml_final(TEXTO, 'Polly.Lupe', 'es-ES', audios)
+        self.assertEqual(documento, GOLDEN_FINAL.replace(
+            '<Say language="es-ES" voice="Polly.Lupe">Gracias por llamar. Hasta luego.</Say>',
+            '<Play>https://prueba.example/media/audio/d.wav</Play>',
+        ))
@@ -0,0 +1,77 @@
+import asyncio
+from urllib.parse import urlencode
+
+from asgiref.testing import ApplicationCommunicator
+from django.core.cache import cache
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.urls import resolve
+
+from llamadas.management.stub_openai import StubOpenAI
+from llamadas.models import Llamada, MensajeConversacion
+
+
+TURNO = {'CallSid': 'CA_ASYNC', 'CallStatus': 'in-progress', 'SpeechResult': 'Hola'}
+
+
+AJUSTES = dict(
+    ROOT_URLCONF='llamadas.urls_async', BASE_URL='https://prueba.example',
+    CACHE_RESPUESTAS_ACTIVA=False, IDEMPOTENCIA_ACTIVA=False,
+)
+
+
+@override_settings(**AJUSTES)
+class WebhookAsyncTests(TestCase):
+    """El webhook async probado a través del resolver y el handler ASGI, no llamando a la vista"""
+
+    def setUp(self):
+        # El almacén de conversaciones vive en la caché: que no quede la de otra prueba
+        cache.clear()
+
+    def test_la_ruta_resuelve_a_una_corrutina(self):
+        # Un decorador síncrono (p. ej. csrf_exempt de Django 4.2) la convertiría en función normal
+        self.assertTrue(asyncio.iscoroutinefunction(resolve('/webhook/').func))
+        self.assertTrue(asyncio.iscoroutinefunction(resolve('/webhook-resultado/').func))
+
+    async def test_turno_por_el_handler_asgi_con_csrf(self):
+        llamada = await Llamada.objects.acreate(sid='CA_ASYNC', numero_destino='+1', numero_origen='+2')
+        with StubOpenAI(latencia=0) as stub, override_settings(OPENAI_API_KEY='x', OPENAI_BASE_URL=stub.url):
+            respuesta = await AsyncClient(enforce_csrf_checks=True).post('/webhook/', TURNO)
+
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertIn(b'<Gather', respuesta.content)
+        self.assertIn(b'Claro, con gusto te ayudo.', respuesta.content)
+        self.assertEqual(stub.peticiones, 1)
+        self.assertEqual(await MensajeConversacion.objects.filter(llamada=llamada).acount(), 2)
+
+
+@override_settings(**AJUSTES)
+class AplicacionAsgiTests(TransactionTestCase):
+    """La petición entra por noxus.asgi.application, como la recibe uvicorn"""
+
+    def setUp(self):
+        cache.clear()
+
+    async def test_aplicacion_asgi_del_proyecto(self):
+        from noxus.asgi import application
+
+        await Llamada.objects.acreate(sid='CA_ASYNC', numero_destino='+1', numero_origen='+2')
+        cuerpo = urlencode(TURNO).encode()
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'POST',
+            'scheme': 'https', 'path': '/webhook/', 'raw_path': b'/webhook/', 'query_string': b'',
+            'headers': [
+                (b'host', b'testserver'),
+                (b'content-type', b'application/x-www-form-urlencoded'),
+                (b'content-length', str(len(cuerpo)).encode()),
+            ],
+            'client': ('127.0.0.1', 5000), 'server': ('testserver', 443),
+        }
+        with StubOpenAI(latencia=0) as stub, override_settings(OPENAI_API_KEY='x', OPENAI_BASE_URL=stub.url):
+            comunicador = ApplicationCommunicator(application, scope)
+            await comunicador.send_input({'type': 'http.request', 'body': cuerpo})
+            inicio = await comunicador.receive_output(10)
+            contenido = await comunicador.receive_output(10)
+
+        self.assertEqual(inicio['status'], 200)
+        self.assertIn(b'<Gather', contenido['body'])
+        self.assertEqual(stub.peticiones, 1)
@@ -0,0 +1,62 @@
+from django.core.cache import cache
+from django.test import TestCase
+
+from llamadas.campanas import _marcar_fallida
+from llamadas.models import EstadisticaLlamadas, Llamada
+
+
+class WebhookStatusTests(TestCase):
+    """Cada llamada terminada se cuenta una sola vez en las estadísticas"""
+
+    def setUp(self):
+        cache.clear()
+        self.llamada = Llamada.objects.create(sid='CA_STATUS', numero_destino='+1', numero_origen='+2')
+
+    def terminadas(self, estado):
+        return sum(EstadisticaLlamadas.objects.filter(estado=estado).values_list('llamadas', flat=True))
+
+    def status(self, call_status='completed', duracion='42'):
+        return self.client.post('/webhook-status/', {
+            'CallSid': 'CA_STATUS', 'CallStatus': call_status, 'CallDuration': duracion,
+        })
+
+    def test_cuenta_la_llamada_terminada(self):
+        self.assertEqual(self.status().status_code, 200)
+
+        self.llamada.refresh_from_db()
+        self.assertEqual((self.llamada.estado, self.llamada.duracion), ('completada', 42))
+        self.assertIsNotNone(self.llamada.fecha_fin)
+        self.assertEqual(self.terminadas('completada'), 1)
+
+    def test_estado_final_escrito_antes_por_el_webhook_de_voz(self):
+        # webhook_llamada recibió CallStatus=completed antes que este callback
+        Llamada.objects.filter(pk=self.llamada.pk).update(estado='completada')
+
+        self.status()
+
+        self.assertEqual(self.terminadas('completada'), 1)
+
+    def test_callback_repetido_no_cuenta_dos_veces(self):
+        self.status()
+        self.status()
+
+        self.assertEqual(self.terminadas('completada'), 1)
+
+    def test_marcar_fallida_despues_del_callback(self):
+        self.status()
+
+        _marcar_fallida(self.llamada.pk, 'sin callback')
+
+        self.llamada.refresh_from_db()
+        self.assertEqual(self.llamada.estado, 'completada')
+        self.assertEqual((self.terminadas('completada'), self.terminadas('fallida')), (1, 0))
+
+    def test_marcar_fallida_conserva_el_estado_final(self):
+        Llamada.objects.filter(pk=self.llamada.pk).update(estado='completada')
+
+        _marcar_fallida(self.llamada.pk, 'sin callback')
+
+        self.llamada.refresh_from_db()
+        self.assertEqual(self.llamada.estado, 'completada')
+        self.assertIsNotNone(self.llamada.fecha_fin)
+        self.assertEqual((self.terminadas('completada'), self.terminadas('fallida')), (1, 0))
@@ -0,0 +1,41 @@
+"""
+Token firmado del turno en la URL de acción del <Gather>
+
+Cada documento TwiML que espera la voz del usuario lleva en la URL del webhook
+un token "t" con el ID de la llamada y el número de turno, firmado con
+SECRET_KEY (django.core.signing). Con él el webhook identifica la llamada con
+una búsqueda por clave primaria (o directamente en el almacén de
+conversaciones) aunque falte el CallSid, y reconoce un turno repetido o viejo
+(reintento de Twilio, petición duplicada) sin volver a procesarlo.
+
+El turno es la cantidad de respuestas de la IA que lleva la conversación: el
+token del <Gather> que sigue a la respuesta N lleva el turno N.
+"""
+from collections import namedtuple
+
+from django.core import signing
+
+
+SALT = 'llamadas.turno'
+
+TurnoFirmado = namedtuple('TurnoFirmado', ['llamada_id', 'turno'])
+
+
+def firmar_turno(llamada_id, turno):
+    """
+    Token compacto "<id>-<turno>:<firma>" (solo caracteres seguros en URLs y XML)
+    """
+    return signing.Signer(salt=SALT).sign(f"{llamada_id}-{turno}")
+
+
+def leer_turno(token):
+    """
+    TurnoFirmado del token, o None si falta, está mal formado o la firma no es válida
+    """
+    if not token:
+        return None
+    try:
+        llamada_id, turno = signing.Signer(salt=SALT).unsign(token).split('-')
+        return TurnoFirmado(int(llamada_id), int(turno))
+    except (signing.BadSignature, ValueError):
+        return None
@@ -0,0 +1,214 @@
+"""
+Documentos TwiML precompilados
+
+Los documentos que devuelve el webhook son siempre iguales salvo el texto de la
+IA: la voz, el idioma y la URL del webhook no cambian entre turnos. En lugar de
+armar el árbol VoiceResponse/Gather y serializarlo en cada petición, cada
+documento se construye una sola vez por (voz, idioma, URL) con un marcador en
+el lugar del texto, y en cada turno solo se inserta el texto escapado.
+
+Las funciones construir_* son la referencia (el árbol de la librería de
+Twilio); las plantillas compiladas producen exactamente los mismos bytes, lo
+que verifica `python manage.py benchmark_twiml`. En el documento de espera
+el dato variable es la URL del <Redirect> en lugar del texto.
+
+La URL del webhook lleva además el token firmado del turno (ver tokens.py),
+que cambia en cada turno: las plantillas tienen un segundo marcador en su
+lugar, así que el documento se sigue compilando una sola vez por URL base. `audios` son pares
+(texto, url) de frases fijas con audio pre-renderizado (ver audio.py).
+"""
+import re
+from functools import lru_cache
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from twilio.twiml.voice_response import VoiceResponse, Gather
+
+
+# Marcador del texto dinámico: solo caracteres que el serializador XML no escapa
+MARCADOR = 'NOXUS0MARCADOR0TEXTO'
+# Marcador del token del turno; el token solo usa caracteres que no se escapan
+MARCADOR_TOKEN = 'NOXUS0MARCADOR0TOKEN'
+_MARCADORES = re.compile(f'({MARCADOR}|{MARCADOR_TOKEN})')
+
+SALUDO_INICIAL = 'Hola, soy tu asistente virtual. ¿En qué puedo ayudarte?'
+SIN_RESPUESTA = 'No escuché tu respuesta. Por favor, intenta de nuevo.'
+ALGO_MAS = '¿Algo más en lo que pueda ayudarte?'
+DESPEDIDA = 'Gracias por llamar. Hasta luego.'
+UN_MOMENTO = 'Un momento, por favor.'
+
+
+def url_con_token(url, token):
+    """
+    URL del webhook con el token del turno como parámetro "t"
+    """
+    if not token:
+        return url
+    return f"{url}{'&' if '?' in url else '?'}t={token}"
+
+
+def _decir(nodo, texto, voz, idioma, audios):
+    """
+    <Play> si la frase tiene audio pre-renderizado (ver audio.py), si no <Say>
+    """
+    url = dict(audios).get(texto)
+    if url:
+        nodo.play(url)
+    else:
+        nodo.say(texto, language=idioma, voice=voz)
+
+
+def construir_twiml_inicial(webhook_url, voz, idioma, audios=()):
+    """
+    TwiML para el inicio de la llamada
+    """
+    response = VoiceResponse()
+
+    # Saludo inicial más corto y directo
+    _decir(response, SALUDO_INICIAL, voz, idioma, audios)
+
+    # Pausa breve antes de capturar
+    response.pause(length=1)
+
+    # Gather para capturar la voz del usuario
+    gather = Gather(
+        input='speech',
+        language=idioma,
+        speech_timeout='auto',
+        action=webhook_url,
+        method='POST',
+        timeout=10,  # Timeout de 10 segundos
+        finish_on_key='#'  # Opcional: terminar con #
+    )
+    # No agregar otro Say dentro del Gather, solo esperar
+    response.append(gather)
+
+    # Si no hay respuesta, redirigir al webhook para intentar de nuevo
+    _decir(response, SIN_RESPUESTA, voz, idioma, audios)
+    response.redirect(webhook_url)
+
+    return str(response)
+
+
+def construir_twiml_respuesta(mensaje_ia, webhook_url, voz, idioma, audios=()):
+    """
+    TwiML con la respuesta de la IA que espera más input
+    """
+    response = VoiceResponse()
+
+    # Pausa breve antes de responder
+    response.pause(length=1)
+
+    # Decir la respuesta de la IA
+    response.say(mensaje_ia, language=idioma, voice=voz)
+
+    # Pausa después de la respuesta
+    response.pause(length=1)
+
+    # Gather para capturar más input del usuario
+    gather = Gather(
+        input='speech',
+        language=idioma,
+        speech_timeout='auto',
+        action=webhook_url,
+        method='POST',
+        timeout=10,  # Timeout de 10 segundos
+        finish_on_key='#'  # Opcional: terminar con #
+    )
+    _decir(gather, ALGO_MAS, voz, idioma, audios)
+    response.append(gather)
+
+    # Si no hay respuesta, finalizar
+    response.pause(length=2)
+    _decir(response, DESPEDIDA, voz, idioma, audios)
+    response.hangup()
+
+    return str(response)
+
+
+def construir_twiml_final(mensaje_ia, voz, idioma, audios=()):
+    """
+    TwiML final para cerrar la llamada
+    """
+    response = VoiceResponse()
+    response.say(mensaje_ia, language=idioma, voice=voz)
+    _decir(response, DESPEDIDA, voz, idioma, audios)
+    response.hangup()
+
+    return str(response)
+
+
+def construir_twiml_espera(redirect_url, voz, idioma, audios=()):
+    """
+    TwiML de relleno mientras la respuesta de la IA se termina en segundo plano
+    """
+    response = VoiceResponse()
+    _decir(response, UN_MOMENTO, voz, idioma, audios)
+    # Twilio vuelve a pedir el resultado (ver diferidas.py)
+    response.redirect(redirect_url, method='POST')
+
+    return str(response)
+
+
+class PlantillaTwiML:
+    """Documento TwiML partido alrededor de los datos dinámicos (texto y token)"""
+
+    def __init__(self, documento):
+        self.partes = _MARCADORES.split(documento)
+
+    def render(self, texto='', token=''):
+        valores = {MARCADOR: escape(texto), MARCADOR_TOKEN: token}
+        return ''.join([valores.get(parte, parte) for parte in self.partes])
+
+
+@lru_cache(maxsize=256)
+def _twiml_inicial(webhook_url, voz, idioma, audios):
+    return construir_twiml_inicial(webhook_url, voz, idioma, audios)
+
+
+@lru_cache(maxsize=256)
+def _plantilla_inicial(webhook_url, voz, idioma, audios):
+    return PlantillaTwiML(construir_twiml_inicial(url_con_token(webhook_url, MARCADOR_TOKEN), voz, idioma, audios))
+
+
+@lru_cache(maxsize=256)
+def _plantilla_respuesta(webhook_url, voz, idioma, audios, con_token):
+    url = url_con_token(webhook_url, MARCADOR_TOKEN) if con_token else webhook_url
+    return PlantillaTwiML(construir_twiml_respuesta(MARCADOR, url, voz, idioma, audios))
+
+
+@lru_cache(maxsize=32)
+def _plantilla_final(voz, idioma, audios):
+    return PlantillaTwiML(construir_twiml_final(MARCADOR, voz, idioma, audios))
+
+
+@lru_cache(maxsize=32)
+def _plantilla_espera(voz, idioma, audios):
+    return PlantillaTwiML(construir_twiml_espera(MARCADOR, voz, idioma, audios))
+
+
+def twiml_inicial(webhook_url, voz, idioma, audios=(), token=''):
+    if not token:
+        return _twiml_inicial(webhook_url, voz, idioma, audios)
+    return _plantilla_inicial(webhook_url, voz, idioma, audios).render(token=token)
+
+
+def twiml_respuesta(mensaje_ia, webhook_url, voz, idioma, audios=(), token=''):
+    if not mensaje_ia:
+        # Sin texto la librería serializa <Say/> vacío: se delega en el constructor
+        return construir_twiml_respuesta(mensaje_ia, url_con_token(webhook_url, token), voz, idioma, audios)
+    return _plantilla_respuesta(webhook_url, voz, idioma, audios, bool(token)).render(mensaje_ia, token)
+
+
+def twiml_final(mensaje_ia, voz, idioma, audios=()):
+    if not mensaje_ia:
+        return construir_twiml_final(mensaje_ia, voz, idioma, audios)
+    return _plantilla_final(voz, idioma, audios).render(mensaje_ia)
+
+
+def twiml_espera(redirect_url, voz, idioma, audios=()):
+    return _plantilla_espera(voz, idioma, audios).render(redirect_url)
+
+
+def voz_e_idioma():
+    return settings.TWILIO_VOZ, settings.TWILIO_IDIOMA
@@ -0,0 +1,90 @@
+"""
+URL pública de los webhooks
+
+Twilio necesita una URL pública para los webhooks. Si settings.BASE_URL lo es,
+se usa tal cual. Si apunta a localhost (desarrollo con ngrok), la URL del
+túnel se pide a la API local de ngrok (NGROK_API_URL) una sola vez, se guarda
+en memoria y un hilo la vuelve a consultar cada URL_PUBLICA_REFRESCO
+segundos: si ngrok se reinicia con otra URL se toma la nueva, y si el túnel
+desaparece se vuelve a BASE_URL (iniciar_llamada rechaza las URLs locales).
+
+La comparten iniciar_llamada, los webhooks y las campañas, así que el
+<Gather> y los <Redirect> apuntan al mismo túnel por el que llamó Twilio, y
+ninguna petición espera a la API de ngrok.
+"""
+import logging
+import threading
+
+import requests
+from django.conf import settings
+from django.urls import reverse
+
+
+logger = logging.getLogger(__name__)
+
+_url_tunel = None
+_resuelta = False
+_lock = threading.Lock()
+_hilo = None
+
+
+def es_local(url):
+    return 'localhost' in url or '127.0.0.1' in url
+
+
+def detectar_tunel():
+    """
+    URL pública del túnel de ngrok (https si hay), o None si no responde o no hay túneles
+    """
+    try:
+        respuesta = requests.get(settings.NGROK_API_URL, timeout=1)
+        respuesta.raise_for_status()
+        tuneles = respuesta.json().get('tunnels', [])
+    except (requests.RequestException, ValueError):
+        return None
+    if not tuneles:
+        return None
+    https = next((t for t in tuneles if t.get('proto') == 'https'), None)
+    return (https or tuneles[0])['public_url']
+
+
+def _refrescar():
+    global _url_tunel
+    url = detectar_tunel()
+    if url != _url_tunel:
+        if url:
+            logger.info("URL pública detectada en ngrok", extra={'url': url})
+        else:
+            logger.warning("El túnel de ngrok no responde, se usa BASE_URL")
+        _url_tunel = url
+
+
+def _ejecutar():
+    evento = threading.Event()
+    while not evento.wait(settings.URL_PUBLICA_REFRESCO):
+        _refrescar()
+
+
+def url_base():
+    """
+    URL base pública de los webhooks, sin barra final
+    """
+    if not es_local(settings.BASE_URL):
+        return settings.BASE_URL.rstrip('/')
+    global _resuelta, _hilo
+    if not _resuelta:
+        with _lock:
+            if not _resuelta:
+                _refrescar()
+                _resuelta = True
+                if settings.URL_PUBLICA_REFRESCO:
+                    _hilo = threading.Thread(target=_ejecutar, name='url-publica', daemon=True)
+                    _hilo.start()
+    return (_url_tunel or settings.BASE_URL).rstrip('/')
+
+
+def url_webhook(nombre):
+    """
+    URL absoluta de una vista de llamadas, p. ej. url_webhook('webhook_llamada')
+    """
+    return f"{url_base()}{reverse(f'llamadas:{nombre}')}"
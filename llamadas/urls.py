@@ -1,14 +1,25 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import api, views
 
 app_name = 'llamadas'
 
 urlpatterns = [
     path('', views.index, name='index'),
     path('iniciar/', views.iniciar_llamada, name='iniciar_llamada'),
-    path('webhook/', views.webhook_llamada, name='webhook_llamada'),
+    # Con WEBHOOK_ASYNC=True se sirve la versión async (requiere ASGI)
+    path('webhook/', views.webhook_llamada_async if settings.WEBHOOK_ASYNC else views.webhook_llamada, name='webhook_llamada'),
+    path('webhook-resultado/', views.webhook_resultado_async if settings.WEBHOOK_ASYNC else views.webhook_resultado, name='webhook_resultado'),
     path('webhook-test/', views.webhook_test, name='webhook_test'),
     path('webhook-status/', views.webhook_status, name='webhook_status'),
+    path('audio/<str:nombre>', views.audio_frase, name='audio_frase'),
     path('llamada/<int:llamada_id>/', views.detalle_llamada, name='detalle_llamada'),
+    path('estadisticas/', views.estadisticas, name='estadisticas'),
+    path('metrics', views.metricas, name='metricas'),
+    path('api/llamadas/', api.llamadas_lista, name='api_llamadas'),
+    path('api/llamadas/<int:llamada_id>/', api.llamada_detalle, name='api_llamada'),
+    path('api/llamadas/<int:llamada_id>/mensajes/', api.llamada_mensajes, name='api_mensajes'),
+    path('api/buscar/', api.buscar, name='api_buscar'),
+    path('api/exportar/', api.exportar, name='api_exportar'),
 ]
 
@@ -0,0 +1,31 @@
+"""
+Rutas de llamadas con los webhooks de voz asíncronos, sin depender de
+WEBHOOK_ASYNC (que se lee al importar urls.py). benchmark_webhook y las
+pruebas las usan como ROOT_URLCONF para pasar por el handler y el resolver
+de Django en lugar de llamar a la vista directamente. urls_sync.py es el
+equivalente con los webhooks síncronos.
+"""
+from django.contrib import admin
+from django.urls import include, path
+
+from . import urls, views
+
+
+def con_vistas(vistas):
+    """
+    urlpatterns del proyecto con las vistas de llamadas indicadas por nombre de ruta
+    """
+    rutas = [
+        path(str(ruta.pattern), vistas[ruta.name], name=ruta.name) if ruta.name in vistas else ruta
+        for ruta in urls.urlpatterns
+    ]
+    return [
+        path('admin/', admin.site.urls),
+        path('', include((rutas, urls.app_name))),
+    ]
+
+
+urlpatterns = con_vistas({
+    'webhook_llamada': views.webhook_llamada_async,
+    'webhook_resultado': views.webhook_resultado_async,
+})
@@ -0,0 +1,11 @@
+"""
+Rutas de llamadas con los webhooks de voz síncronos (ver urls_async.py)
+"""
+from . import views
+from .urls_async import con_vistas
+
+
+urlpatterns = con_vistas({
+    'webhook_llamada': views.webhook_llamada,
+    'webhook_resultado': views.webhook_resultado,
+})
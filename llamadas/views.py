@@ -1,18 +1,57 @@
 from django.shortcuts import render, redirect
-from django.http import HttpResponse, JsonResponse
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.conf import settings
-from django.urls import reverse
+from django.utils import timezone
+from asgiref.sync import sync_to_async
 from twilio.twiml.voice_response import VoiceResponse
-from .models import Llamada, MensajeConversacion
+from .models import Llamada
 from .services import TwilioService, AIService
+from .campanas import PREFIJO_SID_PROVISIONAL, adoptar_sid, registrar_resultado
+from .estadisticas import ESTADOS_FINALES, registrar_fin, registrar_inicio, registrar_inicio_async, resumen_estadisticas
+from .persistencia import guardar_mensajes
+from .archivo import mensajes_llamada, transcripcion_llamada
+from .contexto import obtener_resumen, obtener_resumen_async, programar_resumen
+from .conversaciones import (
+    actualizar_estado, agregar_mensajes, cargar_conversacion, finalizar_conversacion, obtener_conversacion,
+)
+from .streaming import RUTA_MEDIA_STREAM
+from .tokens import leer_turno
+from .registro import con_contexto_llamada, contexto_llamada
+from .metricas import medir, medir_turno, texto_prometheus
+from .idempotencia import idempotente
+from .api import vista_api
+from .audio import PATRON_NOMBRE
+from .url_publica import es_local, url_base, url_webhook
+from . import diferidas
 import json
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+# Mapeo de CallStatus de Twilio a Llamada.estado usado por los webhooks de voz
+ESTADOS_WEBHOOK = {
+    'ringing': 'iniciada',
+    'in-progress': 'en_progreso',
+    'completed': 'completada',
+    'failed': 'fallida',
+    'busy': 'fallida',
+    'no-answer': 'fallida',
+    'canceled': 'cancelada'
+}
+
+# Respuestas de un turno diferido que falló o no terminó a tiempo (ver diferidas.py)
+ERROR_TURNO = 'Lo siento, hubo un error al procesar tu solicitud. Por favor, intenta de nuevo.'
+DEMORA_TURNO = 'Lo siento, estoy tardando más de lo normal. ¿Puedes repetir tu pregunta?'
 
 
 def index(request):
     """Vista principal para iniciar llamadas"""
-    llamadas = Llamada.objects.all()[:10]
+    # La tabla no muestra transcripcion ni notas: no traerlas de la BD
+    llamadas = Llamada.objects.defer('transcripcion', 'notas')[:10]
     return render(request, 'llamadas/index.html', {'llamadas': llamadas})
 
 
@@ -28,42 +67,19 @@ def iniciar_llamada(request):
     if not settings.TWILIO_ACCOUNT_SID or not settings.TWILIO_AUTH_TOKEN:
         return JsonResponse({'error': 'Twilio no está configurado'}, status=500)
     
-    # Intentar detectar ngrok automáticamente si BASE_URL es localhost
-    webhook_url_base = settings.BASE_URL
-    if 'localhost' in settings.BASE_URL or '127.0.0.1' in settings.BASE_URL:
-        # Intentar detectar ngrok automáticamente
-        try:
-            import requests
-            response = requests.get('http://localhost:4040/api/tunnels', timeout=1)
-            if response.status_code == 200:
-                data = response.json()
-                tunnels = data.get('tunnels', [])
-                if tunnels:
-                    https_tunnel = next((t for t in tunnels if t.get('proto') == 'https'), None)
-                    if https_tunnel:
-                        webhook_url_base = https_tunnel['public_url']
-                    else:
-                        webhook_url_base = tunnels[0]['public_url']
-        except:
-            pass
-        
-        # Si aún es localhost después de intentar detectar ngrok
-        if 'localhost' in webhook_url_base or '127.0.0.1' in webhook_url_base:
-            return JsonResponse({
-                'error': 'BASE_URL no puede ser localhost. Twilio requiere una URL pública. Por favor, configura ngrok (ejecuta: ngrok http 8000) y actualiza BASE_URL en settings.py con la URL de ngrok, o ejecuta: python configurar_ngrok.py'
-            }, status=400)
+    # URL pública resuelta y cacheada una vez (BASE_URL o el túnel de ngrok, ver url_publica.py)
+    if es_local(url_base()):
+        return JsonResponse({
+            'error': 'BASE_URL no puede ser localhost. Twilio requiere una URL pública. Por favor, configura ngrok (ejecuta: ngrok http 8000) y actualiza BASE_URL en settings.py con la URL de ngrok, o ejecuta: python configurar_ngrok.py'
+        }, status=400)
     
     try:
         twilio_service = TwilioService()
         
-        # URL del webhook para manejar la llamada (usa webhook_url_base que puede ser ngrok detectado)
-        webhook_url = f"{webhook_url_base}{reverse('llamadas:webhook_llamada')}"
+        # URL del webhook para manejar la llamada
+        webhook_url = url_webhook('webhook_llamada')
         
-        print(f"\n[DEBUG] Iniciando llamada:")
-        print(f"  Destino: {numero_destino}")
-        print(f"  Webhook URL: {webhook_url}")
-        print(f"  BASE_URL: {settings.BASE_URL}")
-        print(f"  webhook_url_base: {webhook_url_base}\n")
+        logger.info("Iniciando llamada", extra={'numero_destino': numero_destino, 'webhook_url': webhook_url})
         
         # Hacer la llamada
         call = twilio_service.hacer_llamada(numero_destino, webhook_url)
@@ -75,6 +91,7 @@ def iniciar_llamada(request):
             numero_origen=settings.TWILIO_PHONE_NUMBER,
             estado='iniciada'
         )
+        registrar_inicio(llamada)
         
         return JsonResponse({
             'success': True,
@@ -84,6 +101,7 @@ def iniciar_llamada(request):
         })
     
     except Exception as e:
+        logger.exception("Error al iniciar la llamada")
         # Mejorar el mensaje de error
         error_msg = str(e)
         if 'Url is not a valid URL' in error_msg or 'localhost' in error_msg.lower():
@@ -101,22 +119,161 @@ def webhook_test(request):
     """
     from twilio.twiml.voice_response import VoiceResponse
     
-    print("\n[WEBHOOK-TEST] Petición recibida en endpoint de prueba")
+    logger.info("Petición recibida en el endpoint de prueba")
     response = VoiceResponse()
     response.say('Hola, este es un mensaje de prueba desde Django. ¿Puedes escucharme?', language='es-ES', voice='Polly.Lupe')
     response.hangup()
     
     return HttpResponse(str(response), content_type='text/xml; charset=utf-8')
 
+def csrf_exempt_async(view_func):
+    """
+    csrf_exempt para vistas async: el de Django 4.2 las envuelve en una función
+    síncrona y el handler ASGI deja de reconocerlas como corrutinas
+    """
+    view_func.csrf_exempt = True
+    return view_func
+
+
+def _responder_turno(conversacion, speech_result, ai_service):
+    """
+    Obtiene la respuesta de la IA a un turno de voz y guarda los mensajes
+    
+    Returns:
+        Respuesta de la IA como string
+    """
+    # Historial previo al mensaje actual, ya listo para enviar a OpenAI
+    historial = list(conversacion['mensajes'])
+    # Resumen de la parte antigua del historial (ver contexto.py)
+    with medir('resumen'):
+        resumen = obtener_resumen(conversacion['sid'])
+    logger.debug("Historial de conversación", extra={
+        'mensajes_previos': len(historial), 'mensajes_resumidos': resumen.mensajes if resumen else 0,
+    })
+    
+    # Obtener respuesta de la IA
+    respuesta_ia = ai_service.obtener_respuesta(speech_result, historial, resumen)
+    
+    # Turno diferido que llegó tarde: el llamante no la va a escuchar, no se guarda
+    if not diferidas.reclamar_entrega():
+        logger.warning("Respuesta descartada: llegó después de la última espera")
+        return respuesta_ia
+    
+    # Guardar los mensajes del turno (y la transcripción) en una sola transacción
+    nuevos = [
+        {"role": "user", "content": speech_result},
+        {"role": "assistant", "content": respuesta_ia},
+    ]
+    with medir('guardar'):
+        guardar_mensajes(conversacion['llamada_id'], [('usuario', speech_result), ('ia', respuesta_ia)])
+        agregar_mensajes(conversacion, nuevos)
+    # Si el historial ya no entra en el presupuesto, se resume en segundo plano
+    programar_resumen(conversacion['sid'], historial + nuevos, resumen)
+    return respuesta_ia
+
+
+async def _responder_turno_async(conversacion, speech_result):
+    """
+    Versión asíncrona de _responder_turno
+    """
+    # Historial previo al mensaje actual
+    historial = list(conversacion['mensajes'])
+    with medir('resumen'):
+        resumen = await obtener_resumen_async(conversacion['sid'])
+    
+    respuesta_ia = await AIService().obtener_respuesta_async(speech_result, historial, resumen)
+    
+    if not await diferidas.reclamar_entrega_async():
+        logger.warning("Respuesta descartada: llegó después de la última espera")
+        return respuesta_ia
+    
+    nuevos = [
+        {"role": "user", "content": speech_result},
+        {"role": "assistant", "content": respuesta_ia},
+    ]
+    with medir('guardar'):
+        await sync_to_async(guardar_mensajes)(conversacion['llamada_id'], [('usuario', speech_result), ('ia', respuesta_ia)])
+        await sync_to_async(agregar_mensajes, thread_sensitive=False)(conversacion, nuevos)
+    programar_resumen(conversacion['sid'], historial + nuevos, resumen)
+    return respuesta_ia
+
+
+def _turno_actual(conversacion):
+    """
+    (llamada_id, turno) de la conversación, para el token del Gather
+    """
+    if not conversacion:
+        return None, 0
+    return conversacion['llamada_id'], conversacion.get('turno', 0)
+
+
+def _turno_invalido(conversacion, turno_firmado):
+    """
+    Motivo para no procesar el turno, o None si es válido (o no trae token)
+    """
+    if turno_firmado is None:
+        return None
+    if turno_firmado.llamada_id != conversacion['llamada_id']:
+        return 'otra llamada'
+    if turno_firmado.turno < conversacion.get('turno', 0):
+        return 'repetido'
+    return None
+
+
+def _twiml_turno_rechazado(twilio_service, conversacion, webhook_url, motivo):
+    """
+    Un turno repetido recibe otra vez la última respuesta (sin llamar a la IA);
+    un token de otra llamada, el TwiML de error
+    """
+    if motivo == 'repetido':
+        ultima = next((m['content'] for m in reversed(conversacion['mensajes']) if m['role'] == 'assistant'), '')
+        return twilio_service.generar_twiml_respuesta(ultima or ERROR_TURNO, webhook_url, *_turno_actual(conversacion))
+    response = VoiceResponse()
+    response.say('Lo siento, hubo un error. Por favor, intenta más tarde.', language='es-ES', voice='Polly.Lupe')
+    response.hangup()
+    return str(response)
+
+
+def _url_resultado(clave, intento, token=''):
+    """
+    URL del <Redirect> que vuelve a pedir la respuesta de un turno diferido
+    """
+    url = f"{url_webhook('webhook_resultado')}?clave={clave}&intento={intento}"
+    return f"{url}&t={token}" if token else url
+
+
+def _twiml_resultado(twilio_service, clave, intento, listo, respuesta_ia, turno_firmado=None):
+    """
+    Respuesta del turno si ya está; si no, más relleno hasta RELLENO_MAX_ESPERAS
+
+    El token del relleno ya lleva el turno siguiente (turno_firmado). Si el
+    turno no se guardó (abandonado o fallido), la conversación no avanzó y el
+    Gather firma el turno en el que sigue: con el siguiente, un reintento de
+    Twilio del próximo turno pasaría por nuevo y se procesaría dos veces
+    """
+    webhook_url = url_webhook('webhook_llamada')
+    llamada_id, turno = turno_firmado or (None, 0)
+    if listo and respuesta_ia is not None:
+        return twilio_service.generar_twiml_respuesta(respuesta_ia, webhook_url, llamada_id, turno)
+    if not listo and clave and intento < settings.RELLENO_MAX_ESPERAS:
+        token = twilio_service.token_turno(llamada_id, turno)
+        return twilio_service.generar_twiml_espera(_url_resultado(clave, intento + 1, token))
+    turno_sin_guardar = max(turno - 1, 0) if turno_firmado else turno
+    if listo:
+        return twilio_service.generar_twiml_respuesta(ERROR_TURNO, webhook_url, llamada_id, turno_sin_guardar)
+    logger.warning("Turno diferido sin respuesta", extra={'clave': clave, 'esperas': intento})
+    return twilio_service.generar_twiml_respuesta(DEMORA_TURNO, webhook_url, llamada_id, turno_sin_guardar)
+
+
 @csrf_exempt
+@con_contexto_llamada
+@idempotente
+@medir_turno
 def webhook_llamada(request):
     """
     Webhook de Twilio para manejar eventos de la llamada
     NOTA: Removido @require_http_methods para permitir GET también (Twilio puede hacer GET)
     """
-    import logging
-    logger = logging.getLogger(__name__)
-    
     # Log inicial para verificar que el webhook está siendo llamado
     # Verificar si es una petición de Twilio (debe tener CallSid o From/To) o es del desbloqueo
     post_params = dict(request.POST)
@@ -125,20 +282,17 @@ def webhook_llamada(request):
                              post_params.get('From') or get_params.get('From') or
                              post_params.get('To') or get_params.get('To'))
     
-    print("\n" + "=" * 60)
-    print("[WEBHOOK] Petición recibida")
-    print(f"[WEBHOOK] Método: {request.method}")
-    print(f"[WEBHOOK] URL: {request.path}")
-    print(f"[WEBHOOK] Es petición de Twilio: {is_twilio_request}")
-    print(f"[WEBHOOK] Todos los parámetros POST: {post_params}")
-    print(f"[WEBHOOK] Todos los parámetros GET: {get_params}")
-    print("=" * 60 + "\n")
+    # Solo los nombres de los parámetros: los valores traen números de teléfono y lo que dijo el usuario
+    logger.debug("Petición recibida", extra={
+        'metodo': request.method, 'ruta': request.path, 'es_twilio': is_twilio_request,
+        'parametros': sorted({*post_params, *get_params}),
+    })
     
     # Si no es una petición de Twilio y no tiene parámetros, puede ser del desbloqueo
     # En ese caso, devolver un TwiML simple para que ngrok se desbloquee
     # PERO si es POST sin parámetros, puede ser la primera llamada de Twilio cuando se contesta
     if not is_twilio_request and not post_params and not get_params and request.method == 'GET':
-        print("[WEBHOOK] Petición de desbloqueo de ngrok detectada (GET)")
+        logger.debug("Petición de desbloqueo de ngrok (GET)")
         response = VoiceResponse()
         response.say('OK', language='es-ES')
         return HttpResponse(str(response), content_type='text/xml; charset=utf-8')
@@ -146,7 +300,7 @@ def webhook_llamada(request):
     # Si es POST sin parámetros, puede ser la primera llamada de Twilio cuando se contesta
     # En ese caso, generar TwiML inicial de todas formas
     if request.method == 'POST' and not is_twilio_request and not post_params and not get_params:
-        print("[WEBHOOK] POST sin parámetros - puede ser primera llamada de Twilio, generando TwiML inicial")
+        logger.debug("POST sin parámetros, se genera el TwiML inicial")
     
     try:
         # Obtener parámetros tanto de POST como GET (Twilio puede usar ambos)
@@ -155,144 +309,123 @@ def webhook_llamada(request):
         speech_result = request.POST.get('SpeechResult') or request.GET.get('SpeechResult', '')
         digits = request.POST.get('Digits') or request.GET.get('Digits', '')  # Por si acaso usa DTMF
         
-        print(f"[WEBHOOK] CallSid: {call_sid}")
-        print(f"[WEBHOOK] CallStatus: {call_status}")
-        print(f"[WEBHOOK] SpeechResult: {speech_result}")
-        print(f"[WEBHOOK] Digits: {digits}")
-        
-        # Obtener o crear la llamada
-        # Si no hay CallSid, intentar obtenerlo de otros parámetros o buscar la llamada más reciente
-        if not call_sid:
-            # Intentar obtener de otros parámetros
-            call_sid = request.POST.get('CallSid') or request.GET.get('CallSid') or request.POST.get('CallSid') or ''
-            # Si aún no hay CallSid, buscar la llamada más reciente que esté en progreso
-            if not call_sid:
-                try:
-                    llamada_reciente = Llamada.objects.filter(estado__in=['iniciada', 'en_progreso']).order_by('-fecha_creacion').first()
-                    if llamada_reciente:
-                        call_sid = llamada_reciente.sid
-                        print(f"[WEBHOOK] Usando CallSid de llamada reciente: {call_sid}")
-                except:
-                    pass
+        logger.debug("Evento de llamada", extra={
+            'call_status': call_status, 'speech_caracteres': len(speech_result), 'digits': bool(digits),
+        })
         
-        try:
-            llamada = Llamada.objects.get(sid=call_sid) if call_sid else None
-        except Llamada.DoesNotExist:
-            llamada = None
+        # Llamada y turno firmados en la URL del Gather (ver tokens.py)
+        turno_firmado = leer_turno(request.GET.get('t', ''))
         
-        # Si no existe la llamada, crear una nueva
-        if not llamada:
-            numero_destino = request.POST.get('To', '') or request.GET.get('To', '')
-            numero_origen = request.POST.get('From', '') or request.GET.get('From', '')
-            if call_sid or numero_destino:
-                llamada = Llamada.objects.create(
-                    sid=call_sid or f"TEMP_{request.META.get('REMOTE_ADDR', 'unknown')}",
-                    numero_destino=numero_destino,
-                    numero_origen=numero_origen,
-                    estado='iniciada'
-                )
-                print(f"[WEBHOOK] Llamada creada: {llamada.sid}")
-            else:
-                print(f"[WEBHOOK] ERROR: No se puede crear llamada sin CallSid ni número de destino")
-                # Aún así, generar TwiML inicial para que la llamada continúe
+        # Estado de la conversación en el almacén (ver conversaciones.py): en los
+        # turnos normales evita leer la llamada y el historial de la base de datos
+        with medir('conversacion'):
+            conversacion = obtener_conversacion(call_sid)
+            
+            if conversacion is None:
+                # Obtener o crear la llamada: por la clave primaria del token o por CallSid
+                llamada = None
+                if turno_firmado:
+                    llamada = Llamada.objects.filter(pk=turno_firmado.llamada_id).first()
+                    # Llamada de campaña cuyo primer evento llega antes de que el programador guarde el CallSid
+                    if llamada and call_sid and llamada.sid.startswith(PREFIJO_SID_PROVISIONAL):
+                        llamada = adoptar_sid(llamada.pk, call_sid)
+                elif call_sid:
+                    llamada = Llamada.objects.filter(sid=call_sid).first()
+                
+                # Si no existe la llamada, crear una nueva
+                if not llamada:
+                    numero_destino = request.POST.get('To', '') or request.GET.get('To', '')
+                    numero_origen = request.POST.get('From', '') or request.GET.get('From', '')
+                    if call_sid or numero_destino:
+                        llamada = Llamada.objects.create(
+                            sid=call_sid or f"TEMP_{request.META.get('REMOTE_ADDR', 'unknown')}",
+                            numero_destino=numero_destino,
+                            numero_origen=numero_origen,
+                            estado='iniciada'
+                        )
+                        registrar_inicio(llamada)
+                        logger.info("Llamada creada desde el webhook", extra={'llamada_id': llamada.pk})
+                    else:
+                        logger.warning("No se puede crear la llamada sin CallSid ni número de destino")
+                        # Aún así, generar TwiML inicial para que la llamada continúe
+                
+                if llamada:
+                    conversacion = obtener_conversacion(llamada.sid) or cargar_conversacion(llamada)
+            
+        if conversacion:
+            contexto_llamada(llamada_id=conversacion['llamada_id'], turno=conversacion.get('turno', 0))
         
         # Actualizar estado solo si tenemos una llamada válida
-        if llamada and call_status:
-            estado_map = {
-                'ringing': 'iniciada',
-                'in-progress': 'en_progreso',
-                'completed': 'completada',
-                'failed': 'fallida',
-                'busy': 'fallida',
-                'no-answer': 'fallida',
-                'canceled': 'cancelada'
-            }
-            llamada.estado = estado_map.get(call_status, 'en_progreso')
-            llamada.save()
+        if conversacion and call_status:
+            actualizar_estado(conversacion, ESTADOS_WEBHOOK.get(call_status, 'en_progreso'))
         
         twilio_service = TwilioService()
         ai_service = AIService()
         
         # Si hay resultado de voz del usuario
         if speech_result and speech_result.strip():
-            if not llamada:
-                print(f"[WEBHOOK] ERROR: SpeechResult recibido pero no hay llamada asociada")
-                # Intentar encontrar la llamada más reciente
-                try:
-                    llamada = Llamada.objects.filter(estado__in=['iniciada', 'en_progreso']).order_by('-fecha_creacion').first()
-                    if not llamada:
-                        print(f"[WEBHOOK] ERROR: No se encontró ninguna llamada activa")
-                        response = VoiceResponse()
-                        response.say('Lo siento, hubo un error. Por favor, intenta más tarde.', language='es-ES', voice='Polly.Lupe')
-                        response.hangup()
-                        return HttpResponse(str(response), content_type='text/xml')
-                except Exception as e:
-                    print(f"[WEBHOOK] ERROR al buscar llamada: {e}")
-                    response = VoiceResponse()
-                    response.say('Lo siento, hubo un error. Por favor, intenta más tarde.', language='es-ES', voice='Polly.Lupe')
-                    response.hangup()
-                    return HttpResponse(str(response), content_type='text/xml')
-            # Guardar mensaje del usuario
-            MensajeConversacion.objects.create(
-                llamada=llamada,
-                tipo='usuario',
-                contenido=speech_result
-            )
+            if not conversacion:
+                logger.warning("SpeechResult recibido sin llamada asociada")
+                response = VoiceResponse()
+                response.say('Lo siento, hubo un error. Por favor, intenta más tarde.', language='es-ES', voice='Polly.Lupe')
+                response.hangup()
+                return HttpResponse(str(response), content_type='text/xml')
             
-            # Obtener historial de conversación (excluyendo el mensaje actual que acabamos de crear)
-            mensajes_previos = MensajeConversacion.objects.filter(llamada=llamada).exclude(
-                tipo='usuario', contenido=speech_result
-            ).order_by('timestamp')
-            historial = []
-            for msg in mensajes_previos:
-                historial.append({
-                    "role": "user" if msg.tipo == "usuario" else "assistant",
-                    "content": msg.contenido
-                })
-            print(f"[DEBUG] Historial de conversación: {len(historial)} mensajes previos")
+            webhook_url = url_webhook('webhook_llamada')
+            llamada_id, turno = _turno_actual(conversacion)
             
-            # Obtener respuesta de la IA
-            print(f"[DEBUG] Obteniendo respuesta de IA para: {speech_result}")
-            respuesta_ia = ai_service.obtener_respuesta(speech_result, historial)
-            print(f"[DEBUG] Respuesta de IA: {respuesta_ia}")
+            # Turno de otra llamada, repetido o viejo (reintento de Twilio): no se procesa
+            motivo = _turno_invalido(conversacion, turno_firmado)
+            if motivo:
+                logger.info("Turno rechazado", extra={'motivo': motivo, 'turno_token': turno_firmado.turno})
+                twiml = _twiml_turno_rechazado(twilio_service, conversacion, webhook_url, motivo)
+                return HttpResponse(twiml, content_type='text/xml')
             
-            # Guardar respuesta de la IA
-            MensajeConversacion.objects.create(
-                llamada=llamada,
-                tipo='ia',
-                contenido=respuesta_ia
-            )
+            if settings.RELLENO_ACTIVO:
+                # El turno corre en segundo plano; si no termina a tiempo se
+                # responde con relleno y un <Redirect> (ver diferidas.py)
+                clave = diferidas.iniciar(_responder_turno, conversacion, speech_result, ai_service)
+                listo, respuesta_ia = diferidas.esperar(clave)
+                if not listo:
+                    logger.info("La IA está demorando, se envía relleno", extra={'clave': clave})
+                    token = twilio_service.token_turno(llamada_id, turno + 1)
+                    twiml = twilio_service.generar_twiml_espera(_url_resultado(clave, 1, token))
+                    return HttpResponse(twiml, content_type='text/xml')
+                if respuesta_ia is None:
+                    # El turno falló sin guardarse: la conversación sigue en este turno
+                    twiml = twilio_service.generar_twiml_respuesta(ERROR_TURNO, webhook_url, llamada_id, turno)
+                    return HttpResponse(twiml, content_type='text/xml')
+            else:
+                respuesta_ia = _responder_turno(conversacion, speech_result, ai_service)
             
-            # Generar TwiML con la respuesta
-            webhook_url = f"{settings.BASE_URL}{reverse('llamadas:webhook_llamada')}"
-            twiml = twilio_service.generar_twiml_respuesta(respuesta_ia, webhook_url)
-            print(f"[DEBUG] TwiML generado: {twiml[:200]}...")
+            # Generar TwiML con la respuesta; el Gather lleva el token del turno siguiente
+            twiml = twilio_service.generar_twiml_respuesta(respuesta_ia, webhook_url, llamada_id, turno + 1)
+            logger.debug("TwiML de respuesta generado", extra={'bytes': len(twiml)})
             
             return HttpResponse(twiml, content_type='text/xml')
         
         # Primera llamada - saludo inicial (cuando no hay speech_result aún)
         else:
-            print(f"[DEBUG] Primera llamada - generando TwiML inicial")
-            if not llamada:
-                print(f"[DEBUG] No hay llamada asociada, pero generando TwiML inicial de todas formas")
-            webhook_url = f"{settings.BASE_URL}{reverse('llamadas:webhook_llamada')}"
-            twiml = twilio_service.generar_twiml_inicial(webhook_url)
-            print(f"[DEBUG] TwiML inicial generado: {len(twiml)} caracteres")
-            print(f"[DEBUG] TwiML contiene 'Gather': {'Gather' in twiml}")
-            print(f"[DEBUG] TwiML completo (primeros 500 chars): {twiml[:500]}")
+            if not conversacion:
+                logger.debug("Sin llamada asociada, se genera el TwiML inicial de todas formas")
+            if settings.VOZ_TIEMPO_REAL:
+                # Modo tiempo real: la conversación sigue por el WebSocket de Media Streams
+                stream_url = url_base().replace('https://', 'wss://').replace('http://', 'ws://') + RUTA_MEDIA_STREAM
+                twiml = twilio_service.generar_twiml_stream(stream_url, call_sid)
+                logger.debug("TwiML de Media Stream generado", extra={'stream_url': stream_url})
+                return HttpResponse(twiml, content_type='text/xml; charset=utf-8')
+            webhook_url = url_webhook('webhook_llamada')
+            twiml = twilio_service.generar_twiml_inicial(webhook_url, *_turno_actual(conversacion))
+            logger.debug("TwiML inicial generado", extra={'bytes': len(twiml)})
             
             # Asegurar que el Content-Type sea correcto y agregar charset
             response = HttpResponse(twiml, content_type='text/xml; charset=utf-8')
             response['Content-Type'] = 'text/xml; charset=utf-8'
-            print(f"[DEBUG] Response Content-Type: {response['Content-Type']}")
             return response
     
-    except Exception as e:
+    except Exception:
         # En caso de error, generar TwiML de error
-        import traceback
-        error_trace = traceback.format_exc()
-        print(f"[ERROR] Error en webhook_llamada: {str(e)}")
-        print(f"[ERROR] Traceback: {error_trace}")
+        logger.exception("Error en webhook_llamada")
         
         response = VoiceResponse()
         response.say('Lo siento, hubo un error. Por favor, intenta más tarde.', language='es-ES', voice='Polly.Lupe')
@@ -300,8 +433,156 @@ def webhook_llamada(request):
         return HttpResponse(str(response), content_type='text/xml')
 
 
+@csrf_exempt_async
+@con_contexto_llamada
+@idempotente
+@medir_turno
+async def webhook_llamada_async(request):
+    """
+    Versión asíncrona de webhook_llamada para servir con ASGI (uvicorn).
+    Las consultas usan el ORM async y la respuesta de la IA AsyncOpenAI, así que
+    un solo proceso atiende muchas conversaciones a la vez mientras espera a OpenAI.
+    Se activa con WEBHOOK_ASYNC=True (ver urls.py)
+    """
+    try:
+        call_sid = request.POST.get('CallSid') or request.GET.get('CallSid', '')
+        call_status = request.POST.get('CallStatus') or request.GET.get('CallStatus', '')
+        speech_result = request.POST.get('SpeechResult') or request.GET.get('SpeechResult', '')
+        
+        logger.debug("Evento de llamada (async)", extra={
+            'call_status': call_status, 'speech_caracteres': len(speech_result),
+        })
+        
+        turno_firmado = leer_turno(request.GET.get('t', ''))
+        
+        # Estado de la conversación en el almacén; solo se consulta la BD si no está
+        with medir('conversacion'):
+            conversacion = await sync_to_async(obtener_conversacion, thread_sensitive=False)(call_sid)
+            
+            if conversacion is None:
+                # Obtener la llamada por la clave primaria del token o por CallSid
+                llamada = None
+                if turno_firmado:
+                    llamada = await Llamada.objects.filter(pk=turno_firmado.llamada_id).afirst()
+                    if llamada and call_sid and llamada.sid.startswith(PREFIJO_SID_PROVISIONAL):
+                        llamada = await sync_to_async(adoptar_sid)(llamada.pk, call_sid)
+                elif call_sid:
+                    llamada = await Llamada.objects.filter(sid=call_sid).afirst()
+                
+                if not llamada:
+                    numero_destino = request.POST.get('To', '') or request.GET.get('To', '')
+                    numero_origen = request.POST.get('From', '') or request.GET.get('From', '')
+                    if call_sid or numero_destino:
+                        llamada = await Llamada.objects.acreate(
+                            sid=call_sid or f"TEMP_{request.META.get('REMOTE_ADDR', 'unknown')}",
+                            numero_destino=numero_destino,
+                            numero_origen=numero_origen,
+                            estado='iniciada'
+                        )
+                        await registrar_inicio_async(llamada)
+                        logger.info("Llamada creada desde el webhook", extra={'llamada_id': llamada.pk})
+                
+                if llamada:
+                    conversacion = (
+                        await sync_to_async(obtener_conversacion, thread_sensitive=False)(llamada.sid)
+                        or await sync_to_async(cargar_conversacion)(llamada)
+                    )
+            
+        if conversacion:
+            contexto_llamada(llamada_id=conversacion['llamada_id'], turno=conversacion.get('turno', 0))
+        
+        if conversacion and call_status:
+            await sync_to_async(actualizar_estado)(conversacion, ESTADOS_WEBHOOK.get(call_status, 'en_progreso'))
+        
+        twilio_service = TwilioService()
+        webhook_url = url_webhook('webhook_llamada')
+        
+        if speech_result and speech_result.strip():
+            if not conversacion:
+                response = VoiceResponse()
+                response.say('Lo siento, hubo un error. Por favor, intenta más tarde.', language='es-ES', voice='Polly.Lupe')
+                response.hangup()
+                return HttpResponse(str(response), content_type='text/xml')
+            
+            llamada_id, turno = _turno_actual(conversacion)
+            motivo = _turno_invalido(conversacion, turno_firmado)
+            if motivo:
+                twiml = _twiml_turno_rechazado(twilio_service, conversacion, webhook_url, motivo)
+                return HttpResponse(twiml, content_type='text/xml')
+            
+            if settings.RELLENO_ACTIVO:
+                clave = diferidas.iniciar_async(_responder_turno_async(conversacion, speech_result))
+                listo, respuesta_ia = await diferidas.esperar_async(clave)
+                if not listo:
+                    token = twilio_service.token_turno(llamada_id, turno + 1)
+                    twiml = twilio_service.generar_twiml_espera(_url_resultado(clave, 1, token))
+                    return HttpResponse(twiml, content_type='text/xml')
+                if respuesta_ia is None:
+                    twiml = twilio_service.generar_twiml_respuesta(ERROR_TURNO, webhook_url, llamada_id, turno)
+                    return HttpResponse(twiml, content_type='text/xml')
+            else:
+                respuesta_ia = await _responder_turno_async(conversacion, speech_result)
+            
+            twiml = twilio_service.generar_twiml_respuesta(respuesta_ia, webhook_url, llamada_id, turno + 1)
+            return HttpResponse(twiml, content_type='text/xml')
+        
+        if settings.VOZ_TIEMPO_REAL:
+            stream_url = url_base().replace('https://', 'wss://').replace('http://', 'ws://') + RUTA_MEDIA_STREAM
+            twiml = twilio_service.generar_twiml_stream(stream_url, call_sid)
+        else:
+            twiml = twilio_service.generar_twiml_inicial(webhook_url, *_turno_actual(conversacion))
+        return HttpResponse(twiml, content_type='text/xml; charset=utf-8')
+    
+    except Exception:
+        logger.exception("Error en webhook_llamada_async")
+        response = VoiceResponse()
+        response.say('Lo siento, hubo un error. Por favor, intenta más tarde.', language='es-ES', voice='Polly.Lupe')
+        response.hangup()
+        return HttpResponse(str(response), content_type='text/xml')
+
+
+def _parametros_resultado(request):
+    clave = request.GET.get('clave', '')
+    try:
+        intento = int(request.GET.get('intento', '1'))
+    except ValueError:
+        intento = settings.RELLENO_MAX_ESPERAS
+    return clave, intento, leer_turno(request.GET.get('t', ''))
+
+
+@csrf_exempt
+@con_contexto_llamada
+def webhook_resultado(request):
+    """
+    Destino del <Redirect> de relleno: devuelve la respuesta de un turno
+    diferido o, si todavía no está, más relleno (ver diferidas.py)
+    """
+    clave, intento, turno_firmado = _parametros_resultado(request)
+    listo, respuesta_ia = diferidas.esperar(clave) if clave else (False, None)
+    if clave and not listo and intento >= settings.RELLENO_MAX_ESPERAS:
+        # Última espera: la respuesta se descarta salvo que ya se esté guardando
+        listo, respuesta_ia = diferidas.abandonar(clave)
+    twiml = _twiml_resultado(TwilioService(), clave, intento, listo, respuesta_ia, turno_firmado)
+    return HttpResponse(twiml, content_type='text/xml')
+
+
+@csrf_exempt_async
+@con_contexto_llamada
+async def webhook_resultado_async(request):
+    """
+    Versión asíncrona de webhook_resultado (no ocupa un hilo mientras espera)
+    """
+    clave, intento, turno_firmado = _parametros_resultado(request)
+    listo, respuesta_ia = await diferidas.esperar_async(clave) if clave else (False, None)
+    if clave and not listo and intento >= settings.RELLENO_MAX_ESPERAS:
+        listo, respuesta_ia = await diferidas.abandonar_async(clave)
+    twiml = _twiml_resultado(TwilioService(), clave, intento, listo, respuesta_ia, turno_firmado)
+    return HttpResponse(twiml, content_type='text/xml')
+
+
 @csrf_exempt
 @require_http_methods(["POST"])
+@con_contexto_llamada
 def webhook_status(request):
     """
     Webhook para actualizar el estado de la llamada cuando finaliza
@@ -310,6 +591,14 @@ def webhook_status(request):
     call_status = request.POST.get('CallStatus', '')
     call_duration = request.POST.get('CallDuration', '0')
     
+    # Eventos intermedios (ringing, answered) de una llamada en curso: sin leer
+    # la fila, por el buffer de escritura diferida (ver estados.py)
+    if call_status in ESTADOS_WEBHOOK and ESTADOS_WEBHOOK[call_status] not in ESTADOS_FINALES:
+        conversacion = obtener_conversacion(call_sid)
+        if conversacion is not None:
+            actualizar_estado(conversacion, ESTADOS_WEBHOOK[call_status])
+            return HttpResponse('OK', status=200)
+    
     try:
         llamada = Llamada.objects.get(sid=call_sid)
         
@@ -324,27 +613,73 @@ def webhook_status(request):
         if call_status in estado_map:
             llamada.estado = estado_map[call_status]
             llamada.duracion = int(call_duration) if call_duration else 0
-        
-        # Generar transcripción completa
-        mensajes = MensajeConversacion.objects.filter(llamada=llamada).order_by('timestamp')
-        transcripcion = "\n".join([f"{msg.get_tipo_display()}: {msg.contenido}" for msg in mensajes])
-        llamada.transcripcion = transcripcion
-        
-        llamada.save()
+            # La transcripción se mantiene al guardar cada turno (ver persistencia.py);
+            # solo se escriben los campos de estado para no pisarla. fecha_fin marca
+            # la llamada ya contada en las estadísticas: no se filtra por estado porque
+            # webhook_llamada puede haber escrito el estado final antes que este callback
+            cambios = {'estado': llamada.estado, 'duracion': llamada.duracion}
+            if Llamada.objects.filter(pk=llamada.pk, fecha_fin__isnull=True).update(
+                fecha_fin=timezone.now(), **cambios
+            ):
+                registrar_fin(llamada, llamada.estado, llamada.duracion)
+            else:
+                Llamada.objects.filter(pk=llamada.pk).update(**cambios)
+            # La llamada terminó: liberar su estado de conversación
+            finalizar_conversacion(call_sid)
+            # Si es de una campaña, cerrar o reprogramar el número
+            registrar_resultado(llamada, call_status)
         
         return HttpResponse('OK', status=200)
     
     except Llamada.DoesNotExist:
+        logger.warning("Callback de estado de una llamada desconocida", extra={'call_status': call_status})
         return HttpResponse('Llamada no encontrada', status=404)
     except Exception as e:
+        logger.exception("Error en webhook_status")
         return HttpResponse(f'Error: {str(e)}', status=500)
 
 
+@require_http_methods(["GET", "HEAD"])
+def audio_frase(request, nombre):
+    """
+    Audio pre-renderizado de una frase fija (ver audio.py). El nombre es un
+    hash del contenido, así que Twilio y los proxies lo pueden cachear sin límite
+    """
+    if not PATRON_NOMBRE.match(nombre):
+        raise Http404
+    ruta = settings.AUDIO_CACHE_DIR / nombre
+    if not ruta.is_file():
+        raise Http404
+    response = FileResponse(ruta.open('rb'))
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+
+def estadisticas(request):
+    """Panel de estadísticas: lee solo los agregados por hora (ver estadisticas.py)"""
+    try:
+        horas = min(max(int(request.GET.get('horas', 24)), 1), 24 * 31)
+    except ValueError:
+        horas = 24
+    return render(request, 'llamadas/estadisticas.html', {
+        'horas': horas,
+        'estadisticas': resumen_estadisticas(horas),
+    })
+
+
+@vista_api
+def metricas(request):
+    """Métricas del proceso en formato de texto de Prometheus (ver metricas.py)"""
+    return HttpResponse(texto_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 def detalle_llamada(request, llamada_id):
     """Vista para ver detalles de una llamada"""
     try:
-        llamada = Llamada.objects.get(id=llamada_id)
-        mensajes = MensajeConversacion.objects.filter(llamada=llamada).order_by('timestamp')
+        llamada = Llamada.objects.select_related('archivo').get(id=llamada_id)
+        # Incluye los mensajes archivados de las llamadas antiguas (ver archivo.py)
+        mensajes = mensajes_llamada(llamada)
+        llamada.transcripcion = transcripcion_llamada(llamada, mensajes)
         return render(request, 'llamadas/detalle.html', {
             'llamada': llamada,
             'mensajes': mensajes
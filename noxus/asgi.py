@@ -3,15 +3,55 @@ ASGI config for noxus project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Además de las peticiones HTTP de Django, enruta el WebSocket de Twilio Media
+Streams (modo de voz en tiempo real, ver llamadas/streaming.py).
+
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 """
 
+import asyncio
+import logging
 import os
 
 from django.core.asgi import get_asgi_application
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'noxus.asgi.application')
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'noxus.settings')
+
+django_application = get_asgi_application()
+
+# Importar después de inicializar Django (necesita las apps cargadas)
+from django.conf import settings  # noqa: E402
+from llamadas.clientes import calentar_clientes_async, cerrar_clientes_async  # noqa: E402
+from llamadas.streaming import MediaStreamHandler, RUTA_MEDIA_STREAM  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+media_stream_application = MediaStreamHandler()
+
+
+async def lifespan(scope, receive, send):
+    """Arranque/parada del worker: precalienta y cierra los clientes HTTP compartidos"""
+    while True:
+        mensaje = await receive()
+        if mensaje['type'] == 'lifespan.startup':
+            if settings.CALENTAR_CLIENTES:
+                # Acotado: un Twilio/OpenAI lento no demora el arranque del worker
+                try:
+                    await asyncio.wait_for(calentar_clientes_async(), settings.HTTP_TIMEOUT_CONEXION * 2)
+                except asyncio.TimeoutError:
+                    logger.warning("El precalentamiento de clientes no terminó a tiempo")
+            await send({'type': 'lifespan.startup.complete'})
+        elif mensaje['type'] == 'lifespan.shutdown':
+            await cerrar_clientes_async()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
 
-application = get_asgi_application()
 
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(scope, receive, send)
+    elif scope['type'] == 'websocket' and scope['path'] == RUTA_MEDIA_STREAM:
+        await media_stream_application(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
@@ -77,26 +77,56 @@ WSGI_APPLICATION = 'noxus.wsgi.application'
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
 # Database configuration
-# Durante desarrollo usamos SQLite, luego migraremos a PostgreSQL en producción
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# SQLite para desarrollo; en producción DB_ENGINE=postgresql y los datos de conexión por entorno
+DB_ENGINE = os.getenv('DB_ENGINE', 'sqlite')
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('DB_NAME', 'noxus_db'),
+            'USER': os.getenv('DB_USER', ''),
+            'PASSWORD': os.getenv('DB_PASSWORD', ''),
+            'HOST': os.getenv('DB_HOST', 'localhost'),
+            'PORT': os.getenv('DB_PORT', '5432'),
+            # Conexiones persistentes: cada worker reutiliza su conexión entre peticiones
+            # en lugar de abrir una nueva (TCP + autenticación) por cada webhook
+            'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '600')),
+            # Verifica la conexión reutilizada antes de usarla (reinicios de la BD o de PgBouncer)
+            'CONN_HEALTH_CHECKS': os.getenv('DB_CONN_HEALTH_CHECKS', 'True') == 'True',
+            # Con PgBouncer en modo transacción los cursores del lado del servidor no sirven
+            'DISABLE_SERVER_SIDE_CURSORS': os.getenv('DB_PGBOUNCER', 'False') == 'True',
+            'OPTIONS': {
+                'connect_timeout': int(os.getenv('DB_CONNECT_TIMEOUT', '5')),
+                'application_name': os.getenv('DB_APPLICATION_NAME', 'noxus'),
+            },
+        }
     }
-}
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv('DB_NAME', BASE_DIR / 'db.sqlite3'),
+        }
+    }
+
 
-# Configuración de PostgreSQL (comentada para desarrollo)
-# Descomentar cuando PostgreSQL esté configurado
-# DATABASES = {
-#     'default': {
-#         'ENGINE': 'django.db.backends.postgresql',
-#         'NAME': 'noxus_db',
-#         'USER': 'admin',
-#         'PASSWORD': 'admin1234',
-#         'HOST': 'localhost',
-#         'PORT': '5432',
-#     }
-# }
+# Cache
+# Con REDIS_URL se usa Redis (compartido entre workers y nodos); si no, memoria local del proceso
+REDIS_URL = os.getenv('REDIS_URL', '')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
 
 
 # Password validation
@@ -137,6 +167,10 @@ STATIC_URL = 'static/'
 STATICFILES_DIRS = [BASE_DIR / 'static']
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
+# Archivos generados (audio pre-renderizado de las frases fijas)
+MEDIA_URL = 'media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -146,11 +180,153 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 TWILIO_ACCOUNT_SID = os.getenv('TWILIO_ACCOUNT_SID', '')
 TWILIO_AUTH_TOKEN = os.getenv('TWILIO_AUTH_TOKEN', '')
 TWILIO_PHONE_NUMBER = os.getenv('TWILIO_PHONE_NUMBER', '')
+# Voz e idioma de los mensajes <Say>
+TWILIO_VOZ = os.getenv('TWILIO_VOZ', 'Polly.Lupe')
+TWILIO_IDIOMA = os.getenv('TWILIO_IDIOMA', 'es-ES')
+# Solo para pruebas: apuntar la API REST de Twilio a un servidor falso local
+TWILIO_API_URL = os.getenv('TWILIO_API_URL', 'https://api.twilio.com')
 
 # OpenAI Configuration
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', '')
 OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-4')
+# Opcional: API compatible con OpenAI en otra URL (p. ej. un stub local para benchmarks)
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL', '')
 
 # Base URL for webhooks (necesario para Twilio)
 BASE_URL = os.getenv('BASE_URL', 'http://localhost:8000')
+# Con BASE_URL local se usa el túnel de ngrok, consultado a su API cada URL_PUBLICA_REFRESCO segundos (ver llamadas/url_publica.py)
+NGROK_API_URL = os.getenv('NGROK_API_URL', 'http://localhost:4040/api/tunnels')
+URL_PUBLICA_REFRESCO = float(os.getenv('URL_PUBLICA_REFRESCO', '30'))
+
+# API JSON de solo lectura y /metrics (llamadas/api.py): exigen "Authorization: Bearer <token>"; vacío = desactivadas (404)
+API_TOKEN = os.getenv('API_TOKEN', '')
+
+
+# Contexto enviado a OpenAI (ver llamadas/contexto.py)
+# Presupuesto de tokens para el historial reciente y tope para el mensaje del usuario
+HISTORIAL_MAX_TOKENS = int(os.getenv('HISTORIAL_MAX_TOKENS', '600'))
+MENSAJE_MAX_TOKENS = int(os.getenv('MENSAJE_MAX_TOKENS', '300'))
+# Resumen acumulativo de lo que queda fuera del presupuesto, generado en segundo plano
+RESUMEN_ACTIVO = os.getenv('RESUMEN_ACTIVO', 'True') == 'True'
+RESUMEN_MAX_TOKENS = int(os.getenv('RESUMEN_MAX_TOKENS', '150'))
+# Mensajes fuera de la ventana que se acumulan antes de pedir un resumen nuevo
+RESUMEN_LOTE = int(os.getenv('RESUMEN_LOTE', '4'))
+RESUMEN_WORKERS = int(os.getenv('RESUMEN_WORKERS', '2'))
+OPENAI_MODEL_RESUMEN = os.getenv('OPENAI_MODEL_RESUMEN', OPENAI_MODEL)
+
+# Registro estructurado (ver llamadas/registro.py): JSON por línea, escrito desde un hilo aparte
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_FORMATO = os.getenv('LOG_FORMATO', 'json')  # 'json' o 'texto'
+# Fracción de llamadas (0-1) cuyos registros DEBUG/INFO se escriben; WARNING y ERROR siempre
+LOG_MUESTREO = float(os.getenv('LOG_MUESTREO', '1.0'))
+# Registros en espera de escribirse; si se llena se descartan en lugar de bloquear
+LOG_COLA_MAX = int(os.getenv('LOG_COLA_MAX', '10000'))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'llamada': {'()': 'llamadas.registro.FiltroLlamada', 'muestreo': LOG_MUESTREO},
+    },
+    'formatters': {
+        'json': {'()': 'llamadas.registro.FormatoJSON'},
+        'texto': {'()': 'llamadas.registro.FormatoTexto'},
+    },
+    'handlers': {
+        'cola': {
+            'class': 'llamadas.registro.ManejadorCola',
+            'max_cola': LOG_COLA_MAX,
+            'formatter': LOG_FORMATO,
+            'filters': ['llamada'],
+        },
+    },
+    'loggers': {
+        'llamadas': {'handlers': ['cola'], 'level': LOG_LEVEL, 'propagate': False},
+    },
+}
 
+# Archivo de conversaciones antiguas (ver llamadas/archivo.py y el comando archivar_conversaciones)
+# Días desde la creación de una llamada terminada hasta compactar sus mensajes
+ARCHIVO_DIAS = int(os.getenv('ARCHIVO_DIAS', '90'))
+# 'gzip' o 'zstd' (requiere el paquete zstandard; sin él se usa gzip)
+ARCHIVO_COMPRESION = os.getenv('ARCHIVO_COMPRESION', 'gzip')
+
+# Métricas de latencia por etapa (ver llamadas/metricas.py), expuestas en /metrics
+# Fracción de turnos (0-1) que se guardan como TiempoTurno para revisarlos en el admin
+METRICAS_MUESTREO_TURNOS = float(os.getenv('METRICAS_MUESTREO_TURNOS', '0.0'))
+# Los turnos que tardan al menos estos segundos se guardan siempre (0 = no)
+METRICAS_TURNO_LENTO = float(os.getenv('METRICAS_TURNO_LENTO', '5.0'))
+
+# Pools de conexiones HTTP hacia Twilio y OpenAI (ver llamadas/clientes.py)
+HTTP_POOL_CONEXIONES = int(os.getenv('HTTP_POOL_CONEXIONES', '50'))
+HTTP_POOL_KEEPALIVE = int(os.getenv('HTTP_POOL_KEEPALIVE', '20'))
+HTTP_TIMEOUT = float(os.getenv('HTTP_TIMEOUT', '15'))
+HTTP_TIMEOUT_CONEXION = float(os.getenv('HTTP_TIMEOUT_CONEXION', '3'))
+# Abrir las conexiones al arrancar cada worker
+CALENTAR_CLIENTES = os.getenv('CALENTAR_CLIENTES', 'True') == 'True'
+
+# Caché de respuestas de la IA para preguntas repetidas (ver llamadas/cache_respuestas.py)
+# Desactivada por defecto: reutiliza respuestas sin ver toda la conversación
+CACHE_RESPUESTAS_ACTIVA = os.getenv('CACHE_RESPUESTAS_ACTIVA', 'False') == 'True'
+CACHE_RESPUESTAS_MAX = int(os.getenv('CACHE_RESPUESTAS_MAX', '10000'))
+CACHE_RESPUESTAS_TTL = int(os.getenv('CACHE_RESPUESTAS_TTL', '3600'))
+# Similitud mínima (0-1) entre trigramas para aceptar una pregunta parecida; 1 = solo
+# coincidencias exactas. Además deben coincidir negaciones, números y fechas
+CACHE_RESPUESTAS_SIMILITUD = float(os.getenv('CACHE_RESPUESTAS_SIMILITUD', '0.92'))
+# Mensajes recientes que forman parte de la clave (0 = ignorar el contexto)
+CACHE_RESPUESTAS_CONTEXTO = int(os.getenv('CACHE_RESPUESTAS_CONTEXTO', '2'))
+
+# Webhook asíncrono (async def + AsyncOpenAI + ORM async), requiere servir con ASGI (uvicorn)
+WEBHOOK_ASYNC = os.getenv('WEBHOOK_ASYNC', 'False') == 'True'
+
+# Relleno mientras la IA responde (ver llamadas/diferidas.py): si la respuesta no llega en
+# RELLENO_ESPERA segundos, el webhook contesta "Un momento, por favor" y un <Redirect>
+RELLENO_ACTIVO = os.getenv('RELLENO_ACTIVO', 'False') == 'True'
+RELLENO_ESPERA = float(os.getenv('RELLENO_ESPERA', '2.5'))
+RELLENO_MAX_ESPERAS = int(os.getenv('RELLENO_MAX_ESPERAS', '4'))
+RELLENO_WORKERS = int(os.getenv('RELLENO_WORKERS', '20'))
+RELLENO_TTL = int(os.getenv('RELLENO_TTL', '120'))
+
+# Reintentos de Twilio del mismo webhook (ver llamadas/idempotencia.py): se procesan una sola vez
+IDEMPOTENCIA_ACTIVA = os.getenv('IDEMPOTENCIA_ACTIVA', 'True') == 'True'
+# Segundos que se guarda el TwiML de cada petición para responder a sus duplicados
+IDEMPOTENCIA_TTL = int(os.getenv('IDEMPOTENCIA_TTL', '60'))
+# Segundos que un duplicado espera a la petición original antes de procesarse por su cuenta
+IDEMPOTENCIA_ESPERA = float(os.getenv('IDEMPOTENCIA_ESPERA', '15'))
+
+# Mensajes de cada turno escritos por un hilo después de responder (ver llamadas/persistencia.py)
+MENSAJES_DIFERIDOS = os.getenv('MENSAJES_DIFERIDOS', 'False') == 'True'
+# Turnos en espera; con la cola llena el request espera lugar y se avisa pasados MENSAJES_ESPERA_COLA segundos
+MENSAJES_COLA_MAX = int(os.getenv('MENSAJES_COLA_MAX', '2000'))
+MENSAJES_ESPERA_COLA = float(os.getenv('MENSAJES_ESPERA_COLA', '0.5'))
+# Turnos como máximo por transacción
+MENSAJES_LOTE = int(os.getenv('MENSAJES_LOTE', '200'))
+# Reintentos (con espera exponencial) de un turno que no se pudo escribir antes de descartarlo
+MENSAJES_REINTENTOS = int(os.getenv('MENSAJES_REINTENTOS', '5'))
+
+# Escritura diferida de los estados intermedios de las llamadas (ver llamadas/estados.py)
+ESTADOS_DIFERIDOS = os.getenv('ESTADOS_DIFERIDOS', 'True') == 'True'
+# Segundos entre escrituras, y llamadas pendientes que fuerzan una escritura antes
+ESTADOS_INTERVALO = float(os.getenv('ESTADOS_INTERVALO', '1.0'))
+ESTADOS_LOTE = int(os.getenv('ESTADOS_LOTE', '500'))
+
+# Estado de las conversaciones en curso (ver llamadas/conversaciones.py)
+# AlmacenCache: caché de Django, compartida entre workers con REDIS_URL.
+# AlmacenLRU: memoria del proceso, solo para un único worker
+CONVERSACION_ALMACEN = os.getenv('CONVERSACION_ALMACEN', 'llamadas.conversaciones.AlmacenCache')
+CONVERSACION_LRU_MAX = int(os.getenv('CONVERSACION_LRU_MAX', '5000'))
+CONVERSACION_CACHE_ALIAS = os.getenv('CONVERSACION_CACHE_ALIAS', 'default')
+CONVERSACION_TTL = int(os.getenv('CONVERSACION_TTL', '7200'))
+
+# Modo de voz en tiempo real (Twilio Media Streams por WebSocket, requiere servir con ASGI)
+VOZ_TIEMPO_REAL = os.getenv('VOZ_TIEMPO_REAL', 'False') == 'True'
+MEDIA_STREAM_TRANSCRIPTOR = os.getenv('MEDIA_STREAM_TRANSCRIPTOR', '')
+MEDIA_STREAM_SINTETIZADOR = os.getenv('MEDIA_STREAM_SINTETIZADOR', '')
+
+# Audio pre-renderizado para las frases fijas (<Play> en lugar de <Say>, ver llamadas/audio.py)
+# Vacío = desactivado. Para pruebas: llamadas.audio.TTSArchivoLocal
+AUDIO_TTS_BACKEND = os.getenv('AUDIO_TTS_BACKEND', '')
+AUDIO_CACHE_DIR = MEDIA_ROOT / 'audio'
+# URL pública de AUDIO_CACHE_DIR terminada en "/" (CDN o servidor web). Vacía = la vista
+# audio_frase, con la URL pública de los webhooks de cada petición
+AUDIO_CACHE_URL = os.getenv('AUDIO_CACHE_URL', '')
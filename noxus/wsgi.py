@@ -11,7 +11,16 @@ import os
 
 from django.core.wsgi import get_wsgi_application
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'noxus.wsgi.application')
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'noxus.settings')
 
 application = get_wsgi_application()
 
+# Precalentar las conexiones de Twilio/OpenAI de este worker (ver llamadas/clientes.py)
+# en un hilo aparte: importar este módulo no espera a la red
+from django.conf import settings  # noqa: E402
+
+if settings.CALENTAR_CLIENTES:
+    from llamadas.clientes import calentar_en_segundo_plano
+
+    calentar_en_segundo_plano()
+